@@ -0,0 +1,107 @@
+import os
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# Orçamento de tokens do contexto alargado dos motores v2, v4 e v5.
+MAX_TOKENS_CONTEXTO = int(os.getenv("CONTEXTO_MOTORES_MAX_TOKENS", "16000"))
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa barata de tokens (~4 caracteres por token), suficiente para orçamentos de contexto."""
+    return len(texto) // 4 + 1
+
+class IndiceArtigos:
+    """
+    Índice (origem, Artigo) -> intervalos contíguos [início, fim) de `original_index`.
+    Como os chunks de um arquivo são gravados em ordem, um artigo é quase sempre um
+    único intervalo; cabeçalhos repetidos (ex.: anexos) geram intervalos adicionais.
+    """
+
+    def __init__(self, intervalos: Dict[str, Dict[str, List[List[int]]]]):
+        self._intervalos = intervalos
+
+    @staticmethod
+    def construir(chunks: Sequence[Document]) -> "IndiceArtigos":
+        intervalos = {}
+        for i, doc in enumerate(chunks):
+            origem, artigo = doc.metadata.get("origem"), doc.metadata.get("Artigo")
+            if not (origem and artigo): continue
+            lista = intervalos.setdefault(origem, {}).setdefault(artigo, [])
+            if lista and lista[-1][1] == i:
+                lista[-1][1] = i + 1
+            else:
+                lista.append([i, i + 1])
+        return IndiceArtigos(intervalos)
+
+    def salvar(self, caminho: str):
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(self._intervalos, f, ensure_ascii=False)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> "IndiceArtigos":
+        if not os.path.exists(caminho):
+            return cls({})
+        with open(caminho, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def intervalos(self, origem: str, artigo: str) -> List[Tuple[int, int]]:
+        return [tuple(par) for par in self._intervalos.get(origem, {}).get(artigo, [])]
+
+def chunks_do_artigo(chunk: Document, ordered_chunks: Sequence[Document]) -> List[Document]:
+    """Todos os chunks do mesmo artigo, na mesma norma de origem, em ordem de documento."""
+    origem, artigo = chunk.metadata.get("origem"), chunk.metadata.get("Artigo")
+    indice_artigos = getattr(ordered_chunks, "indice_artigos", None)
+    if not (origem and artigo and indice_artigos):
+        return []
+    docs = []
+    for inicio, fim in indice_artigos.intervalos(origem, artigo):
+        docs.extend(ordered_chunks[inicio:fim])
+    return docs
+
+def vizinhos(chunk: Document, ordered_chunks: Sequence[Document], janela: int = 1) -> List[Document]:
+    """O chunk e até `janela` vizinhos de cada lado, sem atravessar para outra norma de origem."""
+    indice = chunk.metadata.get("original_index")
+    if indice is None:
+        return []
+    origem = chunk.metadata.get("origem")
+    inicio, fim = max(0, indice - janela), min(len(ordered_chunks), indice + janela + 1)
+    if hasattr(ordered_chunks, "metadado"):
+        posicoes = [i for i in range(inicio, fim) if ordered_chunks.metadado(i, "origem") == origem]
+        return [ordered_chunks[i] for i in posicoes]
+    return [doc for doc in ordered_chunks[inicio:fim] if doc.metadata.get("origem") == origem]
+
+class ColetorDeContexto:
+    """
+    Acumula os documentos do contexto final, sem duplicatas (por `original_index`,
+    ou pelo texto quando não houver índice) e respeitando um orçamento de tokens.
+    """
+
+    def __init__(self, orcamento_tokens: Optional[int] = None):
+        self.orcamento_tokens = orcamento_tokens
+        self.tokens_usados = 0
+        self._documentos: Dict[Any, Document] = {}
+
+    @staticmethod
+    def _chave(doc: Document) -> Any:
+        indice = doc.metadata.get("original_index")
+        return ("indice", indice) if indice is not None else ("texto", doc.page_content)
+
+    def contem(self, doc: Document) -> bool:
+        return self._chave(doc) in self._documentos
+
+    def adicionar(self, docs: Iterable[Document]) -> bool:
+        """Adiciona os documentos em ordem. Retorna False se o orçamento se esgotou."""
+        for doc in docs:
+            chave = self._chave(doc)
+            if chave in self._documentos: continue
+            tokens = estimar_tokens(doc.page_content)
+            if self.orcamento_tokens is not None and self.tokens_usados + tokens > self.orcamento_tokens:
+                return False
+            self._documentos[chave] = doc
+            self.tokens_usados += tokens
+        return True
+
+    @property
+    def documentos(self) -> List[Document]:
+        return list(self._documentos.values())
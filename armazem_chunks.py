@@ -0,0 +1,144 @@
+import os
+import json
+import mmap
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+
+from alargamento_contexto import IndiceArtigos
+from artefatos_versionados import gravacao_versionada, resolver_versao
+
+AUSENTE = -1  # código de coluna para chunks que não têm aquele metadado
+
+def cabecalho_do_chunk(metadata: Dict[str, Any]) -> str:
+    """Cabeçalho de norma/artigo/parágrafo usado na indexação vetorial."""
+    artigo = metadata.get("Artigo", "").replace("#", "").strip()
+    paragrafo = metadata.get("Paragrafo", "").replace("#", "").strip()
+
+    context_header = f"[Norma: {metadata.get('tipo_norma', 'N/A').title()} {metadata.get('numero_norma', 'N/A')}"
+    if artigo:
+        context_header += f" | {artigo}"
+    if paragrafo:
+        context_header += f" | {paragrafo}"
+    context_header += "]\n"
+    return context_header
+
+def montar_texto_com_cabecalho(doc: Document) -> str:
+    """Prefixa o chunk com o cabeçalho de norma/artigo/parágrafo usado na indexação vetorial."""
+    return cabecalho_do_chunk(doc.metadata) + doc.page_content
+
+def separar_cabecalho(doc: Document) -> Tuple[str, str]:
+    """(cabeçalho, texto original) de um chunk montado por `montar_texto_com_cabecalho`; ("", texto) nos demais."""
+    cabecalho = cabecalho_do_chunk(doc.metadata)
+    if doc.page_content.startswith(cabecalho):
+        return cabecalho, doc.page_content[len(cabecalho):]
+    return "", doc.page_content
+
+class ArmazemDeChunks(Sequence):
+    """
+    Armazém colunar dos chunks ordenados, endereçado por `original_index`.
+
+    Os textos ficam em um único blob UTF-8 com um vetor de offsets, e cada chave de
+    metadado vira uma coluna de códigos int32 sobre um dicionário de valores distintos.
+    Tudo é mapeado em memória na carga; `Document`s só são criados quando um chunk é
+    acessado, então os processos compartilham uma única cópia do corpus pelo page cache.
+    O índice de artigos (origem, Artigo) -> intervalos é gravado e carregado junto.
+    """
+
+    def __init__(self, blob, offsets: np.ndarray, colunas: Dict[str, np.ndarray], valores: Dict[str, List[Any]],
+                 indice_artigos: Optional[IndiceArtigos] = None):
+        self._blob = blob
+        self._offsets = offsets
+        self._colunas = colunas
+        self._valores = valores
+        self._codigo_por_valor = {}
+        self.indice_artigos = indice_artigos
+
+    @staticmethod
+    def salvar(chunks: List[Document], caminho: str):
+        """Grava uma nova versão do armazém em `caminho` (veja artefatos_versionados)."""
+        with gravacao_versionada(caminho) as destino:
+            ArmazemDeChunks._gravar(chunks, destino)
+
+    @staticmethod
+    def _gravar(chunks: List[Document], caminho: str):
+        textos = [doc.page_content.encode("utf-8") for doc in chunks]
+        offsets = np.zeros(len(textos) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in textos], out=offsets[1:])
+        with open(os.path.join(caminho, "textos.bin"), "wb") as f:
+            f.write(b"".join(textos))
+        np.save(os.path.join(caminho, "textos_offsets.npy"), offsets)
+
+        chaves = sorted({k for doc in chunks for k in doc.metadata if k != "original_index"})
+        esquema = {}
+        for n, chave in enumerate(chaves):
+            dicionario = {}
+            codigos = np.full(len(chunks), AUSENTE, dtype=np.int32)
+            for i, doc in enumerate(chunks):
+                if chave in doc.metadata:
+                    valor = doc.metadata[chave]
+                    codigos[i] = dicionario.setdefault(json.dumps(valor, ensure_ascii=False, sort_keys=True), len(dicionario))
+            arquivo = f"coluna_{n}.npy"
+            np.save(os.path.join(caminho, arquivo), codigos)
+            esquema[chave] = {"arquivo": arquivo, "valores": [json.loads(v) for v in dicionario]}
+        with open(os.path.join(caminho, "colunas.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_chunks": len(chunks), "colunas": esquema}, f, ensure_ascii=False)
+        IndiceArtigos.construir(chunks).salvar(os.path.join(caminho, "artigos.json"))
+
+    @classmethod
+    def carregar(cls, caminho: str) -> "ArmazemDeChunks":
+        caminho = resolver_versao(caminho)
+        with open(os.path.join(caminho, "colunas.json"), "r", encoding="utf-8") as f:
+            esquema = json.load(f)["colunas"]
+        with open(os.path.join(caminho, "textos.bin"), "rb") as f:
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b""
+        offsets = np.load(os.path.join(caminho, "textos_offsets.npy"), mmap_mode="r")
+        colunas = {chave: np.load(os.path.join(caminho, info["arquivo"]), mmap_mode="r") for chave, info in esquema.items()}
+        valores = {chave: info["valores"] for chave, info in esquema.items()}
+        return cls(blob, offsets, colunas, valores, IndiceArtigos.carregar(os.path.join(caminho, "artigos.json")))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def texto(self, i: int) -> str:
+        return bytes(self._blob[int(self._offsets[i]):int(self._offsets[i + 1])]).decode("utf-8")
+
+    def metadado(self, i: int, chave: str, padrao: Any = None) -> Any:
+        coluna = self._colunas.get(chave)
+        if coluna is None or coluna[i] == AUSENTE:
+            return padrao
+        return self._valores[chave][coluna[i]]
+
+    def metadados(self, i: int) -> Dict[str, Any]:
+        meta = {chave: self._valores[chave][coluna[i]] for chave, coluna in self._colunas.items() if coluna[i] != AUSENTE}
+        meta["original_index"] = int(i)
+        return meta
+
+    def codigos(self, chave: str) -> np.ndarray:
+        """Coluna de códigos de um metadado, para filtros vetorizados."""
+        return self._colunas[chave]
+
+    def valores(self, chave: str) -> List[Any]:
+        """Dicionário de valores distintos de um metadado (indexado pelos códigos)."""
+        return self._valores[chave]
+
+    def ids_com_valor(self, chave: str, valores: Sequence[Any]) -> np.ndarray:
+        """Ids (em ordem de documento) dos chunks cujo metadado `chave` está em `valores`."""
+        if chave not in self._colunas:
+            return np.empty(0, dtype=np.int64)
+        if chave not in self._codigo_por_valor:
+            self._codigo_por_valor[chave] = {v: c for c, v in enumerate(self._valores[chave]) if isinstance(v, (str, int, float, bool))}
+        codigos = [self._codigo_por_valor[chave][v] for v in valores if v in self._codigo_por_valor[chave]]
+        if not codigos:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(np.isin(self._colunas[chave], codigos))
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Document, List[Document]]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Chunk {i} fora do intervalo (0..{len(self) - 1}).")
+        return Document(page_content=self.texto(i), metadata=self.metadados(i))
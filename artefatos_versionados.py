@@ -0,0 +1,55 @@
+import os
+import time
+import uuid
+import shutil
+from contextlib import contextmanager
+from typing import Iterator
+
+# Os apps mantêm os artefatos mapeados em memória pelo processo inteiro (st.cache_resource).
+# Regravar um arquivo mapeado o trunca (no Linux, "Bus error" em quem o lê; no Windows a
+# escrita falha). Por isso cada construção grava uma versão nova em `<caminho>/<versão>/` e
+# só então troca o ponteiro `<caminho>/ATUAL` com os.replace (atômico): quem já carregou
+# continua na versão anterior e a próxima carga pega a nova.
+ARQUIVO_PONTEIRO = "ATUAL"
+PREFIXO_VERSAO = "v_"
+MANTER_VERSOES = max(1, int(os.getenv("ARTEFATOS_MANTER_VERSOES", "3")))
+
+def resolver_versao(caminho: str) -> str:
+    """Pasta da versão publicada do artefato (o próprio `caminho` no formato antigo, sem ponteiro)."""
+    ponteiro = os.path.join(caminho, ARQUIVO_PONTEIRO)
+    if not os.path.exists(ponteiro):
+        return caminho
+    with open(ponteiro, "r", encoding="utf-8") as f:
+        return os.path.join(caminho, f.read().strip())
+
+@contextmanager
+def gravacao_versionada(caminho: str) -> Iterator[str]:
+    """
+    Pasta nova e vazia para gravar uma versão do artefato. Ao sair sem erro ela é publicada
+    (troca do ponteiro) e só as MANTER_VERSOES versões mais recentes ficam no disco.
+    """
+    agora = time.time_ns()
+    versao = f"{PREFIXO_VERSAO}{time.strftime('%Y%m%d_%H%M%S', time.localtime(agora // 10**9))}_{agora % 10**9:09d}_{uuid.uuid4().hex[:6]}"
+    destino = os.path.join(caminho, versao)
+    os.makedirs(destino)
+    try:
+        yield destino
+    except BaseException:
+        shutil.rmtree(destino, ignore_errors=True)
+        raise
+    temporario = os.path.join(caminho, f"{ARQUIVO_PONTEIRO}.{versao}.tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write(versao)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, os.path.join(caminho, ARQUIVO_PONTEIRO))
+    _remover_versoes_antigas(caminho, versao)
+
+def _remover_versoes_antigas(caminho: str, atual: str):
+    # O nome começa pelo horário da gravação (até o nanossegundo), então a ordem alfabética é a cronológica.
+    versoes = sorted(nome for nome in os.listdir(caminho)
+                     if nome.startswith(PREFIXO_VERSAO) and nome != atual and os.path.isdir(os.path.join(caminho, nome)))
+    for nome in versoes[:len(versoes) - (MANTER_VERSOES - 1)]:
+        # No Linux um arquivo ainda mapeado continua válido para quem o mapeou depois de
+        # removido; no Windows a remoção falha e fica para a próxima construção.
+        shutil.rmtree(os.path.join(caminho, nome), ignore_errors=True)
@@ -0,0 +1,162 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from vectorstore_faiss import (ajustar_parametros_busca, carregar_vetores, construir_indice, encurtar_vetores,
+                               busca_dois_estagios, DIMENSAO_GROSSA)
+from classificador_intencao import perguntas_registradas
+
+TIPOS_AVALIADOS = ("flat", "sq16", "sq8", "pq", "hnsw", "ivf")
+
+def separar_consultas(vetores: np.ndarray, n_consultas: int, semente: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Separa `n_consultas` vetores do corpus para servirem de consulta e os tira da base
+    indexada. Uma consulta que também está no índice tem o próprio vetor como vizinho
+    exato e qualquer tipo de índice o encontra, o que infla o recall.
+    """
+    rng = np.random.default_rng(semente)
+    n_consultas = min(n_consultas, len(vetores) - 1)
+    separados = np.zeros(len(vetores), dtype=bool)
+    separados[rng.choice(len(vetores), size=n_consultas, replace=False)] = True
+    return np.ascontiguousarray(vetores[~separados], dtype=np.float32), np.ascontiguousarray(vetores[separados], dtype=np.float32)
+
+def consultas_registradas(embeddings: Any, n_consultas: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    Embeddings (normalizados) das perguntas reais gravadas pelo feedback dos apps, ou None
+    se não houver nenhuma. Com o EmbeddingsComCache, as perguntas já vistas não voltam à API.
+    """
+    perguntas = perguntas_registradas()[:n_consultas]
+    if not perguntas:
+        return None
+    consultas = np.array(embeddings.embed_documents(perguntas), dtype=np.float32)
+    faiss.normalize_L2(consultas)
+    return consultas
+
+def recall_em_k(ids: np.ndarray, ids_referencia: np.ndarray) -> float:
+    """Fração média dos k vizinhos exatos que aparecem entre os k devolvidos."""
+    acertos = [len(set(linha[linha >= 0]) & set(referencia)) / len(referencia) for linha, referencia in zip(ids, ids_referencia)]
+    return float(np.mean(acertos))
+
+def avaliar_tipos(vetores: np.ndarray, consultas: np.ndarray, k: int = 10, tipos: Sequence[str] = TIPOS_AVALIADOS) -> List[Dict]:
+    """
+    Constrói cada tipo de índice em memória e mede recall@k contra a busca exata (Flat),
+    latência média por consulta (uma consulta por vez, como no chatbot) e memória do
+    índice serializado.
+    """
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    referencia, _ = construir_indice(vetores, "flat")
+    _, ids_referencia = referencia.search(consultas, k)
+
+    resultados = []
+    for tipo in tipos:
+        inicio = time.perf_counter()
+        index, fabrica = construir_indice(vetores, tipo)
+        tempo_construcao = time.perf_counter() - inicio
+        ajustar_parametros_busca(index)
+
+        ids = np.empty((len(consultas), k), dtype=np.int64)
+        inicio = time.perf_counter()
+        for i, consulta in enumerate(consultas):
+            ids[i] = index.search(consulta[None, :], k)[1][0]
+        latencia_ms = (time.perf_counter() - inicio) / len(consultas) * 1000
+
+        resultados.append({
+            "tipo": tipo,
+            "fabrica": fabrica,
+            f"recall@{k}": recall_em_k(ids, ids_referencia),
+            "latencia_ms": latencia_ms,
+            "memoria_mb": len(faiss.serialize_index(index)) / 2**20,
+            "construcao_s": tempo_construcao,
+        })
+    return resultados
+
+def avaliar_dois_estagios(vetores: np.ndarray, consultas: np.ndarray, k: int = 10, tipo: str = "flat",
+                          dimensao_grossa: int = DIMENSAO_GROSSA) -> Dict:
+    """
+    Mesma medição para a busca em dois estágios (Matryoshka) do FAISSPreFiltrado: índice
+    grosso do `tipo` pedido com os vetores encurtados e re-pontuação exata dos candidatos.
+    A memória informada é a do índice grosso, o único percorrido a cada busca.
+    """
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    referencia, _ = construir_indice(vetores, "flat")
+    _, ids_referencia = referencia.search(consultas, k)
+
+    inicio = time.perf_counter()
+    indice_grosso, fabrica = construir_indice(encurtar_vetores(vetores, dimensao_grossa), tipo)
+    ajustar_parametros_busca(indice_grosso)
+    tempo_construcao = time.perf_counter() - inicio
+
+    ids = np.full((len(consultas), k), -1, dtype=np.int64)
+    inicio = time.perf_counter()
+    for i, consulta in enumerate(consultas):
+        encontrados = busca_dois_estagios(consulta[None, :], k, indice_grosso, vetores)[0]
+        ids[i, :len(encontrados)] = encontrados
+    latencia_ms = (time.perf_counter() - inicio) / len(consultas) * 1000
+
+    return {
+        "tipo": f"{tipo}@{dimensao_grossa}",
+        "fabrica": f"{fabrica}+exata",
+        f"recall@{k}": recall_em_k(ids, ids_referencia),
+        "latencia_ms": latencia_ms,
+        "memoria_mb": len(faiss.serialize_index(indice_grosso)) / 2**20,
+        "construcao_s": tempo_construcao,
+    }
+
+def imprimir_tabela(resultados: List[Dict], k: int):
+    print(f"\n{'tipo':<9} {'fábrica':<18} {f'recall@{k}':>10} {'ms/consulta':>12} {'memória (MB)':>13} {'construção (s)':>15}")
+    for r in resultados:
+        print(f"{r['tipo']:<9} {r['fabrica']:<18} {r[f'recall@{k}']:>10.3f} {r['latencia_ms']:>12.3f} {r['memoria_mb']:>13.2f} {r['construcao_s']:>15.2f}")
+
+def executar_benchmark(faiss_path: str = "faiss_index_limpo", n_consultas: int = 200, k: int = 10,
+                       tipos: Sequence[str] = TIPOS_AVALIADOS, vetores: Optional[np.ndarray] = None,
+                       consultas: Optional[np.ndarray] = None) -> List[Dict]:
+    """
+    Benchmark dos tipos de índice sobre os vetores (`vetores.npy`) gravados pelo build_index_v4,
+    mais a busca em dois estágios de cada tipo, com FAISS_DIMENSAO_GROSSA dimensões e
+    FAISS_FATOR_CANDIDATOS * k (no mínimo FAISS_MIN_CANDIDATOS) candidatos.
+
+    As consultas são os embeddings normalizados de perguntas reais (`consultas`, veja
+    `consultas_registradas`) sobre o corpus inteiro; sem elas, `n_consultas` vetores do
+    corpus ficam fora do índice e servem de consulta (`separar_consultas`).
+    """
+    if vetores is None:
+        vetores = carregar_vetores(faiss_path)
+        if vetores is None:
+            raise FileNotFoundError(f"'{faiss_path}' não tem vetores.npy. Reconstrua os índices com o build_index_v4.")
+        vetores = np.array(vetores)
+    else:
+        # o índice do chatbot guarda vetores normalizados (produto interno); o mesmo vale aqui
+        vetores = np.array(vetores, dtype=np.float32)
+        faiss.normalize_L2(vetores)
+    if consultas is None:
+        vetores, consultas = separar_consultas(vetores, n_consultas)
+        origem = "vetores do corpus fora do índice"
+    else:
+        consultas = np.ascontiguousarray(consultas, dtype=np.float32)
+        origem = "perguntas registradas"
+    print(f"📊 Avaliando {len(tipos)} tipos de índice com {len(vetores)} vetores de {vetores.shape[1]} dimensões e {len(consultas)} consultas ({origem}).")
+    resultados = avaliar_tipos(vetores, consultas, k, tipos)
+    if 0 < DIMENSAO_GROSSA < vetores.shape[1]:
+        resultados.extend(avaliar_dois_estagios(vetores, consultas, k, tipo) for tipo in tipos)
+    imprimir_tabela(resultados, k)
+    return resultados
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    consultas = None
+    if os.getenv("OPENAI_API_KEY"):
+        from cache_embeddings import EmbeddingsComCache
+        from clientes_llm import obter_embeddings_openai
+        consultas = consultas_registradas(EmbeddingsComCache(obter_embeddings_openai("text-embedding-3-large")), n_consultas=200)
+    if consultas is None:
+        print("⚠️ Aviso: sem perguntas registradas (ou sem OPENAI_API_KEY); usando vetores do corpus fora do índice como consultas.")
+    executar_benchmark(
+        faiss_path=os.getenv("FAISS_INDEX_PATH", "faiss_index_limpo"),
+        n_consultas=200,
+        k=10,
+        consultas=consultas,
+    )
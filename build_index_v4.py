@@ -1,112 +1,286 @@
-import os
-import pickle
-import re
-from pathlib import Path
-from dotenv import load_dotenv
-
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.retrievers import BM25Retriever
-
-load_dotenv()
-API_KEY = os.getenv("OPENAI_API_KEY")
-
-DATA_FOLDER = Path(r"C:\Users\joao.beneton\Downloads\New project\data - Copia")
-
-def extract_metadata_from_filename(file: Path):
-    """Extrai metadados do nome do arquivo de forma robusta."""
-    name = file.stem
-    name_lower = name.lower()
-    meta = {}
-    patterns = {
-        "resolucao": r"^(?:res_|resolucao_?)(\d+)",
-        "carta circular": r"^(?:carta_circular_|c[_\s]?circ[_\s]?|circ[_\s]?)(\d+)",
-        "circular": r"^(?:circular_|circ[_\s]?)(\d+)", 
-        "instrucao": r"^(?:dlo_|instrucao_?)(\d+)",
-        "norma": r"^norma[_\s]?(\d+)",
-        "instrumento": r"^(?:instrumento_|intrumento_?)(\d+)",
-        "voto": r"^(?:Voto_|VOTO_?)(\d+)",
-        "contexto":r"^(?:contexto_?)(\d+)",
-    }
-    for norma_type, pattern in patterns.items():
-        m = re.match(pattern, name_lower)
-        if m:
-            meta["tipo_norma"] = norma_type
-            meta["numero_norma"] = m.group(1)
-            return meta
-    print(f"⚠️  Aviso: O arquivo '{file.name}' não corresponde a nenhum padrão de metadados e será ignorado.")
-    return {}
-
-def build_and_save_indexes(faiss_path: str, bm25_path: str, ordered_chunks_path: str):
-    """Constrói e salva todos os índices necessários para o chatbot."""
-    recursive_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150, separators=["\n\n", "\n", ". ", " ", ""])
-    
-    headers_to_split_on = [("#", "Titulo"), ("##", "Artigo"), ("###", "Paragrafo")]
-    markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on, strip_headers=False)
-
-    all_docs = []
-    for file_path in DATA_FOLDER.rglob("*"):
-        suf = file_path.suffix.lower()
-        if not (suf in [".pdf", ".md", ".markdown"]): continue
-
-        print(f"📄 Processando arquivo: {file_path.name}")
-        file_meta = extract_metadata_from_filename(file_path)
-        if not file_meta: continue
-
-        file_meta["formato"] = suf.strip(".")
-        file_meta["origem"] = file_path.name
-        
-        if suf == ".pdf":
-            docs = PyMuPDFLoader(str(file_path)).load()
-            chunks = recursive_splitter.split_documents(docs)
-        elif suf in (".md", ".markdown"):
-            raw_text = file_path.read_text(encoding="utf-8")
-            chunks = markdown_splitter.split_text(raw_text)
-        
-        for chunk in chunks: chunk.metadata.update(file_meta)
-        all_docs.extend(chunks)
-    
-    chunks_filtrados = [doc for doc in all_docs if len(doc.page_content.strip()) > 50]
-    print(f"🔍 Chunks totais após filtragem: {len(chunks_filtrados)}")
-    if not chunks_filtrados:
-        raise RuntimeError("Nenhum documento encontrado e processado. Verifique a pasta e os nomes dos arquivos.")
-
-    for i, doc in enumerate(chunks_filtrados):
-        doc.metadata['original_index'] = i
-
-    texts_com_metadata = []
-    metadatas = []
-    for d in chunks_filtrados:
-        artigo = d.metadata.get("Artigo", "").replace("#", "").strip()
-        paragrafo = d.metadata.get("Paragrafo", "").replace("#", "").strip()
-        
-        context_header = f"[Norma: {d.metadata.get('tipo_norma', 'N/A').title()} {d.metadata.get('numero_norma', 'N/A')}"
-        if artigo:
-            context_header += f" | {artigo}"
-        if paragrafo:
-            context_header += f" | {paragrafo}"
-        context_header += "]\n"
-
-        texts_com_metadata.append(context_header + d.page_content)
-        metadatas.append(d.metadata)
-
-    embedder = OpenAIEmbeddings(model="text-embedding-3-large", openai_api_key=API_KEY, chunk_size=256)
-    vectorstore = FAISS.from_texts(texts=texts_com_metadata, embedding=embedder, metadatas=metadatas, normalize_L2=True)
-    vectorstore.save_local(faiss_path)
-    print(f"✅ FAISS reconstruído e salvo em `{faiss_path}`.")
-
-    bm25_retriever = BM25Retriever.from_documents(chunks_filtrados)
-    with open(bm25_path, "wb") as f: pickle.dump(bm25_retriever, f)
-    print(f"✅ BM25 reconstruído e salvo em `{bm25_path}`.")
-
-    with open(ordered_chunks_path, "wb") as f: pickle.dump(chunks_filtrados, f)
-    print(f"✅ Lista ordenada de chunks salva em `{ordered_chunks_path}`.")
-
-if __name__ == "__main__":
-    build_and_save_indexes(
-        faiss_path="faiss_index_limpo",
-        bm25_path="bm25_index_limpo.pkl",
-        ordered_chunks_path="ordered_chunks.pkl"
-    )
\ No newline at end of file
+import os
+import json
+import re
+import hashlib
+import concurrent.futures
+from pathlib import Path
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+import numpy as np
+
+from langchain_community.document_loaders import PyMuPDFLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
+from langchain_core.documents import Document
+
+from cache_embeddings import EmbeddingsComCache
+from clientes_llm import obter_embeddings_openai
+from indice_bm25 import salvar_indice_bm25
+from armazem_chunks import ArmazemDeChunks, montar_texto_com_cabecalho
+from indice_metadados import IndiceMetadados
+from vectorstore_faiss import salvar_indice_faiss, carregar_indice_faiss, carregar_vetores, TIPO_INDICE_PADRAO, DIMENSAO_GROSSA
+
+load_dotenv()
+API_KEY = os.getenv("OPENAI_API_KEY")
+
+DATA_FOLDER = Path(r"C:\Users\joao.beneton\Downloads\New project\data - Copia")
+EXTENSOES_SUPORTADAS = (".pdf", ".md", ".markdown")
+MAX_WORKERS_PARSING = os.cpu_count() or 1
+
+# Qualquer mudança aqui invalida o manifesto e força uma reconstrução completa.
+CONFIG_INDEXACAO = {
+    "embedding_model": "text-embedding-3-large",
+    "chunk_size": 1000,
+    "chunk_overlap": 150,
+    "min_chunk_chars": 50,
+    "versao_cabecalho": 1,
+}
+
+def extract_metadata_from_filename(file: Path):
+    """Extrai metadados do nome do arquivo de forma robusta."""
+    name = file.stem
+    name_lower = name.lower()
+    meta = {}
+    patterns = {
+        "resolucao": r"^(?:res_|resolucao_?)(\d+)",
+        "carta circular": r"^(?:carta_circular_|c[_\s]?circ[_\s]?|circ[_\s]?)(\d+)",
+        "circular": r"^(?:circular_|circ[_\s]?)(\d+)",
+        "instrucao": r"^(?:dlo_|instrucao_?)(\d+)",
+        "norma": r"^norma[_\s]?(\d+)",
+        "instrumento": r"^(?:instrumento_|intrumento_?)(\d+)",
+        "voto": r"^(?:Voto_|VOTO_?)(\d+)",
+        "contexto":r"^(?:contexto_?)(\d+)",
+    }
+    for norma_type, pattern in patterns.items():
+        m = re.match(pattern, name_lower)
+        if m:
+            meta["tipo_norma"] = norma_type
+            meta["numero_norma"] = m.group(1)
+            return meta
+    print(f"⚠️  Aviso: O arquivo '{file.name}' não corresponde a nenhum padrão de metadados e será ignorado.")
+    return {}
+
+def calcular_hash_arquivo(file_path: Path) -> str:
+    """Calcula o SHA-256 do conteúdo do arquivo, lendo em blocos."""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+def listar_arquivos_fonte(data_folder: Path) -> List[Path]:
+    """Lista os arquivos suportados em ordem determinística (caminho relativo)."""
+    arquivos = [p for p in data_folder.rglob("*") if p.is_file() and p.suffix.lower() in EXTENSOES_SUPORTADAS]
+    return sorted(arquivos, key=lambda p: p.relative_to(data_folder).as_posix())
+
+def criar_splitters():
+    recursive_splitter = RecursiveCharacterTextSplitter(chunk_size=CONFIG_INDEXACAO["chunk_size"], chunk_overlap=CONFIG_INDEXACAO["chunk_overlap"], separators=["\n\n", "\n", ". ", " ", ""])
+
+    headers_to_split_on = [("#", "Titulo"), ("##", "Artigo"), ("###", "Paragrafo")]
+    markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on, strip_headers=False)
+    return recursive_splitter, markdown_splitter
+
+def processar_arquivo(file_path: Path, recursive_splitter, markdown_splitter) -> Optional[List[Document]]:
+    """Carrega, divide e anota um único arquivo. Retorna None se o nome não tiver metadados."""
+    suf = file_path.suffix.lower()
+    file_meta = extract_metadata_from_filename(file_path)
+    if not file_meta: return None
+
+    file_meta["formato"] = suf.strip(".")
+    file_meta["origem"] = file_path.name
+
+    if suf == ".pdf":
+        docs = PyMuPDFLoader(str(file_path)).load()
+        chunks = recursive_splitter.split_documents(docs)
+    else:
+        raw_text = file_path.read_text(encoding="utf-8")
+        chunks = markdown_splitter.split_text(raw_text)
+
+    for chunk in chunks: chunk.metadata.update(file_meta)
+    return [doc for doc in chunks if len(doc.page_content.strip()) > CONFIG_INDEXACAO["min_chunk_chars"]]
+
+_SPLITTERS_DO_WORKER = None
+
+def _processar_arquivo_no_worker(file_path: Path) -> Optional[List[Document]]:
+    """Ponto de entrada dos processos do pool: cria os splitters uma vez por processo."""
+    global _SPLITTERS_DO_WORKER
+    if _SPLITTERS_DO_WORKER is None:
+        _SPLITTERS_DO_WORKER = criar_splitters()
+    print(f"📄 Processando arquivo: {file_path.name}")
+    return processar_arquivo(file_path, *_SPLITTERS_DO_WORKER)
+
+def processar_arquivos_em_paralelo(arquivos: List[Path], max_workers: int = MAX_WORKERS_PARSING) -> List[Optional[List[Document]]]:
+    """
+    Faz parsing, extração de metadados e divisão dos arquivos em um pool de processos.
+    O resultado segue a ordem de `arquivos`, independente da ordem de término dos workers.
+    """
+    if not arquivos:
+        return []
+    if max_workers <= 1 or len(arquivos) == 1:
+        return [_processar_arquivo_no_worker(p) for p in arquivos]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(max_workers, len(arquivos))) as executor:
+        return list(executor.map(_processar_arquivo_no_worker, arquivos))
+
+def _versao_config() -> str:
+    return hashlib.sha256(json.dumps(CONFIG_INDEXACAO, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def carregar_manifesto(manifest_path: str) -> Dict:
+    """Lê o manifesto da última construção. Retorna {} se ausente ou de outra configuração."""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        try:
+            manifesto = json.load(f)
+        except json.JSONDecodeError:
+            print(f"⚠️  Aviso: Manifesto '{manifest_path}' corrompido. Será feita uma reconstrução completa.")
+            return {}
+    if manifesto.get("versao_config") != _versao_config():
+        print("ℹ️  Configuração de indexação alterada. Será feita uma reconstrução completa.")
+        return {}
+    return manifesto
+
+def salvar_manifesto(manifest_path: str, arquivos: Dict[str, Dict], tipo_indice: str = TIPO_INDICE_PADRAO,
+                     dimensao_grossa: int = DIMENSAO_GROSSA):
+    # O tipo do índice entra na versão: trocá-lo muda os resultados da busca (e invalida o cache de respostas).
+    conteudo = json.dumps({"arquivos": arquivos, "tipo_indice": tipo_indice, "dimensao_grossa": dimensao_grossa}, sort_keys=True).encode("utf-8")
+    manifesto = {
+        "versao_config": _versao_config(),
+        "versao": hashlib.sha256(conteudo).hexdigest()[:16],
+        "tipo_indice": tipo_indice,
+        "dimensao_grossa": dimensao_grossa,
+        "arquivos": arquivos,
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+
+def _carregar_estado_anterior(faiss_path: str, ordered_chunks_path: str):
+    """Carrega chunks e vetores da construção anterior para reaproveitamento."""
+    if not (os.path.isdir(ordered_chunks_path) and os.path.isdir(faiss_path)):
+        return None, None
+    # Materializa tudo: a versão lida pode ser removida quando as novas forem publicadas.
+    chunks_anteriores = ArmazemDeChunks.carregar(ordered_chunks_path)[:]
+    vetores_anteriores = carregar_vetores(faiss_path)
+    if vetores_anteriores is not None:
+        vetores_anteriores = np.array(vetores_anteriores)
+    else:
+        # Índices antigos (só IndexFlatL2, sem `vetores.npy`): os vetores saem do próprio índice,
+        # construído na ordem de `original_index` (a posição i no FAISS é o chunk i).
+        index = carregar_indice_faiss(faiss_path)
+        vetores_anteriores = index.reconstruct_n(0, index.ntotal)
+    if len(vetores_anteriores) != len(chunks_anteriores):
+        print("⚠️  Aviso: FAISS e armazém de chunks fora de sincronia. Será feita uma reconstrução completa.")
+        return None, None
+    return chunks_anteriores, vetores_anteriores
+
+def build_and_save_indexes(faiss_path: str, bm25_path: str, ordered_chunks_path: str,
+                           manifest_path: str = "manifesto_indices.json", metadata_index_path: str = "indice_metadados",
+                           forcar_reconstrucao: bool = False, tipo_indice: str = TIPO_INDICE_PADRAO,
+                           dimensao_grossa: int = DIMENSAO_GROSSA):
+    """
+    Constrói e salva todos os índices necessários para o chatbot.
+
+    A construção é incremental: um manifesto guarda o hash de cada arquivo de origem e
+    somente arquivos novos ou alterados são reprocessados e re-embeddados. Os chunks e
+    vetores dos arquivos inalterados são reaproveitados da construção anterior e os
+    arquivos removidos saem dos índices.
+
+    `tipo_indice` escolhe a compressão do FAISS (veja `fabrica_do_tipo`); trocá-lo
+    reconstrói o índice a partir dos vetores guardados, sem gerar embeddings de novo.
+    O mesmo vale para `dimensao_grossa`, a dimensão do índice grosso da busca em dois
+    estágios (0 desliga).
+
+    Cada artefato é gravado numa versão nova e publicado por troca atômica de ponteiro
+    (artefatos_versionados), então a reconstrução pode rodar com os apps no ar.
+    """
+    embedder = EmbeddingsComCache(obter_embeddings_openai(CONFIG_INDEXACAO["embedding_model"], API_KEY, chunk_size=256))
+
+    manifesto_anterior = {} if forcar_reconstrucao else carregar_manifesto(manifest_path)
+    chunks_anteriores, vetores_anteriores = None, None
+    if manifesto_anterior:
+        chunks_anteriores, vetores_anteriores = _carregar_estado_anterior(faiss_path, ordered_chunks_path)
+        if chunks_anteriores is None:
+            manifesto_anterior = {}
+    arquivos_anteriores = manifesto_anterior.get("arquivos", {})
+
+    # 1ª passada: decide, pelo hash, o que pode ser reaproveitado.
+    plano = []
+    for file_path in listar_arquivos_fonte(DATA_FOLDER):
+        chave = file_path.relative_to(DATA_FOLDER).as_posix()
+        file_hash = calcular_hash_arquivo(file_path)
+        entrada_anterior = arquivos_anteriores.get(chave)
+        if not (entrada_anterior and entrada_anterior["sha256"] == file_hash):
+            entrada_anterior = None
+        plano.append((file_path, chave, file_hash, entrada_anterior))
+
+    # 2ª passada: processa em paralelo somente os arquivos novos ou alterados.
+    a_processar = [file_path for file_path, _, _, entrada in plano if entrada is None]
+    if a_processar:
+        print(f"⚙️  Processando {len(a_processar)} arquivos com até {MAX_WORKERS_PARSING} processos.")
+    processados = dict(zip(a_processar, processar_arquivos_em_paralelo(a_processar)))
+
+    # 3ª passada: monta a lista final na ordem do plano, o que mantém `original_index` estável.
+    novo_manifesto = {}
+    chunks_filtrados = []
+    vetores_por_chunk = []  # vetor reaproveitado ou None (precisa ser embeddado)
+    reaproveitados, reprocessados = 0, 0
+    for file_path, chave, file_hash, entrada_anterior in plano:
+        if entrada_anterior is not None:
+            inicio, n_chunks = entrada_anterior["inicio"], entrada_anterior["n_chunks"]
+            chunks = chunks_anteriores[inicio:inicio + n_chunks]
+            vetores_por_chunk.extend(vetores_anteriores[inicio:inicio + n_chunks])
+            reaproveitados += 1
+        else:
+            chunks = processados[file_path]
+            if chunks is None: continue
+            vetores_por_chunk.extend([None] * len(chunks))
+            reprocessados += 1
+
+        novo_manifesto[chave] = {"sha256": file_hash, "origem": file_path.name, "inicio": len(chunks_filtrados), "n_chunks": len(chunks)}
+        chunks_filtrados.extend(chunks)
+
+    removidos = sorted(set(arquivos_anteriores) - set(novo_manifesto))
+    for chave in removidos:
+        print(f"🗑️  Arquivo removido do índice: {chave}")
+
+    print(f"🔍 Chunks totais após filtragem: {len(chunks_filtrados)} ({reaproveitados} arquivos reaproveitados, {reprocessados} reprocessados, {len(removidos)} removidos)")
+    if not chunks_filtrados:
+        raise RuntimeError("Nenhum documento encontrado e processado. Verifique a pasta e os nomes dos arquivos.")
+    artefatos_presentes = all(os.path.exists(p) for p in (faiss_path, bm25_path, ordered_chunks_path, metadata_index_path))
+    mesmo_tipo = (manifesto_anterior.get("tipo_indice", "flat") == tipo_indice
+                  and manifesto_anterior.get("dimensao_grossa", 0) == dimensao_grossa)
+    if not mesmo_tipo and manifesto_anterior:
+        print(f"ℹ️  Tipo do índice FAISS alterado para '{tipo_indice}' (índice grosso: {dimensao_grossa or 'desligado'}). O índice será reconstruído com os vetores existentes.")
+    if reprocessados == 0 and not removidos and artefatos_presentes and mesmo_tipo:
+        print("✅ Nenhuma alteração nos arquivos de origem. Índices mantidos.")
+        return
+
+    for i, doc in enumerate(chunks_filtrados):
+        doc.metadata['original_index'] = i
+
+    pendentes = [i for i, vetor in enumerate(vetores_por_chunk) if vetor is None]
+    print(f"🧮 Gerando embeddings para {len(pendentes)} de {len(chunks_filtrados)} chunks.")
+    if pendentes:
+        novos_vetores = embedder.embed_documents([montar_texto_com_cabecalho(chunks_filtrados[i]) for i in pendentes])
+        for i, vetor in zip(pendentes, novos_vetores):
+            vetores_por_chunk[i] = vetor
+
+    fabrica = salvar_indice_faiss(np.asarray(vetores_por_chunk, dtype=np.float32), faiss_path, tipo_indice, dimensao_grossa)
+    print(f"✅ FAISS ({fabrica}) atualizado e salvo em `{faiss_path}`.")
+
+    salvar_indice_bm25(chunks_filtrados, bm25_path)
+    print(f"✅ BM25 atualizado e salvo em `{bm25_path}`.")
+
+    ArmazemDeChunks.salvar(chunks_filtrados, ordered_chunks_path)
+    print(f"✅ Armazém ordenado de chunks salvo em `{ordered_chunks_path}`.")
+
+    IndiceMetadados.construir_e_salvar(chunks_filtrados, metadata_index_path)
+    print(f"✅ Índice de metadados salvo em `{metadata_index_path}`.")
+
+    salvar_manifesto(manifest_path, novo_manifesto, tipo_indice, dimensao_grossa)
+    print(f"✅ Manifesto salvo em `{manifest_path}`.")
+
+if __name__ == "__main__":
+    build_and_save_indexes(
+        faiss_path="faiss_index_limpo",
+        bm25_path="bm25_index_limpo",
+        ordered_chunks_path="chunks_ordenados"
+    )
@@ -0,0 +1,136 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional, Dict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+CAMINHO_CACHE_EMBEDDINGS = os.getenv("EMBEDDINGS_CACHE_PATH", "cache_embeddings.sqlite")
+MAX_ENTRADAS_CACHE = int(os.getenv("EMBEDDINGS_CACHE_MAX_ENTRADAS", "500000"))
+TAMANHO_LOTE_SQL = 500  # abaixo do limite de variáveis por consulta do SQLite
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+class EmbeddingsComCache(Embeddings):
+    """
+    Envolve um modelo de embeddings com um cache persistente em SQLite, endereçado por
+    (modelo, dimensões, hash do texto). É compartilhado pelo builder e pelos apps, então
+    textos já vistos (chunks inalterados, perguntas repetidas) não voltam à API.
+    Quando o cache passa de `max_entradas`, as entradas acessadas há mais tempo são removidas.
+    """
+
+    def __init__(self, embeddings: Embeddings, caminho: str = CAMINHO_CACHE_EMBEDDINGS,
+                 max_entradas: int = MAX_ENTRADAS_CACHE, modelo: Optional[str] = None,
+                 dimensoes: Optional[int] = None):
+        self.embeddings = embeddings
+        self.modelo = modelo or getattr(embeddings, "model", type(embeddings).__name__)
+        self.dimensoes = dimensoes if dimensoes is not None else (getattr(embeddings, "dimensions", None) or 0)
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                modelo TEXT NOT NULL,
+                dimensoes INTEGER NOT NULL,
+                hash_texto TEXT NOT NULL,
+                vetor BLOB NOT NULL,
+                ultimo_acesso REAL NOT NULL,
+                PRIMARY KEY (modelo, dimensoes, hash_texto)
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_acesso ON embeddings (ultimo_acesso)")
+        self._conn.commit()
+        self._n_entradas = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _buscar(self, hashes: List[str]) -> Dict[str, List[float]]:
+        encontrados = {}
+        agora = time.time()
+        with self._lock:
+            for i in range(0, len(hashes), TAMANHO_LOTE_SQL):
+                lote = hashes[i:i + TAMANHO_LOTE_SQL]
+                marcadores = ",".join("?" * len(lote))
+                linhas = self._conn.execute(
+                    f"SELECT hash_texto, vetor FROM embeddings WHERE modelo = ? AND dimensoes = ? AND hash_texto IN ({marcadores})",
+                    [self.modelo, self.dimensoes, *lote],
+                ).fetchall()
+                for h, blob in linhas:
+                    encontrados[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if encontrados:
+                self._conn.executemany(
+                    "UPDATE embeddings SET ultimo_acesso = ? WHERE modelo = ? AND dimensoes = ? AND hash_texto = ?",
+                    [(agora, self.modelo, self.dimensoes, h) for h in encontrados],
+                )
+                self._conn.commit()
+        return encontrados
+
+    def _gravar(self, novos: Dict[str, List[float]]):
+        agora = time.time()
+        with self._lock:
+            cursor = self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (modelo, dimensoes, hash_texto, vetor, ultimo_acesso) VALUES (?, ?, ?, ?, ?)",
+                [(self.modelo, self.dimensoes, h, np.asarray(v, dtype=np.float32).tobytes(), agora) for h, v in novos.items()],
+            )
+            self._n_entradas += max(cursor.rowcount, 0)
+            if self._n_entradas > self.max_entradas:
+                self._n_entradas = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                excedente = self._n_entradas - self.max_entradas
+                if excedente > 0:
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY ultimo_acesso ASC LIMIT ?)",
+                        (excedente,),
+                    )
+                    self._n_entradas -= excedente
+            self._conn.commit()
+
+    def _faltantes(self, texts: List[str]):
+        hashes = [hash_texto(t) for t in texts]
+        encontrados = self._buscar(list(dict.fromkeys(hashes)))
+        faltantes = {}
+        for h, t in zip(hashes, texts):
+            if h not in encontrados:
+                faltantes.setdefault(h, t)
+        if faltantes:
+            print(f"-> Cache de embeddings: {len(texts) - len(faltantes)} acertos, {len(faltantes)} textos enviados à API.")
+        return hashes, encontrados, faltantes
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, encontrados, faltantes = self._faltantes(texts)
+        if faltantes:
+            vetores = self.embeddings.embed_documents(list(faltantes.values()))
+            novos = dict(zip(faltantes.keys(), vetores))
+            self._gravar(novos)
+            encontrados.update(novos)
+        return [list(encontrados[h]) for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        h = hash_texto(text)
+        encontrado = self._buscar([h]).get(h)
+        if encontrado is not None:
+            return encontrado
+        vetor = self.embeddings.embed_query(text)
+        self._gravar({h: vetor})
+        return vetor
+
+    # Versões assíncronas: o SQLite local é consultado direto e só a chamada à API é aguardada.
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, encontrados, faltantes = self._faltantes(texts)
+        if faltantes:
+            vetores = await self.embeddings.aembed_documents(list(faltantes.values()))
+            novos = dict(zip(faltantes.keys(), vetores))
+            self._gravar(novos)
+            encontrados.update(novos)
+        return [list(encontrados[h]) for h in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        h = hash_texto(text)
+        encontrado = self._buscar([h]).get(h)
+        if encontrado is not None:
+            return encontrado
+        vetor = await self.embeddings.aembed_query(text)
+        self._gravar({h: vetor})
+        return vetor
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+# desligado | leitura_escrita | replay (só lê; faltas vão à API sem gravar) | replay_estrito (falta = erro)
+MODOS_CACHE_LLM = ("desligado", "leitura_escrita", "replay", "replay_estrito")
+MODO_CACHE_LLM = os.getenv("LLM_CACHE_MODO", "desligado")
+CAMINHO_CACHE_LLM = os.getenv("LLM_CACHE_PATH", "cache_llm.sqlite")
+MAX_BYTES_CACHE_LLM = int(float(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+class FaltaNoCacheLLM(LookupError):
+    """Chamada sem resposta gravada no modo "replay_estrito"."""
+
+def _serializar(geracoes: Sequence[Generation]) -> str:
+    return json.dumps([
+        {"message": message_to_dict(g.message), "generation_info": g.generation_info} if isinstance(g, ChatGeneration)
+        else {"text": g.text, "generation_info": g.generation_info}
+        for g in geracoes
+    ], ensure_ascii=False)
+
+def _desserializar(texto: str) -> list:
+    return [
+        ChatGeneration(message=messages_from_dict([g["message"]])[0], generation_info=g["generation_info"]) if "message" in g
+        else Generation(text=g["text"], generation_info=g["generation_info"])
+        for g in json.loads(texto)
+    ]
+
+def chave_da_chamada(prompt: str, llm_string: str) -> str:
+    """Endereço da chamada: hash do modelo/provedor/parâmetros (`llm_string`) com o prompt renderizado."""
+    return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+class CacheDeChamadasLLM(BaseCache):
+    """
+    Cache persistente em SQLite das respostas de chat models, no formato do LangChain
+    (`BaseCache`): a chave é o hash de (provedor, modelo, parâmetros, mensagens
+    renderizadas), então só repete a resposta para uma chamada idêntica. Serve para
+    reexecutar conjuntos de perguntas de avaliação sem pagar de novo pelas etapas que
+    não mudaram (condensação, rewrite, HyDE, filtros, roteador).
+
+    Acima de `max_bytes`, as entradas acessadas há mais tempo são removidas. Nos modos
+    "replay" o arquivo não é alterado; no "replay_estrito" uma falta levanta FaltaNoCacheLLM,
+    garantindo uma execução sem chamadas às APIs. O LangChain só consulta o cache em
+    `invoke`, `ainvoke` e `batch`; os ChatComLimites (clientes_llm) o consultam também
+    nos streams.
+    """
+
+    def __init__(self, caminho: str = CAMINHO_CACHE_LLM, modo: str = "leitura_escrita", max_bytes: int = MAX_BYTES_CACHE_LLM):
+        if modo not in MODOS_CACHE_LLM or modo == "desligado":
+            raise ValueError(f"Modo de cache de LLM inválido: '{modo}'. Opções: {', '.join(MODOS_CACHE_LLM[1:])}.")
+        self.modo = modo
+        self.max_bytes = max_bytes
+        self.acertos = self.faltas = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chamadas (
+                chave TEXT PRIMARY KEY,
+                resposta TEXT NOT NULL,
+                tamanho INTEGER NOT NULL,
+                criado_em REAL NOT NULL,
+                ultimo_acesso REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chamadas_acesso ON chamadas (ultimo_acesso)")
+        self._conn.commit()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM chamadas").fetchone()[0]
+
+    @property
+    def somente_leitura(self) -> bool:
+        return self.modo.startswith("replay")
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        chave = chave_da_chamada(prompt, llm_string)
+        with self._lock:
+            linha = self._conn.execute("SELECT resposta FROM chamadas WHERE chave = ?", (chave,)).fetchone()
+            if linha is None:
+                self.faltas += 1
+            else:
+                self.acertos += 1
+                if not self.somente_leitura:
+                    self._conn.execute("UPDATE chamadas SET ultimo_acesso = ? WHERE chave = ?", (time.time(), chave))
+                    self._conn.commit()
+        if linha is None:
+            if self.modo == "replay_estrito":
+                raise FaltaNoCacheLLM(f"Chamada sem resposta no cache de LLM (chave {chave[:12]}).")
+            return None
+        return _desserializar(linha[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if self.somente_leitura:
+            return
+        chave = chave_da_chamada(prompt, llm_string)
+        resposta = _serializar(return_val)
+        tamanho = len(resposta.encode("utf-8"))
+        agora = time.time()
+        with self._lock:
+            anterior = self._conn.execute("SELECT tamanho FROM chamadas WHERE chave = ?", (chave,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chamadas (chave, resposta, tamanho, criado_em, ultimo_acesso) VALUES (?, ?, ?, ?, ?)",
+                (chave, resposta, tamanho, agora, agora),
+            )
+            self._bytes += tamanho - (anterior[0] if anterior else 0)
+            while self._bytes > self.max_bytes:
+                removidas = self._conn.execute(
+                    "SELECT rowid, tamanho FROM chamadas WHERE chave != ? ORDER BY ultimo_acesso ASC LIMIT 100", (chave,)
+                ).fetchall()
+                if not removidas:
+                    break
+                self._conn.executemany("DELETE FROM chamadas WHERE rowid = ?", [(rowid,) for rowid, _ in removidas])
+                self._bytes -= sum(t for _, t in removidas)
+            self._conn.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        if self.somente_leitura:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM chamadas")
+            self._conn.commit()
+            self._bytes = 0
+
+_cache_llm: Optional[CacheDeChamadasLLM] = None
+_configurado = False
+_lock_cache_llm = threading.Lock()
+
+def obter_cache_llm() -> Optional[CacheDeChamadasLLM]:
+    """Cache do processo conforme LLM_CACHE_MODO (None quando "desligado", o padrão)."""
+    global _cache_llm, _configurado
+    with _lock_cache_llm:
+        if not _configurado:
+            if MODO_CACHE_LLM != "desligado":
+                _cache_llm = CacheDeChamadasLLM(modo=MODO_CACHE_LLM)
+                print(f"-> Cache de LLM ativo (modo '{MODO_CACHE_LLM}') em '{CAMINHO_CACHE_LLM}'.")
+            _configurado = True
+        return _cache_llm
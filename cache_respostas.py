@@ -0,0 +1,243 @@
+import os
+import re
+import json
+import time
+import hashlib
+import inspect
+import threading
+import functools
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from configs_v2 import get_config
+from eventos_stream import eventos_de_resultado
+
+CAMINHO_MANIFESTO = os.getenv("MANIFESTO_INDICES_PATH", "manifesto_indices.json")
+MAX_ENTRADAS_RESPOSTAS = int(os.getenv("CACHE_RESPOSTAS_MAX_ENTRADAS", "500"))
+TTL_RESPOSTAS_SEGUNDOS = float(os.getenv("CACHE_RESPOSTAS_TTL", str(24 * 3600)))
+LIMIAR_SIMILARIDADE = float(os.getenv("CACHE_RESPOSTAS_SIMILARIDADE", "0.97"))
+CACHE_RESPOSTAS_ATIVO = os.getenv("CACHE_RESPOSTAS_ATIVO", "1") != "0"
+# Motores cuja resposta depende de um modo de síntese (o roteado delega ao unificado).
+CONFIG_SINTESE_DO_MOTOR = {
+    "conselho": "modo_sintese_conselho",
+    "unificado": "modo_sintese_unificado",
+    "roteado": "modo_sintese_unificado",
+}
+
+_NUMEROS = re.compile(r"\d+")
+
+def normalizar_pergunta(pergunta: str) -> str:
+    """Minúsculas, sem acentos, espaços colapsados e sem pontuação final."""
+    texto = unicodedata.normalize("NFKD", pergunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", texto).strip().rstrip("?!.;: ")
+
+def _digest(valor: Any) -> str:
+    return hashlib.sha256(json.dumps(valor, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+_versao_cache = {"mtime": None, "versao": "sem-manifesto"}
+
+def versao_indice(caminho: str = CAMINHO_MANIFESTO) -> str:
+    """Versão dos índices gravada pelo build_index_v4; relida só quando o manifesto muda."""
+    try:
+        mtime = os.path.getmtime(caminho)
+    except OSError:
+        return "sem-manifesto"
+    if mtime != _versao_cache["mtime"]:
+        with open(caminho, "r", encoding="utf-8") as f:
+            manifesto = json.load(f)
+        _versao_cache.update(mtime=mtime, versao=f"{manifesto.get('versao_config')}:{manifesto.get('versao')}")
+    return _versao_cache["versao"]
+
+class CacheDeRespostas:
+    """
+    Cache em memória das respostas dos motores, compartilhado pelo processo.
+
+    Cada entrada fica num "balde" (motor, normas selecionadas, modelo, prompt, versão do
+    índice, histórico): dentro dele, a pergunta normalizada dá o acerto exato e, sem
+    histórico, o embedding da pergunta dá o acerto por similaridade (cosseno >= limiar e
+    mesmos números citados, para não confundir "Resolução 4966" com "Resolução 4967").
+    Remoção por LRU acima de `max_entradas` e por TTL. Como a versão do índice faz parte
+    do balde, reconstruir os índices invalida tudo automaticamente.
+    """
+
+    def __init__(self, max_entradas: int = MAX_ENTRADAS_RESPOSTAS, ttl_segundos: float = TTL_RESPOSTAS_SEGUNDOS,
+                 limiar_similaridade: float = LIMIAR_SIMILARIDADE):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.limiar_similaridade = limiar_similaridade
+        self._lock = threading.Lock()
+        # (balde, pergunta normalizada) -> (criado_em, vetor normalizado ou None, resultado)
+        self._entradas: "OrderedDict[Tuple[str, str], Tuple[float, Optional[np.ndarray], Dict[str, Any]]]" = OrderedDict()
+
+    def _expirada(self, criado_em: float, agora: float) -> bool:
+        return self.ttl_segundos > 0 and agora - criado_em > self.ttl_segundos
+
+    def buscar(self, balde: str, pergunta: str, vetor: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+        chave = (balde, pergunta)
+        agora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                if self._expirada(entrada[0], agora):
+                    del self._entradas[chave]
+                else:
+                    self._entradas.move_to_end(chave)
+                    return entrada[2]
+            if vetor is None:
+                return None
+
+            numeros = sorted(_NUMEROS.findall(pergunta))
+            melhor, melhor_similaridade = None, self.limiar_similaridade
+            for (b, p), (criado_em, v, _) in list(self._entradas.items()):
+                if b != balde or v is None: continue
+                if self._expirada(criado_em, agora):
+                    del self._entradas[(b, p)]
+                    continue
+                similaridade = float(np.dot(vetor, v))
+                if similaridade >= melhor_similaridade and sorted(_NUMEROS.findall(p)) == numeros:
+                    melhor, melhor_similaridade = (b, p), similaridade
+            if melhor is None:
+                return None
+            self._entradas.move_to_end(melhor)
+            print(f"-> Cache de respostas: acerto semântico (cosseno {melhor_similaridade:.3f}) com '{melhor[1][:60]}'.")
+            return self._entradas[melhor][2]
+
+    def gravar(self, balde: str, pergunta: str, resultado: Dict[str, Any], vetor: Optional[np.ndarray] = None):
+        with self._lock:
+            self._entradas[(balde, pergunta)] = (time.time(), vetor, resultado)
+            self._entradas.move_to_end((balde, pergunta))
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+cache_respostas = CacheDeRespostas()
+
+def _vetor_da_pergunta(vectorstore: Any, pergunta: str) -> Optional[np.ndarray]:
+    """Embedding normalizado da pergunta, pelo mesmo modelo (e cache) do vectorstore."""
+    embeddings = getattr(vectorstore, "embeddings", None)
+    if embeddings is None:
+        return None
+    try:
+        return _normalizar(embeddings.embed_query(pergunta))
+    except Exception as e:
+        print(f"AVISO: Cache de respostas sem busca semântica ({e}).")
+        return None
+
+async def _avetor_da_pergunta(vectorstore: Any, pergunta: str) -> Optional[np.ndarray]:
+    embeddings = getattr(vectorstore, "embeddings", None)
+    if embeddings is None:
+        return None
+    try:
+        return _normalizar(await embeddings.aembed_query(pergunta))
+    except Exception as e:
+        print(f"AVISO: Cache de respostas sem busca semântica ({e}).")
+        return None
+
+def _normalizar(vetor: Any) -> Optional[np.ndarray]:
+    vetor = np.asarray(vetor, dtype=np.float32)
+    norma = np.linalg.norm(vetor)
+    return vetor / norma if norma else None
+
+def _balde(nome_motor: str, argumentos: Dict[str, Any]) -> str:
+    llm = argumentos.get("llm")
+    config_sintese = CONFIG_SINTESE_DO_MOTOR.get(nome_motor)
+    return _digest({
+        "motor": nome_motor,
+        "normas": sorted(argumentos.get("normas_selecionadas") or []),
+        "modelo": getattr(llm, "model_name", None) or getattr(llm, "model", None),
+        "prompt": get_config("prompt"),
+        "modo_sintese": get_config(config_sintese) if config_sintese else None,
+        "versao_indice": versao_indice(),
+        "historico": [(m.get("role"), m.get("content")) for m in argumentos.get("chat_history") or []],
+    })
+
+def _gravavel(resultado: Dict[str, Any]) -> bool:
+    return bool(resultado.get("source_documents")) and not resultado.get("erros")
+
+def com_cache_de_respostas(nome_motor: str) -> Callable:
+    """
+    Decora uma função `obter_resposta_*` com o cache de respostas. Lê `question`,
+    `chat_history`, `normas_selecionadas`, `llm` e `vectorstore` dos argumentos; com
+    histórico só há acerto exato (pergunta + histórico idênticos). Respostas sem
+    documentos de origem ou com falhas parciais (chave "erros") não são gravadas. Funções `async def` ganham um envoltório
+    assíncrono com o mesmo cache, e geradores de eventos (`obter_resposta_*_stream`)
+    repassam o stream e gravam o resultado do evento "fim"; num acerto, o resultado
+    é reemitido como eventos. As versões de um motor decoradas com o mesmo nome
+    compartilham as entradas.
+    """
+    def decorador(funcao: Callable) -> Callable:
+        assinatura = inspect.signature(funcao)
+
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            if not CACHE_RESPOSTAS_ATIVO:
+                return funcao(*args, **kwargs)
+            argumentos = assinatura.bind_partial(*args, **kwargs).arguments
+            pergunta = argumentos.get("question") or ""
+            balde, pergunta_normalizada = _balde(nome_motor, argumentos), normalizar_pergunta(pergunta)
+            resultado, vetor = cache_respostas.buscar(balde, pergunta_normalizada), None
+            if resultado is None and not argumentos.get("chat_history"):
+                vetor = _vetor_da_pergunta(argumentos.get("vectorstore"), pergunta)
+                resultado = cache_respostas.buscar(balde, pergunta_normalizada, vetor)
+            if resultado is not None:
+                print(f"--- CACHE DE RESPOSTAS: '{nome_motor}' respondido sem executar o pipeline ---")
+                return resultado
+
+            resultado = funcao(*args, **kwargs)
+            if _gravavel(resultado):
+                cache_respostas.gravar(balde, pergunta_normalizada, resultado, vetor)
+            return resultado
+
+        @functools.wraps(funcao)
+        async def envolvida_async(*args, **kwargs):
+            if not CACHE_RESPOSTAS_ATIVO:
+                return await funcao(*args, **kwargs)
+            argumentos = assinatura.bind_partial(*args, **kwargs).arguments
+            pergunta = argumentos.get("question") or ""
+            balde, pergunta_normalizada = _balde(nome_motor, argumentos), normalizar_pergunta(pergunta)
+            resultado, vetor = cache_respostas.buscar(balde, pergunta_normalizada), None
+            if resultado is None and not argumentos.get("chat_history"):
+                vetor = await _avetor_da_pergunta(argumentos.get("vectorstore"), pergunta)
+                resultado = cache_respostas.buscar(balde, pergunta_normalizada, vetor)
+            if resultado is not None:
+                print(f"--- CACHE DE RESPOSTAS: '{nome_motor}' respondido sem executar o pipeline ---")
+                return resultado
+
+            resultado = await funcao(*args, **kwargs)
+            if _gravavel(resultado):
+                cache_respostas.gravar(balde, pergunta_normalizada, resultado, vetor)
+            return resultado
+
+        @functools.wraps(funcao)
+        def envolvida_stream(*args, **kwargs):
+            if not CACHE_RESPOSTAS_ATIVO:
+                yield from funcao(*args, **kwargs)
+                return
+            argumentos = assinatura.bind_partial(*args, **kwargs).arguments
+            pergunta = argumentos.get("question") or ""
+            balde, pergunta_normalizada = _balde(nome_motor, argumentos), normalizar_pergunta(pergunta)
+            resultado, vetor = cache_respostas.buscar(balde, pergunta_normalizada), None
+            if resultado is None and not argumentos.get("chat_history"):
+                vetor = _vetor_da_pergunta(argumentos.get("vectorstore"), pergunta)
+                resultado = cache_respostas.buscar(balde, pergunta_normalizada, vetor)
+            if resultado is not None:
+                print(f"--- CACHE DE RESPOSTAS: '{nome_motor}' respondido sem executar o pipeline ---")
+                yield from eventos_de_resultado(resultado)
+                return
+
+            for evento in funcao(*args, **kwargs):
+                if evento["tipo"] == "fim" and _gravavel(evento["resultado"]):
+                    cache_respostas.gravar(balde, pergunta_normalizada, evento["resultado"], vetor)
+                yield evento
+
+        if inspect.iscoroutinefunction(funcao):
+            return envolvida_async
+        return envolvida_stream if inspect.isgeneratorfunction(funcao) else envolvida
+    return decorador
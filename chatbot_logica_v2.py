@@ -1,98 +1,150 @@
-import os, pickle, re
-from dotenv import load_dotenv
-from typing import List, Dict, Any
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.retrievers import EnsembleRetriever, BM25Retriever
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
-from langchain.chains.llm import LLMChain
-from langchain_cohere import CohereRerank
-from configs_v2 import get_config
-
-load_dotenv()
-COHERE_API_KEY = os.getenv("COHERE_API_KEY")
-K_INITIAL_SEARCH = 30
-RERANKER_TOP_N = 10
-TOP_N_FOR_WIDENING = 7
-
-def parse_query_for_metadata(question: str) -> Dict[str, str]:
-    question_lower = question.lower().strip()
-    patterns = {
-        'carta circular': r'(?:carta circular|c_circ|circ)\s*n?º?\s*(\d+)',
-        'circular': r'circular\s*n?º?\s*(\d+)(?!.*carta)',
-        'resolucao': r'(?:resolucao|res)\s*n?º?\s*(\d+)',
-    }
-    for norma_type, pattern in patterns.items():
-        match = re.search(pattern, question_lower)
-        if match:
-            return {"tipo_norma": norma_type, "numero_norma": match.group(1)}
-    return {}
-
-def get_context_from_metadata_filter(vectorstore: FAISS, metadata_filter: Dict) -> List[Document]:
-    print(f"-> Executando busca direta por filtro: {metadata_filter}")
-    relevant_docs = []
-    for doc_id in vectorstore.index_to_docstore_id.values():
-        doc = vectorstore.docstore.search(doc_id)
-        if (doc is not None and
-            doc.metadata.get('tipo_norma') == metadata_filter['tipo_norma'] and
-            doc.metadata.get('numero_norma') == metadata_filter['numero_norma']):
-            relevant_docs.append(doc)
-    return relevant_docs
-
-def run_full_rag_pipeline(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> List[Document]:
-    print("--- Executando Pipeline Semântico Completo (v2 com Article Widening) ---")
-    faiss_retriever = vectorstore.as_retriever(search_kwargs={"k": K_INITIAL_SEARCH})
-    bm25_retriever_full.k = K_INITIAL_SEARCH
-    ensemble_retriever = EnsembleRetriever(retrievers=[bm25_retriever_full, faiss_retriever], weights=[0.5, 0.5])
-    initial_chunks = ensemble_retriever.invoke(question)
-    if not initial_chunks: return []
-
-    reranker = CohereRerank(cohere_api_key=COHERE_API_KEY, model="rerank-multilingual-v3.0", top_n=RERANKER_TOP_N)
-    reranked_chunks = reranker.compress_documents(documents=initial_chunks, query=question)
-    if not reranked_chunks: return []
-
-    final_docs_dict = {}
-
-    artigos_ja_processados = set() 
-
-    for relevant_chunk in reranked_chunks[:TOP_N_FOR_WIDENING]:
-        artigo_pai = relevant_chunk.metadata.get("Artigo")
-
-        if artigo_pai and artigo_pai not in artigos_ja_processados:
-            print(f"-> Alargando contexto para o artigo: '{artigo_pai.strip()[:50]}...'")
-            for chunk_do_artigo in ordered_chunks:
-                if chunk_do_artigo.metadata.get("Artigo") == artigo_pai:
-                    final_docs_dict[chunk_do_artigo.page_content] = chunk_do_artigo
-            
-            artigos_ja_processados.add(artigo_pai)
-        
-        else:
-             final_docs_dict[relevant_chunk.page_content] = relevant_chunk
-
-    for chunk in reranked_chunks:
-        if chunk.page_content not in final_docs_dict:
-            final_docs_dict[chunk.page_content] = chunk
-            
-    return list(final_docs_dict.values())
-
-def obter_resposta_v2(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> Dict[str, Any]:
-    print("--- INICIANDO MOTOR 'Híbrido v1.0' ---")
-    final_context_docs = []
-    metadata_filter = parse_query_for_metadata(question)
-
-    if metadata_filter:
-        final_context_docs = get_context_from_metadata_filter(vectorstore, metadata_filter)
-    
-    if not final_context_docs:
-        final_context_docs = run_full_rag_pipeline(question, llm, vectorstore, bm25_retriever_full, ordered_chunks)
-
-    if not final_context_docs:
-        return {"answer": "Com base nos documentos fornecidos, não encontrei informações para responder a essa pergunta.", "source_documents": []}
-    
-    context_text = "\n\n---\n\n".join([doc.page_content for doc in final_context_docs])
-    qa_prompt = PromptTemplate(template=get_config('prompt'), input_variables=["context", "question"])
-    final_chain = LLMChain(llm=llm, prompt=qa_prompt)
-    response = final_chain.invoke({"context": context_text, "question": question})
-    print("--- FINALIZANDO MOTOR 'Híbrido v1.0' ---")
-    return {"answer": response['text'], "source_documents": final_context_docs}
\ No newline at end of file
+import os, pickle, re
+from dotenv import load_dotenv
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain.prompts import PromptTemplate
+from langchain.retrievers import BM25Retriever
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from configs_v2 import get_config
+from cache_respostas import com_cache_de_respostas
+from eventos_stream import etapa, fontes, gerar_resposta, eventos_de_resultado, resultado_de_eventos
+from vectorstore_faiss import FAISSPreFiltrado
+from pool_candidatos import PoolDeCandidatos
+from alargamento_contexto import ColetorDeContexto, chunks_do_artigo, MAX_TOKENS_CONTEXTO
+
+load_dotenv()
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+K_INITIAL_SEARCH = 30
+RERANKER_TOP_N = 10
+TOP_N_FOR_WIDENING = 7
+RESPOSTA_SEM_INFORMACOES = "Com base nos documentos fornecidos, não encontrei informações para responder a essa pergunta."
+
+def parse_query_for_metadata(question: str) -> Dict[str, str]:
+    question_lower = question.lower().strip()
+    patterns = {
+        'carta circular': r'(?:carta circular|c_circ|circ)\s*n?º?\s*(\d+)',
+        'circular': r'circular\s*n?º?\s*(\d+)(?!.*carta)',
+        'resolucao': r'(?:resolucao|res)\s*n?º?\s*(\d+)',
+    }
+    for norma_type, pattern in patterns.items():
+        match = re.search(pattern, question_lower)
+        if match:
+            return {"tipo_norma": norma_type, "numero_norma": match.group(1)}
+    return {}
+
+def get_context_from_metadata_filter(vectorstore: FAISSPreFiltrado, metadata_filter: Dict) -> List[Document]:
+    print(f"-> Executando busca direta por filtro: {metadata_filter}")
+    ids = vectorstore.indice_metadados.ids_da_norma(metadata_filter['tipo_norma'], metadata_filter['numero_norma'])
+    return [vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)]) for i in ids]
+
+def contexto_por_norma(question: str, vectorstore: FAISSPreFiltrado) -> Optional[Dict[str, Any]]:
+    """{"contexto": docs} quando a pergunta cita uma norma e a busca direta por ela encontra trechos."""
+    metadata_filter = parse_query_for_metadata(question)
+    if metadata_filter:
+        docs = get_context_from_metadata_filter(vectorstore, metadata_filter)
+        if docs:
+            return {"contexto": docs}
+    return None
+
+def sem_documentos(answer: str) -> Dict[str, Any]:
+    """Resultado de um motor que não chegou a trechos para enviar ao LLM."""
+    return {"answer": answer, "source_documents": []}
+
+def cadeia_resposta(question: str, llm: ChatOpenAI, docs: List[Document]) -> Tuple[Any, Dict[str, str]]:
+    """Cadeia de resposta dos motores (prompt do configs_v2) e a sua entrada com os trechos de contexto."""
+    context_text = "\n\n---\n\n".join([doc.page_content for doc in docs])
+    qa_prompt = PromptTemplate(template=get_config('prompt'), input_variables=["context", "question"])
+    return qa_prompt | llm | StrOutputParser(), {"context": context_text, "question": question}
+
+def buscar_candidatos_v2(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document], pool: PoolDeCandidatos) -> Dict[str, Any]:
+    """
+    Estágio anterior ao re-ranking. Retorna {"contexto": docs} quando a busca direta por
+    norma já resolve, ou {"candidatos": docs, ...} para re-rankear e passar a `montar_contexto_v2`.
+    """
+    estado = contexto_por_norma(question, vectorstore)
+    if estado:
+        return estado
+
+    print("--- Executando Pipeline Semântico Completo (v2 com Article Widening) ---")
+    return {"candidatos": pool.busca_hibrida(K_INITIAL_SEARCH), "top_n": RERANKER_TOP_N, "ordered_chunks": ordered_chunks}
+
+def montar_contexto_v2(estado: Dict[str, Any], reranked_chunks: List[Document]) -> List[Document]:
+    if not reranked_chunks: return []
+    ordered_chunks = estado["ordered_chunks"]
+
+    coletor = ColetorDeContexto(MAX_TOKENS_CONTEXTO)
+
+    artigos_ja_processados = set() 
+
+    for relevant_chunk in reranked_chunks[:TOP_N_FOR_WIDENING]:
+        artigo_pai = relevant_chunk.metadata.get("Artigo")
+        chave_artigo = (relevant_chunk.metadata.get("origem"), artigo_pai)
+
+        if artigo_pai and chave_artigo not in artigos_ja_processados:
+            print(f"-> Alargando contexto para o artigo: '{artigo_pai.strip()[:50]}...'")
+            coletor.adicionar(chunks_do_artigo(relevant_chunk, ordered_chunks) or [relevant_chunk])
+            artigos_ja_processados.add(chave_artigo)
+        
+        else:
+            coletor.adicionar([relevant_chunk])
+
+    coletor.adicionar(reranked_chunks)
+    return coletor.documentos
+
+def recuperar_contexto_v2(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> List[Document]:
+    pool = PoolDeCandidatos(question, vectorstore, bm25_retriever_full)
+    estado = buscar_candidatos_v2(question, llm, vectorstore, bm25_retriever_full, ordered_chunks, pool)
+    return pool.montar_contexto(estado, montar_contexto_v2)
+
+def obter_resposta_v2(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> Dict[str, Any]:
+    """Resultado final de `obter_resposta_v2_stream` (o mesmo pipeline e o mesmo cache de respostas)."""
+    return resultado_de_eventos(obter_resposta_v2_stream(question, llm, vectorstore, bm25_retriever_full, ordered_chunks))
+
+# --- VERSÃO ASSÍNCRONA ---
+
+async def buscar_candidatos_v2_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document], pool: PoolDeCandidatos) -> Dict[str, Any]:
+    """Versão assíncrona de `buscar_candidatos_v2`: as pernas BM25 e FAISS rodam em paralelo."""
+    estado = contexto_por_norma(question, vectorstore)
+    if estado:
+        return estado
+
+    print("--- Executando Pipeline Semântico Completo (v2 com Article Widening) ---")
+    return {"candidatos": await pool.abusca_hibrida(K_INITIAL_SEARCH), "top_n": RERANKER_TOP_N, "ordered_chunks": ordered_chunks}
+
+async def recuperar_contexto_v2_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> List[Document]:
+    pool = PoolDeCandidatos(question, vectorstore, bm25_retriever_full)
+    estado = await buscar_candidatos_v2_async(question, llm, vectorstore, bm25_retriever_full, ordered_chunks, pool)
+    return await pool.amontar_contexto(estado, montar_contexto_v2)
+
+@com_cache_de_respostas("v2")
+async def obter_resposta_v2_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> Dict[str, Any]:
+    print("--- INICIANDO MOTOR 'Híbrido v1.0' (assíncrono) ---")
+    final_context_docs = await recuperar_contexto_v2_async(question, llm, vectorstore, bm25_retriever_full, ordered_chunks)
+
+    if not final_context_docs:
+        return sem_documentos(RESPOSTA_SEM_INFORMACOES)
+
+    final_chain, entrada = cadeia_resposta(question, llm, final_context_docs)
+    answer = await final_chain.ainvoke(entrada)
+    print("--- FINALIZANDO MOTOR 'Híbrido v1.0' (assíncrono) ---")
+    return {"answer": answer, "source_documents": final_context_docs}
+
+# --- VERSÃO EM STREAMING ---
+
+@com_cache_de_respostas("v2")
+def obter_resposta_v2_stream(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> Iterator[Dict[str, Any]]:
+    """Pipeline do motor em eventos de etapa e tokens da resposta (veja eventos_stream)."""
+    print("--- INICIANDO MOTOR 'Híbrido v1.0' ---")
+    yield etapa("recuperacao", "Buscando e re-rankeando os trechos relevantes...")
+    final_context_docs = recuperar_contexto_v2(question, llm, vectorstore, bm25_retriever_full, ordered_chunks)
+
+    if not final_context_docs:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_INFORMACOES))
+        return
+    yield fontes(final_context_docs)
+
+    yield etapa("geracao", "Gerando a resposta...")
+    yield from gerar_resposta(*cadeia_resposta(question, llm, final_context_docs), final_context_docs)
+    print("--- FINALIZANDO MOTOR 'Híbrido v1.0' ---")
@@ -1,89 +1,166 @@
-import os, pickle
-from dotenv import load_dotenv
-from typing import List, Dict, Any
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.retrievers import EnsembleRetriever, BM25Retriever
-from langchain_community.vectorstores import FAISS
-from langchain.chains.llm import LLMChain
-from langchain_cohere import CohereRerank
-from configs_v2 import get_config 
-
-load_dotenv()
-COHERE_API_KEY = os.getenv("COHERE_API_KEY")
-K_INITIAL_SEARCH = 30
-RERANKER_TOP_N = 18
-MAX_DOCS_TO_REFINE = 3
-K_REFINED_SEARCH = 25
-
-REWRITE_PROMPT_TEMPLATE = """
-Você é um engenheiro de busca sênior, especialista em otimizar perguntas de usuários para um sistema de busca em documentos regulatórios do Banco Central.
-Sua tarefa é reescrever a pergunta do usuário, transformando-a em uma única query de busca vetorial, precisa e autocontida.
-
-**Siga estas diretrizes para a reescrita:**
-1.  **Extraia o Intento Principal:** Identifique o objetivo central da pergunta do usuário.
-2.  **Incorpore Termos-Chave:** Isole e inclua todos os termos técnicos, entidades, números de normas ou artigos mencionados (ex: "Capital Principal", "Resolução 4.958", "Art. 66", "FPR").
-3.  **Desambigue e Expanda:** Se houver acrônimos ou termos ambíguos, adicione contexto ou o nome por extenso para tornar a busca mais precisa (ex: "CRI" -> "Certificado de Recebíveis Imobiliários").
-4.  **Formule uma Pergunta Clara:** Construa uma pergunta completa e direta, como se estivesse consultando um especialista na norma. Remova qualquer informalidade ou texto supérfluo.
-
-**Não responda à pergunta.** Apenas forneça a versão otimizada para a busca.
-
-Pergunta Original: "{question}"
-Pergunta Otimizada para Busca:"""
-
-def obter_resposta_v3(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever) -> Dict[str, Any]:
-    print("--- INICIANDO MOTOR 'Otimizado 3.0 - MODO DIAGNÓSTICO' ---")
-
-    rewrite_prompt = PromptTemplate.from_template(REWRITE_PROMPT_TEMPLATE)
-    rewrite_chain = LLMChain(llm=llm, prompt=rewrite_prompt)
-    rewritten_question = rewrite_chain.invoke({"question": question})['text']
-
-    print("\n" + "="*50)
-    print("--- PERGUNTA REESCRITA GERADA ---")
-    print(rewritten_question)
-    print("="*50 + "\n")
-
-
-    faiss_retriever_initial = vectorstore.as_retriever(search_kwargs={"k": K_INITIAL_SEARCH})
-    bm25_retriever_full.k = K_INITIAL_SEARCH
-    ensemble_retriever_initial = EnsembleRetriever(retrievers=[bm25_retriever_full, faiss_retriever_initial], weights=[0.5, 0.5])
-    
-    initial_chunks = ensemble_retriever_initial.get_relevant_documents(rewritten_question)
-    
-    if not initial_chunks:
-        return {"answer": "Com base nos documentos fornecidos, não encontrei informações para responder a essa pergunta.", "source_documents": []}
-
-    reranker = CohereRerank(cohere_api_key=COHERE_API_KEY, model="rerank-multilingual-v3.0", top_n=RERANKER_TOP_N)
-    reranked_chunks = reranker.compress_documents(documents=initial_chunks, query=question)
-    if not reranked_chunks:
-        return {"answer": "Com base nos documentos fornecidos, não encontrei informações para responder a essa pergunta.", "source_documents": []}
-
-    source_documents = [chunk.metadata.get('origem') for chunk in reranked_chunks if chunk.metadata.get('origem')]
-    unique_sources = list(dict.fromkeys(source_documents))
-    docs_to_refine = unique_sources[:MAX_DOCS_TO_REFINE]
-
-    refined_chunks_all = []
-    for doc_origin in docs_to_refine:
-        faiss_retriever_filtered = vectorstore.as_retriever(search_kwargs={'k': K_REFINED_SEARCH, 'filter': {'origem': doc_origin}})
-        docs_for_bm25_filtered = [doc for doc in bm25_retriever_full.docs if doc.metadata.get('origem') == doc_origin]
-        if not docs_for_bm25_filtered: continue
-        
-        bm25_retriever_filtered = BM25Retriever.from_documents(docs_for_bm25_filtered)
-        bm25_retriever_filtered.k = K_REFINED_SEARCH
-        ensemble_retriever_filtered = EnsembleRetriever(retrievers=[bm25_retriever_filtered, faiss_retriever_filtered], weights=[0.5, 0.5])
-        
-        chunks_from_this_doc = ensemble_retriever_filtered.get_relevant_documents(rewritten_question)
-        refined_chunks_all.extend(chunks_from_this_doc)
-
-    final_context_docs = reranked_chunks if not refined_chunks_all else list({doc.page_content: doc for doc in refined_chunks_all}.values())
-    context_text = "\n\n---\n\n".join([doc.page_content for doc in final_context_docs])
-    print("\n" + "="*50)
-    print("--- CONTEXTO FINAL ENVIADO AO LLM ---")
-    print(context_text)
-    print("="*50 + "\n")
-
-    qa_prompt = PromptTemplate(template=get_config('prompt'), input_variables=["context", "question"])
-    final_chain = LLMChain(llm=llm, prompt=qa_prompt)
-    response = final_chain.invoke({"context": context_text, "question": question})
-    print("--- FINALIZANDO MOTOR 'Otimizado 3.0 - MODO DIAGNÓSTICO' ---")
-    return {"answer": response['text'], "source_documents": final_context_docs}
\ No newline at end of file
+import os, pickle, asyncio
+import concurrent.futures
+from dotenv import load_dotenv
+from typing import List, Dict, Any, Iterator, Optional
+from langchain_core.documents import Document
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain.prompts import PromptTemplate
+from langchain_community.vectorstores import FAISS
+from langchain_core.output_parsers import StrOutputParser
+from cache_respostas import com_cache_de_respostas
+from eventos_stream import etapa, fontes, gerar_resposta, eventos_de_resultado, resultado_de_eventos
+from indice_bm25 import RetrieverBM25Compacto
+from pool_candidatos import PoolDeCandidatos
+from retriever_hibrido import RetrieverHibrido
+from chatbot_logica_v2 import RESPOSTA_SEM_INFORMACOES, sem_documentos, cadeia_resposta
+
+load_dotenv()
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+K_INITIAL_SEARCH = 30
+RERANKER_TOP_N = 18
+MAX_DOCS_TO_REFINE = 3
+K_REFINED_SEARCH = 25
+MAX_WORKERS_REFINAMENTO = int(os.getenv("V3_MAX_WORKERS_REFINAMENTO", "8"))
+
+# Buscas refinadas de cada norma. Separado do `executor_pernas`, que cada busca usa para a
+# perna BM25: esperar por ele de dentro dele poderia esgotar os workers.
+executor_refinamento = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS_REFINAMENTO, thread_name_prefix="refino_v3")
+
+REWRITE_PROMPT_TEMPLATE = """
+Você é um engenheiro de busca sênior, especialista em otimizar perguntas de usuários para um sistema de busca em documentos regulatórios do Banco Central.
+Sua tarefa é reescrever a pergunta do usuário, transformando-a em uma única query de busca vetorial, precisa e autocontida.
+
+**Siga estas diretrizes para a reescrita:**
+1.  **Extraia o Intento Principal:** Identifique o objetivo central da pergunta do usuário.
+2.  **Incorpore Termos-Chave:** Isole e inclua todos os termos técnicos, entidades, números de normas ou artigos mencionados (ex: "Capital Principal", "Resolução 4.958", "Art. 66", "FPR").
+3.  **Desambigue e Expanda:** Se houver acrônimos ou termos ambíguos, adicione contexto ou o nome por extenso para tornar a busca mais precisa (ex: "CRI" -> "Certificado de Recebíveis Imobiliários").
+4.  **Formule uma Pergunta Clara:** Construa uma pergunta completa e direta, como se estivesse consultando um especialista na norma. Remova qualquer informalidade ou texto supérfluo.
+
+**Não responda à pergunta.** Apenas forneça a versão otimizada para a busca.
+
+Pergunta Original: "{question}"
+Pergunta Otimizada para Busca:"""
+
+def _cadeia_reescrita(llm: ChatOpenAI):
+    return PromptTemplate.from_template(REWRITE_PROMPT_TEMPLATE) | llm | StrOutputParser()
+
+def _mostrar_reescrita(rewritten_question: str):
+    print("\n" + "="*50)
+    print("--- PERGUNTA REESCRITA GERADA ---")
+    print(rewritten_question)
+    print("="*50 + "\n")
+
+def _retriever_inicial(pool: PoolDeCandidatos, bm25_retriever_full: RetrieverBM25Compacto) -> RetrieverHibrido:
+    return RetrieverHibrido(vectorstore=pool.vectorstore, bm25=bm25_retriever_full, docs=bm25_retriever_full.docs, k=K_INITIAL_SEARCH)
+
+def _estado_v3(initial_chunks: List[Document], rewritten_question: str, pool: PoolDeCandidatos, bm25_retriever_full: RetrieverBM25Compacto) -> Dict[str, Any]:
+    return {"candidatos": initial_chunks, "top_n": RERANKER_TOP_N, "rewritten_question": rewritten_question,
+            "vectorstore": pool.vectorstore, "bm25_retriever_full": bm25_retriever_full}
+
+def _normas_a_refinar(reranked_chunks: List[Document]) -> List[str]:
+    source_documents = [chunk.metadata.get('origem') for chunk in reranked_chunks if chunk.metadata.get('origem')]
+    return list(dict.fromkeys(source_documents))[:MAX_DOCS_TO_REFINE]
+
+def _retriever_refinado(estado: Dict[str, Any], doc_origin: str) -> Optional[RetrieverHibrido]:
+    """Busca híbrida restrita a uma norma (None quando o BM25 não tem trechos dela)."""
+    bm25_retriever_full = estado["bm25_retriever_full"]
+    bm25_retriever_filtered = bm25_retriever_full.filtrado('origem', [doc_origin])
+    if bm25_retriever_filtered is None: return None
+    return RetrieverHibrido(vectorstore=estado["vectorstore"], bm25=bm25_retriever_filtered, docs=bm25_retriever_full.docs,
+                            k=K_REFINED_SEARCH, filtro={'origem': doc_origin})
+
+def _fundir_refinados(reranked_chunks: List[Document], refinados: List[List[Document]]) -> List[Document]:
+    refined_chunks_all = [doc for chunks in refinados for doc in chunks]
+    return reranked_chunks if not refined_chunks_all else list({doc.page_content: doc for doc in refined_chunks_all}.values())
+
+def _mostrar_contexto(context_text: str):
+    print("\n" + "="*50)
+    print("--- CONTEXTO FINAL ENVIADO AO LLM ---")
+    print(context_text)
+    print("="*50 + "\n")
+
+def buscar_candidatos_v3(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto, pool: PoolDeCandidatos) -> Dict[str, Any]:
+    """Estágio anterior ao re-ranking: reescrita da pergunta e busca híbrida com a pergunta reescrita."""
+    rewritten_question = _cadeia_reescrita(llm).invoke({"question": question})
+    _mostrar_reescrita(rewritten_question)
+    initial_chunks = _retriever_inicial(pool, bm25_retriever_full).invoke(rewritten_question)
+    return _estado_v3(initial_chunks, rewritten_question, pool, bm25_retriever_full)
+
+def montar_contexto_v3(estado: Dict[str, Any], reranked_chunks: List[Document]) -> List[Document]:
+    """Refinamento: nova busca híbrida dentro de cada uma das normas mais bem colocadas no re-ranking."""
+    if not reranked_chunks: return []
+
+    def refinar(doc_origin: str) -> List[Document]:
+        retriever = _retriever_refinado(estado, doc_origin)
+        return retriever.invoke(estado["rewritten_question"]) if retriever else []
+
+    # As normas são refinadas em paralelo; `map` devolve na ordem das normas, então a
+    # fusão (e o desempate do dedup por conteúdo) é a mesma da versão sequencial.
+    return _fundir_refinados(reranked_chunks, list(executor_refinamento.map(refinar, _normas_a_refinar(reranked_chunks))))
+
+def recuperar_contexto_v3(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto) -> List[Document]:
+    pool = PoolDeCandidatos(question, vectorstore, bm25_retriever_full)
+    estado = buscar_candidatos_v3(question, llm, vectorstore, bm25_retriever_full, pool)
+    return pool.montar_contexto(estado, montar_contexto_v3)
+
+def obter_resposta_v3(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto) -> Dict[str, Any]:
+    """Resultado final de `obter_resposta_v3_stream` (o mesmo pipeline e o mesmo cache de respostas)."""
+    return resultado_de_eventos(obter_resposta_v3_stream(question, llm, vectorstore, bm25_retriever_full))
+
+# --- VERSÃO ASSÍNCRONA ---
+
+async def buscar_candidatos_v3_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto, pool: PoolDeCandidatos) -> Dict[str, Any]:
+    """Versão assíncrona de `buscar_candidatos_v3`."""
+    rewritten_question = await _cadeia_reescrita(llm).ainvoke({"question": question})
+    _mostrar_reescrita(rewritten_question)
+    initial_chunks = await _retriever_inicial(pool, bm25_retriever_full).ainvoke(rewritten_question)
+    return _estado_v3(initial_chunks, rewritten_question, pool, bm25_retriever_full)
+
+async def montar_contexto_v3_async(estado: Dict[str, Any], reranked_chunks: List[Document]) -> List[Document]:
+    """Versão assíncrona de `montar_contexto_v3`: as buscas refinadas de cada norma rodam juntas."""
+    if not reranked_chunks: return []
+
+    async def refinar(doc_origin: str) -> List[Document]:
+        retriever = _retriever_refinado(estado, doc_origin)
+        return await retriever.ainvoke(estado["rewritten_question"]) if retriever else []
+
+    # gather preserva a ordem das normas, então a fusão é a mesma da versão síncrona.
+    return _fundir_refinados(reranked_chunks, await asyncio.gather(*(refinar(o) for o in _normas_a_refinar(reranked_chunks))))
+
+async def recuperar_contexto_v3_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto) -> List[Document]:
+    pool = PoolDeCandidatos(question, vectorstore, bm25_retriever_full)
+    estado = await buscar_candidatos_v3_async(question, llm, vectorstore, bm25_retriever_full, pool)
+    return await pool.amontar_contexto(estado, montar_contexto_v3_async)
+
+@com_cache_de_respostas("v3")
+async def obter_resposta_v3_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto) -> Dict[str, Any]:
+    print("--- INICIANDO MOTOR 'Otimizado 3.0' (assíncrono) ---")
+    final_context_docs = await recuperar_contexto_v3_async(question, llm, vectorstore, bm25_retriever_full)
+
+    if not final_context_docs:
+        return sem_documentos(RESPOSTA_SEM_INFORMACOES)
+
+    final_chain, entrada = cadeia_resposta(question, llm, final_context_docs)
+    answer = await final_chain.ainvoke(entrada)
+    print("--- FINALIZANDO MOTOR 'Otimizado 3.0' (assíncrono) ---")
+    return {"answer": answer, "source_documents": final_context_docs}
+
+# --- VERSÃO EM STREAMING ---
+
+@com_cache_de_respostas("v3")
+def obter_resposta_v3_stream(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto) -> Iterator[Dict[str, Any]]:
+    """Pipeline do motor em eventos de etapa e tokens da resposta (veja eventos_stream)."""
+    print("--- INICIANDO MOTOR 'Otimizado 3.0 - MODO DIAGNÓSTICO' ---")
+    yield etapa("recuperacao", "Buscando e re-rankeando os trechos relevantes...")
+    final_context_docs = recuperar_contexto_v3(question, llm, vectorstore, bm25_retriever_full)
+
+    if not final_context_docs:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_INFORMACOES))
+        return
+    yield fontes(final_context_docs)
+
+    yield etapa("geracao", "Gerando a resposta...")
+    final_chain, entrada = cadeia_resposta(question, llm, final_context_docs)
+    _mostrar_contexto(entrada["context"])
+    yield from gerar_resposta(final_chain, entrada, final_context_docs)
+    print("--- FINALIZANDO MOTOR 'Otimizado 3.0 - MODO DIAGNÓSTICO' ---")
@@ -1,105 +1,133 @@
-
-import os, pickle, re
-from dotenv import load_dotenv
-from typing import List, Dict, Any
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.retrievers import BM25Retriever
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
-from langchain_core.output_parsers import StrOutputParser
-from langchain.chains.llm import LLMChain
-from langchain_cohere import CohereRerank
-from configs_v2 import get_config
-
-load_dotenv()
-COHERE_API_KEY = os.getenv("COHERE_API_KEY")
-K_INITIAL_SEARCH = 30
-RERANKER_TOP_N = 10
-HYDE_TEMPLATE = """
-Você é um especialista em regulação do BACEN.
-Escreva um parágrafo que responda de forma plausível à seguinte pergunta.
-O parágrafo deve ser um trecho de um documento normativo fictício, usando linguagem técnica e formal.
-
-Pergunta: {question}
-Resposta Fictícia:
-"""
-
-def parse_query_for_metadata(question: str) -> Dict[str, str]:
-    question_lower = question.lower().strip()
-    patterns = {
-        'carta circular': r'(?:carta circular|c_circ|circ)\s*n?º?\s*(\d+)',
-        'circular': r'circular\s*n?º?\s*(\d+)(?!.*carta)',
-        'resolucao': r'(?:resolucao|res)\s*n?º?\s*(\d+)',
-    }
-    for norma_type, pattern in patterns.items():
-        match = re.search(pattern, question_lower)
-        if match:
-            return {"tipo_norma": norma_type, "numero_norma": match.group(1)}
-    return {}
-
-def get_context_from_metadata_filter(vectorstore: FAISS, metadata_filter: Dict) -> List[Document]:
-    print(f"-> Executando busca direta por filtro: {metadata_filter}")
-    relevant_docs = []
-    for doc_id in vectorstore.index_to_docstore_id.values():
-        doc = vectorstore.docstore.search(doc_id)
-        if (doc is not None and
-            doc.metadata.get('tipo_norma') == metadata_filter['tipo_norma'] and
-            doc.metadata.get('numero_norma') == metadata_filter['numero_norma']):
-            relevant_docs.append(doc)
-    return relevant_docs
-
-def run_full_rag_pipeline(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> List[Document]:
-    print("--- Executando Pipeline Semântico Completo (HyDE) ---")
-    hyde_prompt = PromptTemplate(template=HYDE_TEMPLATE, input_variables=["question"])
-    hyde_chain = hyde_prompt | llm | StrOutputParser()
-    hypothetical_document = hyde_chain.invoke({"question": question})
-
-    faiss_retriever = vectorstore.as_retriever(search_kwargs={"k": K_INITIAL_SEARCH})
-    bm25_retriever_full.k = K_INITIAL_SEARCH
-    
-    initial_chunks_faiss = faiss_retriever.invoke(hypothetical_document)
-    initial_chunks_bm25 = bm25_retriever_full.invoke(question)
-    initial_chunks = list({doc.page_content: doc for doc in initial_chunks_faiss + initial_chunks_bm25}.values())
-
-    if not initial_chunks: return []
-
-    reranker = CohereRerank(cohere_api_key=COHERE_API_KEY, model="rerank-multilingual-v3.0", top_n=RERANKER_TOP_N)
-    reranked_chunks = reranker.compress_documents(documents=initial_chunks, query=question)
-    if not reranked_chunks: return []
-
-    final_docs_dict = {}
-    if not reranked_chunks[0].metadata.get("origem"): return reranked_chunks
-    
-    primary_source_document = reranked_chunks[0].metadata["origem"]
-    for chunk in reranked_chunks:
-        final_docs_dict[chunk.page_content] = chunk
-        if chunk.metadata.get("origem") == primary_source_document:
-            chunk_index = chunk.metadata.get('original_index')
-            if chunk_index is not None:
-                start_index = max(0, chunk_index - 1)
-                end_index = min(len(ordered_chunks), chunk_index + 2)
-                for neighbor in ordered_chunks[start_index:end_index]:
-                    final_docs_dict[neighbor.page_content] = neighbor
-    return list(final_docs_dict.values())
-
-def obter_resposta_v4(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> Dict[str, Any]:
-    print("--- INICIANDO MOTOR 'Híbrido v2.0 (HyDE + Foco)' ---")
-    final_context_docs = []
-    metadata_filter = parse_query_for_metadata(question)
-
-    if metadata_filter:
-        final_context_docs = get_context_from_metadata_filter(vectorstore, metadata_filter)
-
-    if not final_context_docs:
-        final_context_docs = run_full_rag_pipeline(question, llm, vectorstore, bm25_retriever_full, ordered_chunks)
-
-    if not final_context_docs:
-        return {"answer": "Com base nos documentos fornecidos, não encontrei informações para responder a essa pergunta.", "source_documents": []}
-
-    context_text = "\n\n---\n\n".join([doc.page_content for doc in final_context_docs])
-    qa_prompt = PromptTemplate(template=get_config('prompt'), input_variables=["context", "question"])
-    final_chain = LLMChain(llm=llm, prompt=qa_prompt)
-    response = final_chain.invoke({"context": context_text, "question": question})
-    print("--- FINALIZANDO MOTOR 'Híbrido v2.0 (HyDE + Foco)' ---")
-    return {"answer": response['text'], "source_documents": final_context_docs}
\ No newline at end of file
+
+import os, pickle, asyncio
+from dotenv import load_dotenv
+from typing import List, Dict, Any, Iterator
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain.prompts import PromptTemplate
+from langchain.retrievers import BM25Retriever
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from cache_respostas import com_cache_de_respostas
+from eventos_stream import etapa, fontes, gerar_resposta, eventos_de_resultado, resultado_de_eventos
+from pool_candidatos import PoolDeCandidatos
+from chatbot_logica_v2 import RESPOSTA_SEM_INFORMACOES, contexto_por_norma, sem_documentos, cadeia_resposta
+from alargamento_contexto import ColetorDeContexto, vizinhos, MAX_TOKENS_CONTEXTO
+
+load_dotenv()
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+K_INITIAL_SEARCH = 30
+RERANKER_TOP_N = 10
+JANELA_VIZINHOS = 1
+HYDE_TEMPLATE = """
+Você é um especialista em regulação do BACEN.
+Escreva um parágrafo que responda de forma plausível à seguinte pergunta.
+O parágrafo deve ser um trecho de um documento normativo fictício, usando linguagem técnica e formal.
+
+Pergunta: {question}
+Resposta Fictícia:
+"""
+
+def _cadeia_hyde(llm: ChatOpenAI):
+    hyde_prompt = PromptTemplate(template=HYDE_TEMPLATE, input_variables=["question"])
+    return hyde_prompt | llm | StrOutputParser()
+
+def _estado_v4(initial_chunks_faiss: List[Document], initial_chunks_bm25: List[Document], ordered_chunks: List[Document]) -> Dict[str, Any]:
+    initial_chunks = list({doc.page_content: doc for doc in initial_chunks_faiss + initial_chunks_bm25}.values())
+    return {"candidatos": initial_chunks, "top_n": RERANKER_TOP_N, "ordered_chunks": ordered_chunks}
+
+def buscar_candidatos_v4(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document], pool: PoolDeCandidatos) -> Dict[str, Any]:
+    """
+    Estágio anterior ao re-ranking. Retorna {"contexto": docs} quando a busca direta por
+    norma já resolve, ou {"candidatos": docs, ...} para re-rankear e passar a `montar_contexto_v4`.
+    """
+    estado = contexto_por_norma(question, vectorstore)
+    if estado:
+        return estado
+
+    print("--- Executando Pipeline Semântico Completo (HyDE) ---")
+    hypothetical_document = _cadeia_hyde(llm).invoke({"question": question})
+
+    faiss_retriever = pool.vectorstore.as_retriever(search_kwargs={"k": K_INITIAL_SEARCH})
+    initial_chunks_faiss = faiss_retriever.invoke(hypothetical_document)
+    return _estado_v4(initial_chunks_faiss, pool.busca_bm25(K_INITIAL_SEARCH), ordered_chunks)
+
+def montar_contexto_v4(estado: Dict[str, Any], reranked_chunks: List[Document]) -> List[Document]:
+    if not reranked_chunks: return []
+    ordered_chunks = estado["ordered_chunks"]
+
+    if not reranked_chunks[0].metadata.get("origem"): return reranked_chunks
+    
+    coletor = ColetorDeContexto(MAX_TOKENS_CONTEXTO)
+    primary_source_document = reranked_chunks[0].metadata["origem"]
+    for chunk in reranked_chunks:
+        coletor.adicionar([chunk])
+        if chunk.metadata.get("origem") == primary_source_document:
+            coletor.adicionar(vizinhos(chunk, ordered_chunks, janela=JANELA_VIZINHOS))
+    return coletor.documentos
+
+def recuperar_contexto_v4(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> List[Document]:
+    pool = PoolDeCandidatos(question, vectorstore, bm25_retriever_full)
+    estado = buscar_candidatos_v4(question, llm, vectorstore, bm25_retriever_full, ordered_chunks, pool)
+    return pool.montar_contexto(estado, montar_contexto_v4)
+
+def obter_resposta_v4(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> Dict[str, Any]:
+    """Resultado final de `obter_resposta_v4_stream` (o mesmo pipeline e o mesmo cache de respostas)."""
+    return resultado_de_eventos(obter_resposta_v4_stream(question, llm, vectorstore, bm25_retriever_full, ordered_chunks))
+
+# --- VERSÃO ASSÍNCRONA ---
+
+async def buscar_candidatos_v4_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document], pool: PoolDeCandidatos) -> Dict[str, Any]:
+    """
+    Versão assíncrona de `buscar_candidatos_v4`. A perna BM25 usa a pergunta original,
+    então roda enquanto o LLM escreve o documento hipotético.
+    """
+    estado = contexto_por_norma(question, vectorstore)
+    if estado:
+        return estado
+
+    print("--- Executando Pipeline Semântico Completo (HyDE) ---")
+
+    async def busca_faiss_hyde() -> List[Document]:
+        hypothetical_document = await _cadeia_hyde(llm).ainvoke({"question": question})
+        faiss_retriever = pool.vectorstore.as_retriever(search_kwargs={"k": K_INITIAL_SEARCH})
+        return await faiss_retriever.ainvoke(hypothetical_document)
+
+    initial_chunks_faiss, initial_chunks_bm25 = await asyncio.gather(busca_faiss_hyde(), pool.abusca_bm25(K_INITIAL_SEARCH))
+    return _estado_v4(initial_chunks_faiss, initial_chunks_bm25, ordered_chunks)
+
+async def recuperar_contexto_v4_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> List[Document]:
+    pool = PoolDeCandidatos(question, vectorstore, bm25_retriever_full)
+    estado = await buscar_candidatos_v4_async(question, llm, vectorstore, bm25_retriever_full, ordered_chunks, pool)
+    return await pool.amontar_contexto(estado, montar_contexto_v4)
+
+@com_cache_de_respostas("v4")
+async def obter_resposta_v4_async(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> Dict[str, Any]:
+    print("--- INICIANDO MOTOR 'Híbrido v2.0 (HyDE + Foco)' (assíncrono) ---")
+    final_context_docs = await recuperar_contexto_v4_async(question, llm, vectorstore, bm25_retriever_full, ordered_chunks)
+
+    if not final_context_docs:
+        return sem_documentos(RESPOSTA_SEM_INFORMACOES)
+
+    final_chain, entrada = cadeia_resposta(question, llm, final_context_docs)
+    answer = await final_chain.ainvoke(entrada)
+    print("--- FINALIZANDO MOTOR 'Híbrido v2.0 (HyDE + Foco)' (assíncrono) ---")
+    return {"answer": answer, "source_documents": final_context_docs}
+
+# --- VERSÃO EM STREAMING ---
+
+@com_cache_de_respostas("v4")
+def obter_resposta_v4_stream(question: str, llm: ChatOpenAI, vectorstore: FAISS, bm25_retriever_full: BM25Retriever, ordered_chunks: List[Document]) -> Iterator[Dict[str, Any]]:
+    """Pipeline do motor em eventos de etapa e tokens da resposta (veja eventos_stream)."""
+    print("--- INICIANDO MOTOR 'Híbrido v2.0 (HyDE + Foco)' ---")
+    yield etapa("recuperacao", "Buscando e re-rankeando os trechos relevantes...")
+    final_context_docs = recuperar_contexto_v4(question, llm, vectorstore, bm25_retriever_full, ordered_chunks)
+
+    if not final_context_docs:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_INFORMACOES))
+        return
+    yield fontes(final_context_docs)
+
+    yield etapa("geracao", "Gerando a resposta...")
+    yield from gerar_resposta(*cadeia_resposta(question, llm, final_context_docs), final_context_docs)
+    print("--- FINALIZANDO MOTOR 'Híbrido v2.0 (HyDE + Foco)' ---")
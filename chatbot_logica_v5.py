@@ -1,91 +1,162 @@
-import os
-from typing import List, Dict, Any
-
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.retrievers import BM25Retriever
-from langchain_community.vectorstores import FAISS
-from langchain.chains.llm import LLMChain
-from langchain_cohere import CohereRerank
-from configs_v2 import get_config
-
-COHERE_API_KEY = os.getenv("COHERE_API_KEY")
-RERANKER_TOP_N = 10
-TOP_N_FOR_WIDENING = 5
-K_SEARCH_PER_NORM = 20
-
-def obter_resposta_v5(
-    question: str, 
-    llm: ChatOpenAI, 
-    vectorstore: FAISS, 
-    bm25_retriever_full: BM25Retriever, 
-    ordered_chunks: List[Dict[str, Any]],
-    normas_selecionadas: List[str]
-) -> Dict[str, Any]:
-    """
-    Motor de RAG com foco específico, que realiza a busca apenas nas normas
-    selecionadas manualmente pelo usuário, usando filtragem por metadados.
-    Baseado na robusta pipeline v2 (Ensemble + Rerank + Widening).
-    """
-    print(f"--- INICIANDO MOTOR 'Foco Específico v1.0' ---")
-    print(f"Normas selecionadas para a busca: {normas_selecionadas}")
-
-    if not normas_selecionadas:
-        return {"answer": "Por favor, selecione ao menos uma norma para realizar a busca focada.", "source_documents": []}
-
-    docs_for_bm25_filtered = [
-        doc for doc in bm25_retriever_full.docs 
-        if doc.metadata.get('origem') in normas_selecionadas
-    ]
-    if not docs_for_bm25_filtered:
-        print("AVISO: Nenhum documento encontrado para as normas selecionadas no índice BM25.")
-        bm25_chunks = []
-    else:
-        bm25_retriever_filtered = BM25Retriever.from_documents(docs_for_bm25_filtered)
-        bm25_retriever_filtered.k = K_SEARCH_PER_NORM
-        bm25_chunks = bm25_retriever_filtered.invoke(question)
-
-    all_faiss_chunks = []
-    for norma in normas_selecionadas:
-        retriever_for_norm = vectorstore.as_retriever(
-            search_kwargs={'k': K_SEARCH_PER_NORM, 'filter': {'origem': norma}}
-        )
-        chunks_from_norm = retriever_for_norm.invoke(question)
-        all_faiss_chunks.extend(chunks_from_norm)
-
-    initial_chunks_dict = {}
-    for chunk in bm25_chunks + all_faiss_chunks:
-        initial_chunks_dict[chunk.page_content] = chunk
-    initial_chunks = list(initial_chunks_dict.values())
-
-    if not initial_chunks:
-        return {"answer": "Não encontrei trechos relevantes nas normas selecionadas para responder a essa pergunta.", "source_documents": []}
-
-
-    reranker = CohereRerank(cohere_api_key=COHERE_API_KEY, model="rerank-multilingual-v3.0", top_n=RERANKER_TOP_N)
-    reranked_chunks = reranker.compress_documents(documents=initial_chunks, query=question)
-    
-    if not reranked_chunks:
-        return {"answer": "Após o re-ranking, nenhum trecho foi considerado relevante para a pergunta.", "source_documents": []}
-
-    final_docs_dict = {}
-    for relevant_chunk in reranked_chunks[:TOP_N_FOR_WIDENING]:
-        final_docs_dict[relevant_chunk.page_content] = relevant_chunk
-        chunk_index = relevant_chunk.metadata.get('original_index')
-        if chunk_index is not None:
-            start_index = max(0, chunk_index - 1)
-            end_index = min(len(ordered_chunks), chunk_index + 2)
-            neighbor_chunks = ordered_chunks[start_index:end_index]
-            for chunk in neighbor_chunks:
-                if chunk.metadata.get('origem') in normas_selecionadas:
-                    final_docs_dict[chunk.page_content] = chunk
-    
-    final_context_docs = list(final_docs_dict.values())
-    context_text = "\n\n---\n\n".join([doc.page_content for doc in final_context_docs])
-
-    qa_prompt = PromptTemplate(template=get_config('prompt'), input_variables=["context", "question"])
-    final_chain = LLMChain(llm=llm, prompt=qa_prompt)
-    response = final_chain.invoke({"context": context_text, "question": question})
-
-    print("--- FINALIZANDO MOTOR 'Foco Específico v1.0' ---")
-    return {"answer": response['text'], "source_documents": final_context_docs}
\ No newline at end of file
+import os
+import asyncio
+from typing import List, Dict, Any, Iterator, Optional
+
+from langchain_openai import ChatOpenAI
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from cache_respostas import com_cache_de_respostas
+from eventos_stream import etapa, fontes, gerar_resposta, eventos_de_resultado, resultado_de_eventos
+from indice_bm25 import RetrieverBM25Compacto
+from pool_candidatos import PoolDeCandidatos
+from chatbot_logica_v2 import sem_documentos, cadeia_resposta
+from alargamento_contexto import ColetorDeContexto, vizinhos, MAX_TOKENS_CONTEXTO
+
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+RERANKER_TOP_N = 10
+TOP_N_FOR_WIDENING = 5
+JANELA_VIZINHOS = 1
+K_SEARCH_PER_NORM = 20
+
+RESPOSTA_SEM_NORMAS = "Por favor, selecione ao menos uma norma para realizar a busca focada."
+RESPOSTA_SEM_TRECHOS = "Não encontrei trechos relevantes nas normas selecionadas para responder a essa pergunta."
+RESPOSTA_SEM_RERANK = "Após o re-ranking, nenhum trecho foi considerado relevante para a pergunta."
+
+def _bm25_das_normas(bm25_retriever_full: RetrieverBM25Compacto, normas_selecionadas: List[str]) -> Optional[RetrieverBM25Compacto]:
+    bm25_retriever_filtered = bm25_retriever_full.filtrado('origem', normas_selecionadas)
+    if bm25_retriever_filtered is None:
+        print("AVISO: Nenhum documento encontrado para as normas selecionadas no índice BM25.")
+        return None
+    bm25_retriever_filtered.k = K_SEARCH_PER_NORM
+    return bm25_retriever_filtered
+
+def _estado_v5(bm25_chunks: List[Document], all_faiss_chunks: List[Document], ordered_chunks: List[Dict[str, Any]], normas_selecionadas: List[str]) -> Dict[str, Any]:
+    initial_chunks_dict = {}
+    for chunk in bm25_chunks + all_faiss_chunks:
+        initial_chunks_dict[chunk.page_content] = chunk
+    return {"candidatos": list(initial_chunks_dict.values()), "top_n": RERANKER_TOP_N,
+            "ordered_chunks": ordered_chunks, "normas_selecionadas": normas_selecionadas}
+
+def buscar_candidatos_v5(question: str, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto, ordered_chunks: List[Dict[str, Any]],
+                         normas_selecionadas: List[str], pool: PoolDeCandidatos) -> Dict[str, Any]:
+    """Estágio anterior ao re-ranking: BM25 nos shards das normas e busca vetorial filtrada em cada uma."""
+    bm25_retriever_filtered = _bm25_das_normas(bm25_retriever_full, normas_selecionadas)
+    bm25_chunks = bm25_retriever_filtered.invoke(question) if bm25_retriever_filtered else []
+
+    all_faiss_chunks = []
+    for norma in normas_selecionadas:
+        chunks_from_norm = pool.busca_faiss(K_SEARCH_PER_NORM, filtro={'origem': norma})
+        all_faiss_chunks.extend(chunks_from_norm)
+    return _estado_v5(bm25_chunks, all_faiss_chunks, ordered_chunks, normas_selecionadas)
+
+def montar_contexto_v5(estado: Dict[str, Any], reranked_chunks: List[Document]) -> List[Document]:
+    """Alargamento: vizinhos dos trechos mais relevantes, sem sair das normas selecionadas."""
+    ordered_chunks, normas_selecionadas = estado["ordered_chunks"], estado["normas_selecionadas"]
+    coletor = ColetorDeContexto(MAX_TOKENS_CONTEXTO)
+    for relevant_chunk in reranked_chunks[:TOP_N_FOR_WIDENING]:
+        coletor.adicionar([relevant_chunk])
+        coletor.adicionar(
+            chunk for chunk in vizinhos(relevant_chunk, ordered_chunks, janela=JANELA_VIZINHOS)
+            if chunk.metadata.get('origem') in normas_selecionadas
+        )
+    return coletor.documentos
+
+def obter_resposta_v5(
+    question: str, 
+    llm: ChatOpenAI, 
+    vectorstore: FAISS, 
+    bm25_retriever_full: RetrieverBM25Compacto, 
+    ordered_chunks: List[Dict[str, Any]],
+    normas_selecionadas: List[str]
+) -> Dict[str, Any]:
+    """
+    Motor de RAG com foco específico, que realiza a busca apenas nas normas
+    selecionadas manualmente pelo usuário, usando filtragem por metadados.
+    Baseado na robusta pipeline v2 (Ensemble + Rerank + Widening).
+    Devolve o resultado final de `obter_resposta_v5_stream`.
+    """
+    return resultado_de_eventos(obter_resposta_v5_stream(question, llm, vectorstore, bm25_retriever_full, ordered_chunks, normas_selecionadas))
+
+# --- VERSÃO ASSÍNCRONA ---
+
+async def buscar_candidatos_v5_async(question: str, vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto, ordered_chunks: List[Dict[str, Any]],
+                                     normas_selecionadas: List[str], pool: PoolDeCandidatos) -> Dict[str, Any]:
+    """Versão assíncrona de `buscar_candidatos_v5`: o BM25 e as buscas vetoriais de cada norma rodam juntos."""
+    async def busca_bm25() -> List[Document]:
+        bm25_retriever_filtered = _bm25_das_normas(bm25_retriever_full, normas_selecionadas)
+        return await bm25_retriever_filtered.ainvoke(question) if bm25_retriever_filtered else []
+
+    bm25_chunks, *faiss_por_norma = await asyncio.gather(
+        busca_bm25(), *(pool.abusca_faiss(K_SEARCH_PER_NORM, filtro={'origem': norma}) for norma in normas_selecionadas))
+    return _estado_v5(bm25_chunks, [chunk for chunks in faiss_por_norma for chunk in chunks], ordered_chunks, normas_selecionadas)
+
+@com_cache_de_respostas("v5")
+async def obter_resposta_v5_async(
+    question: str,
+    llm: ChatOpenAI,
+    vectorstore: FAISS,
+    bm25_retriever_full: RetrieverBM25Compacto,
+    ordered_chunks: List[Dict[str, Any]],
+    normas_selecionadas: List[str]
+) -> Dict[str, Any]:
+    """Versão assíncrona de `obter_resposta_v5`."""
+    print(f"--- INICIANDO MOTOR 'Foco Específico v1.0' (assíncrono) ---")
+    print(f"Normas selecionadas para a busca: {normas_selecionadas}")
+
+    if not normas_selecionadas:
+        return sem_documentos(RESPOSTA_SEM_NORMAS)
+
+    pool = PoolDeCandidatos(question, vectorstore, bm25_retriever_full)
+    estado = await buscar_candidatos_v5_async(question, vectorstore, bm25_retriever_full, ordered_chunks, normas_selecionadas, pool)
+    if not estado["candidatos"]:
+        return sem_documentos(RESPOSTA_SEM_TRECHOS)
+
+    reranked_chunks = await pool.areranquear(estado["candidatos"], estado["top_n"])
+    if not reranked_chunks:
+        return sem_documentos(RESPOSTA_SEM_RERANK)
+
+    final_context_docs = montar_contexto_v5(estado, reranked_chunks)
+    final_chain, entrada = cadeia_resposta(question, llm, final_context_docs)
+    answer = await final_chain.ainvoke(entrada)
+
+    print("--- FINALIZANDO MOTOR 'Foco Específico v1.0' (assíncrono) ---")
+    return {"answer": answer, "source_documents": final_context_docs}
+
+# --- VERSÃO EM STREAMING ---
+
+@com_cache_de_respostas("v5")
+def obter_resposta_v5_stream(
+    question: str,
+    llm: ChatOpenAI,
+    vectorstore: FAISS,
+    bm25_retriever_full: RetrieverBM25Compacto,
+    ordered_chunks: List[Dict[str, Any]],
+    normas_selecionadas: List[str]
+) -> Iterator[Dict[str, Any]]:
+    """Pipeline do motor em eventos de etapa e tokens da resposta (veja eventos_stream)."""
+    print(f"--- INICIANDO MOTOR 'Foco Específico v1.0' ---")
+    print(f"Normas selecionadas para a busca: {normas_selecionadas}")
+
+    if not normas_selecionadas:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_NORMAS))
+        return
+
+    yield etapa("recuperacao", f"Buscando nas normas selecionadas: {', '.join(normas_selecionadas)}")
+    pool = PoolDeCandidatos(question, vectorstore, bm25_retriever_full)
+    estado = buscar_candidatos_v5(question, vectorstore, bm25_retriever_full, ordered_chunks, normas_selecionadas, pool)
+    if not estado["candidatos"]:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_TRECHOS))
+        return
+
+    yield etapa("rerank", f"Re-rankeando {len(estado['candidatos'])} trechos candidatos...")
+    reranked_chunks = pool.reranquear(estado["candidatos"], estado["top_n"])
+    if not reranked_chunks:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_RERANK))
+        return
+
+    final_context_docs = montar_contexto_v5(estado, reranked_chunks)
+    yield fontes(final_context_docs)
+
+    yield etapa("geracao", "Gerando a resposta...")
+    yield from gerar_resposta(*cadeia_resposta(question, llm, final_context_docs), final_context_docs)
+    print("--- FINALIZANDO MOTOR 'Foco Específico v1.0' ---")
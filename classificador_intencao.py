@@ -0,0 +1,197 @@
+import os
+import json
+import threading
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import joblib
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+CONSULTA_NORMATIVA = "Consulta Normativa"
+CONSULTA_FACTUAL = "Consulta Factual"
+INTENCOES = (CONSULTA_NORMATIVA, CONSULTA_FACTUAL)
+
+CAMINHO_MODELO_INTENCAO = os.getenv("INTENCAO_MODELO_PATH", "classificador_intencao.joblib")
+CAMINHO_ROTULOS_INTENCAO = os.getenv("INTENCAO_ROTULOS_PATH", "intencoes_rotuladas.json")
+ARQUIVOS_PERGUNTAS = ("respostas_corretas.json", "respostas_incorretas.json")
+LIMIAR_CONFIANCA = float(os.getenv("INTENCAO_LIMIAR_CONFIANCA", "0.8"))
+MIN_EXEMPLOS_POR_INTENCAO = 5
+
+ROUTER_PROMPT_TEMPLATE = """
+Sua tarefa é classificar a pergunta do usuário em uma de duas categorias, com base em sua intenção. Responda apenas com o nome da categoria.
+
+Categorias:
+- "Consulta Normativa": A pergunta envolve a interpretação, cálculo, aplicação ou detalhes de uma lei, regra, norma, resolução ou artigo.
+- "Consulta Factual": A pergunta busca uma definição, descrição ou informação geral sobre uma entidade, pessoa, produto ou conceito.
+
+Pergunta do Usuário:
+"{question}"
+
+Categoria:
+"""
+
+# --- RESPOSTA DO LLM ---
+
+def _sem_acentos(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def interpretar_intencao(resposta: str) -> Optional[str]:
+    """
+    Intenção na resposta do LLM, tolerante a aspas, caixa, acentos, pontuação e texto
+    extra ("Categoria: consulta factual."). None se ela citar nenhuma ou as duas.
+    """
+    texto = _sem_acentos(resposta)
+    encontradas = [intencao for intencao, termo in ((CONSULTA_NORMATIVA, "normativ"), (CONSULTA_FACTUAL, "factual")) if termo in texto]
+    return encontradas[0] if len(encontradas) == 1 else None
+
+def _cadeia_roteador(llm: Any):
+    return PromptTemplate.from_template(ROUTER_PROMPT_TEMPLATE) | llm | StrOutputParser()
+
+def classificar_com_llm(question: str, llm: Any) -> Optional[str]:
+    return interpretar_intencao(_cadeia_roteador(llm).invoke({"question": question}))
+
+async def aclassificar_com_llm(question: str, llm: Any) -> Optional[str]:
+    return interpretar_intencao(await _cadeia_roteador(llm).ainvoke({"question": question}))
+
+# --- TREINAMENTO ---
+
+def perguntas_registradas(arquivos: Iterable[str] = ARQUIVOS_PERGUNTAS) -> List[str]:
+    """Perguntas distintas gravadas pelo feedback dos apps (save_feedback), na ordem dos arquivos."""
+    perguntas = {}
+    for arquivo in arquivos:
+        if not os.path.exists(arquivo):
+            continue
+        with open(arquivo, "r", encoding="utf-8") as f:
+            try:
+                registros = json.load(f)
+            except json.JSONDecodeError:
+                print(f"⚠️ Aviso: '{arquivo}' não é um JSON válido e foi ignorado.")
+                continue
+        for registro in registros:
+            pergunta = (registro.get("question") or "").strip()
+            if pergunta:
+                perguntas.setdefault(pergunta, None)
+    return list(perguntas)
+
+def rotular_perguntas(perguntas: List[str], llm: Any, caminho_rotulos: str = CAMINHO_ROTULOS_INTENCAO) -> Dict[str, str]:
+    """
+    Rótulos de intenção das perguntas. Os registros de feedback não têm rótulo, então o
+    LLM do roteador rotula cada pergunta uma única vez; os rótulos ficam em `caminho_rotulos`
+    (que também pode ser corrigido à mão) e só as perguntas novas voltam ao LLM.
+    """
+    rotulos = {}
+    if os.path.exists(caminho_rotulos):
+        with open(caminho_rotulos, "r", encoding="utf-8") as f:
+            rotulos = json.load(f)
+
+    novas = [p for p in perguntas if p not in rotulos]
+    if novas:
+        print(f"-> Rotulando {len(novas)} perguntas novas com o LLM...")
+        for resposta, pergunta in zip(_cadeia_roteador(llm).batch([{"question": p} for p in novas]), novas):
+            intencao = interpretar_intencao(resposta)
+            if intencao:
+                rotulos[pergunta] = intencao
+            else:
+                print(f"⚠️ Aviso: rótulo ignorado para '{pergunta}': {resposta!r}")
+        with open(caminho_rotulos, "w", encoding="utf-8") as f:
+            json.dump(rotulos, f, ensure_ascii=False, indent=4)
+    return {p: rotulos[p] for p in perguntas if rotulos.get(p) in INTENCOES}
+
+def treinar_classificador(llm: Any, arquivos: Iterable[str] = ARQUIVOS_PERGUNTAS, caminho_modelo: str = CAMINHO_MODELO_INTENCAO,
+                          caminho_rotulos: str = CAMINHO_ROTULOS_INTENCAO) -> Optional["ClassificadorIntencao"]:
+    """
+    Treina TF-IDF (n-gramas de caracteres, robustos a flexões e erros de digitação) +
+    regressão logística com as perguntas registradas e grava o modelo em `caminho_modelo`.
+    Devolve None se alguma intenção tiver menos de MIN_EXEMPLOS_POR_INTENCAO exemplos.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+
+    rotulos = rotular_perguntas(perguntas_registradas(arquivos), llm, caminho_rotulos)
+    contagem = {intencao: sum(1 for r in rotulos.values() if r == intencao) for intencao in INTENCOES}
+    print(f"-> Exemplos por intenção: {contagem}")
+    if min(contagem.values()) < MIN_EXEMPLOS_POR_INTENCAO:
+        print(f"⚠️ Aviso: são necessários ao menos {MIN_EXEMPLOS_POR_INTENCAO} exemplos de cada intenção. Classificador não treinado.")
+        return None
+
+    modelo = make_pipeline(
+        TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 5), strip_accents="unicode", lowercase=True, sublinear_tf=True),
+        LogisticRegression(C=10.0, class_weight="balanced", max_iter=1000),
+    )
+    modelo.fit(list(rotulos), list(rotulos.values()))
+    joblib.dump(modelo, caminho_modelo)
+    print(f"✅ Classificador de intenção salvo em '{caminho_modelo}'.")
+    return ClassificadorIntencao(modelo)
+
+# --- CLASSIFICAÇÃO ---
+
+class ClassificadorIntencao:
+    """Classificador local (CPU) de intenção: um pipeline scikit-learn com `predict_proba`."""
+
+    def __init__(self, modelo: Any):
+        self.modelo = modelo
+
+    @classmethod
+    def carregar(cls, caminho_modelo: str = CAMINHO_MODELO_INTENCAO) -> Optional["ClassificadorIntencao"]:
+        if not os.path.exists(caminho_modelo):
+            return None
+        try:
+            return cls(joblib.load(caminho_modelo))
+        except Exception as e:
+            print(f"AVISO: Classificador de intenção indisponível ({e}); usando o LLM.")
+            return None
+
+    def prever(self, question: str) -> Tuple[str, float]:
+        """(intenção mais provável, probabilidade)."""
+        probabilidades = self.modelo.predict_proba([question])[0]
+        melhor = int(probabilidades.argmax())
+        return str(self.modelo.classes_[melhor]), float(probabilidades[melhor])
+
+_classificador: Optional[ClassificadorIntencao] = None
+_carregado = False
+_lock_classificador = threading.Lock()
+
+def obter_classificador() -> Optional[ClassificadorIntencao]:
+    """Classificador do processo, carregado de INTENCAO_MODELO_PATH na primeira chamada (None se não houver)."""
+    global _classificador, _carregado
+    with _lock_classificador:
+        if not _carregado:
+            _classificador = ClassificadorIntencao.carregar()
+            _carregado = True
+        return _classificador
+
+def _previsao_local(question: str) -> Optional[Tuple[str, float]]:
+    classificador = obter_classificador()
+    if classificador is None:
+        return None
+    intencao, confianca = classificador.prever(question)
+    print(f"--> Classificador local: {intencao} (confiança {confianca:.2f})")
+    return intencao, confianca
+
+def classificar_intencao(question: str, llm: Any) -> Tuple[Optional[str], str]:
+    """
+    (intenção, origem). O classificador local decide quando a confiança atinge
+    LIMIAR_CONFIANCA; abaixo dele (ou sem modelo treinado) a pergunta vai ao LLM.
+    Intenção None quando nem o LLM dá uma resposta reconhecível.
+    """
+    previsao = _previsao_local(question)
+    if previsao and previsao[1] >= LIMIAR_CONFIANCA:
+        return previsao[0], "classificador local"
+    return classificar_com_llm(question, llm), "LLM"
+
+async def aclassificar_intencao(question: str, llm: Any) -> Tuple[Optional[str], str]:
+    previsao = _previsao_local(question)
+    if previsao and previsao[1] >= LIMIAR_CONFIANCA:
+        return previsao[0], "classificador local"
+    return await aclassificar_com_llm(question, llm), "LLM"
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from clientes_llm import obter_llm_openai
+    from configs_v2 import MODEL_NAME
+
+    load_dotenv()
+    treinar_classificador(obter_llm_openai(MODEL_NAME, 0))
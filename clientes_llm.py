@@ -0,0 +1,415 @@
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+import email.utils
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional, Union
+
+import httpx
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.globals import get_llm_cache
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from cache_llm import obter_cache_llm
+
+MAX_CONCORRENCIA = {
+    "openai": int(os.getenv("LLM_MAX_CONCORRENCIA_OPENAI", "16")),
+    "cohere": int(os.getenv("LLM_MAX_CONCORRENCIA_COHERE", "8")),
+}
+MAX_TENTATIVAS = int(os.getenv("LLM_MAX_TENTATIVAS", "5"))
+BACKOFF_BASE_SEGUNDOS = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+BACKOFF_MAX_SEGUNDOS = float(os.getenv("LLM_BACKOFF_MAX", "30.0"))
+MAX_CONEXOES_HTTP = int(os.getenv("LLM_MAX_CONEXOES_HTTP", "32"))
+TIMEOUT_HTTP_SEGUNDOS = float(os.getenv("LLM_TIMEOUT", "120"))
+MODELO_SINTESE_COHERE = "command-r-plus-08-2024"
+# O SDK da Cohere repete sozinho as chamadas com falha (2 vezes por padrão); só dá para
+# desligar por chamada, com `request_options`. Quem repete é o LimitadorProvedor.
+OPCOES_REQUISICAO_COHERE = {"max_retries": 0}
+
+STATUS_RETENTAVEIS = {408, 409, 429, 500, 502, 503, 504, 529}
+NOMES_ERROS_RETENTAVEIS = ("RateLimit", "TooManyRequests", "Timeout", "Connection", "ServiceUnavailable", "InternalServer", "Overloaded")
+_DURACAO = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_SEGUNDOS_POR_UNIDADE = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+# --- ERROS E CABEÇALHOS DE RATE LIMIT ---
+
+def _status(erro: Exception) -> Optional[int]:
+    status = getattr(erro, "status_code", None) or getattr(getattr(erro, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def _cabecalhos(erro: Exception) -> Dict[str, str]:
+    cabecalhos = getattr(erro, "headers", None) or getattr(getattr(erro, "response", None), "headers", None) or {}
+    try:
+        return {str(k).lower(): str(v) for k, v in cabecalhos.items()}
+    except AttributeError:
+        return {}
+
+def erro_retentavel(erro: Exception) -> bool:
+    """429, 5xx, timeouts e falhas de conexão; erros de requisição (400, 401, 404...) sobem na hora."""
+    status = _status(erro)
+    if status is not None:
+        return status in STATUS_RETENTAVEIS
+    return any(nome in type(erro).__name__ for nome in NOMES_ERROS_RETENTAVEIS)
+
+def _duracao(texto: str) -> Optional[float]:
+    """Durações da OpenAI ('1s', '6m0s', '20ms') em segundos."""
+    partes = _DURACAO.findall(texto)
+    return sum(float(n) * _SEGUNDOS_POR_UNIDADE[u] for n, u in partes) if partes else None
+
+def espera_sugerida(erro: Exception) -> Optional[float]:
+    """
+    Segundos pedidos pelo provedor: `retry-after-ms`, `retry-after` (segundos ou data HTTP)
+    ou, num 429 sem eles, o maior `x-ratelimit-reset-*` (OpenAI).
+    """
+    cabecalhos = _cabecalhos(erro)
+    if "retry-after-ms" in cabecalhos:
+        try:
+            return float(cabecalhos["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in cabecalhos:
+        valor = cabecalhos["retry-after"]
+        try:
+            return float(valor)
+        except ValueError:
+            data = email.utils.parsedate_to_datetime(valor) if valor else None
+            if data is not None:
+                return max(0.0, data.timestamp() - time.time())
+    if _status(erro) == 429:
+        resets = [_duracao(v) for k, v in cabecalhos.items() if k.startswith("x-ratelimit-reset")]
+        resets = [r for r in resets if r is not None]
+        if resets:
+            return max(resets)
+    return None
+
+def tempo_de_espera(tentativa: int, erro: Exception) -> float:
+    """Backoff exponencial com jitter total; se o provedor pediu um tempo, ele é o mínimo."""
+    jitter = random.uniform(0, min(BACKOFF_MAX_SEGUNDOS, BACKOFF_BASE_SEGUNDOS * 2 ** tentativa))
+    sugerida = espera_sugerida(erro)
+    return jitter if sugerida is None else min(BACKOFF_MAX_SEGUNDOS, sugerida) + jitter * 0.1
+
+# --- LIMITE DE CONCORRÊNCIA E RETENTATIVAS POR PROVEDOR ---
+
+class SemaforoJusto:
+    """
+    Semáforo do processo para threads e event loops, com fila por ordem de chegada: quem
+    libera uma vaga a entrega direto ao primeiro da fila (o Event de uma thread ou o
+    Future de uma corrotina, no loop dela), sem espera ativa.
+    """
+
+    def __init__(self, vagas: int):
+        self._vagas = vagas
+        self._lock = threading.Lock()
+        self._fila: Deque[Union[threading.Event, asyncio.Future]] = deque()
+
+    def _vaga_livre(self) -> bool:
+        if self._vagas and not self._fila:
+            self._vagas -= 1
+            return True
+        return False
+
+    def acquire(self):
+        with self._lock:
+            if self._vaga_livre():
+                return
+            evento = threading.Event()
+            self._fila.append(evento)
+        evento.wait()
+
+    async def aacquire(self):
+        with self._lock:
+            if self._vaga_livre():
+                return
+            futuro = asyncio.get_running_loop().create_future()
+            self._fila.append(futuro)
+        try:
+            await futuro
+        except asyncio.CancelledError:
+            with self._lock:
+                entregue = futuro not in self._fila
+                if not entregue:
+                    self._fila.remove(futuro)
+            if entregue:  # a vaga chegou junto com o cancelamento: passa adiante
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._fila:
+                proximo = self._fila.popleft()
+                if isinstance(proximo, threading.Event):
+                    proximo.set()
+                    return
+                try:
+                    proximo.get_loop().call_soon_threadsafe(_entregar_vaga, proximo)
+                    return
+                except RuntimeError:
+                    continue  # loop já fechado
+            self._vagas += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *erro):
+        self.release()
+
+def _entregar_vaga(futuro: asyncio.Future):
+    if not futuro.done():
+        futuro.set_result(None)
+
+class LimitadorProvedor:
+    """
+    Chamadas simultâneas de um provedor limitadas por um semáforo do processo (threads e
+    event loops). Um 429 com tempo de espera pausa o provedor inteiro até lá: as outras
+    chamadas esperam em vez de bater no limite de novo.
+    """
+
+    def __init__(self, nome: str, max_concorrencia: int):
+        self.nome = nome
+        self._semaforo = SemaforoJusto(max_concorrencia)
+        self._lock = threading.Lock()
+        self._pausado_ate = 0.0
+
+    def _pausa_restante(self) -> float:
+        with self._lock:
+            return max(0.0, self._pausado_ate - time.monotonic())
+
+    def _registrar_falha(self, erro: Exception, espera: float):
+        if _status(erro) == 429:
+            with self._lock:
+                self._pausado_ate = max(self._pausado_ate, time.monotonic() + espera)
+
+    def _espera_ou_erro(self, erro: Exception, tentativa: int, iniciado: bool = False) -> float:
+        """Tempo até a próxima tentativa; relança `erro` se ele não for retentável ou as tentativas acabaram."""
+        if iniciado or not erro_retentavel(erro) or tentativa == MAX_TENTATIVAS - 1:
+            raise erro
+        espera = tempo_de_espera(tentativa, erro)
+        self._registrar_falha(erro, espera)
+        print(f"AVISO: {self.nome}: {type(erro).__name__} ({_status(erro) or 'sem status'}); nova tentativa em {espera:.1f}s.")
+        return espera
+
+    def chamar(self, funcao: Callable[[], Any]) -> Any:
+        for tentativa in range(MAX_TENTATIVAS):
+            time.sleep(self._pausa_restante())
+            with self._semaforo:
+                try:
+                    return funcao()
+                except Exception as e:
+                    espera = self._espera_ou_erro(e, tentativa)
+            time.sleep(espera)
+
+    async def achamar(self, funcao: Callable[[], Any]) -> Any:
+        for tentativa in range(MAX_TENTATIVAS):
+            await asyncio.sleep(self._pausa_restante())
+            await self._semaforo.aacquire()
+            try:
+                return await funcao()
+            except Exception as e:
+                espera = self._espera_ou_erro(e, tentativa)
+            finally:
+                self._semaforo.release()
+            await asyncio.sleep(espera)
+
+    def transmitir(self, abrir: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        """Stream com a vaga do semáforo até o fim; só há nova tentativa se a falha vier antes do primeiro pedaço."""
+        for tentativa in range(MAX_TENTATIVAS):
+            time.sleep(self._pausa_restante())
+            with self._semaforo:
+                iniciado = False
+                try:
+                    for parte in abrir():
+                        iniciado = True
+                        yield parte
+                    return
+                except Exception as e:
+                    espera = self._espera_ou_erro(e, tentativa, iniciado)
+            time.sleep(espera)
+
+    async def atransmitir(self, abrir: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        for tentativa in range(MAX_TENTATIVAS):
+            await asyncio.sleep(self._pausa_restante())
+            await self._semaforo.aacquire()
+            iniciado = False
+            try:
+                async for parte in abrir():
+                    iniciado = True
+                    yield parte
+                return
+            except Exception as e:
+                espera = self._espera_ou_erro(e, tentativa, iniciado)
+            finally:
+                self._semaforo.release()
+            await asyncio.sleep(espera)
+
+_limitadores: Dict[str, LimitadorProvedor] = {}
+_lock_limitadores = threading.Lock()
+
+def limitador(provedor: str) -> LimitadorProvedor:
+    with _lock_limitadores:
+        if provedor not in _limitadores:
+            _limitadores[provedor] = LimitadorProvedor(provedor, MAX_CONCORRENCIA.get(provedor, 8))
+        return _limitadores[provedor]
+
+# --- MODELOS COM LIMITES ---
+
+class ChatComLimites(BaseChatModel):
+    """
+    Chat model que delega a `modelo` passando pelo LimitadorProvedor de `provedor`. Serve
+    em qualquer cadeia LCEL (invoke, ainvoke, stream, batch) no lugar do modelo original.
+    Com LLM_CACHE_MODO ligado, os clientes do processo consultam o cache de LLM antes do limitador,
+    também nos streams (o LangChain só o consulta em invoke/ainvoke/batch): um acerto vem
+    num único pedaço, e um stream completo é gravado com a mesma chave de um `invoke`.
+    `argumentos_modelo` vão em toda chamada a `modelo` (ex.: `request_options` da Cohere).
+    """
+    modelo: BaseChatModel
+    provedor: str
+    argumentos_modelo: Dict[str, Any] = Field(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"limitado-{self.modelo._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        # Entram na chave do cache de LLM (cache_llm): provedor, modelo e parâmetros do original.
+        return {"provedor": self.provedor, **self.modelo._identifying_params}
+
+    @property
+    def model_name(self) -> Optional[str]:
+        return getattr(self.modelo, "model_name", None) or getattr(self.modelo, "model", None)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return limitador(self.provedor).chamar(lambda: self.modelo._generate(messages, stop=stop, run_manager=run_manager, **{**self.argumentos_modelo, **kwargs}))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return await limitador(self.provedor).achamar(lambda: self.modelo._agenerate(messages, stop=stop, run_manager=run_manager, **{**self.argumentos_modelo, **kwargs}))
+
+    def _cache_de_chamadas(self) -> Optional[BaseCache]:
+        """O cache que o `invoke` consultaria: o próprio, o global (cache=None) ou nenhum."""
+        if isinstance(self.cache, BaseCache):
+            return self.cache
+        return get_llm_cache() if self.cache is None or self.cache is True else None
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        cache = self._cache_de_chamadas()
+        if cache is not None:
+            chave = (dumps(messages), self._get_llm_string(stop=stop, **kwargs))
+            gravado = cache.lookup(*chave)
+            if gravado:
+                yield _pedaco_gravado(gravado)
+                return
+        partes = []
+        for parte in limitador(self.provedor).transmitir(lambda: self.modelo._stream(messages, stop=stop, run_manager=run_manager, **{**self.argumentos_modelo, **kwargs})):
+            partes.append(parte)
+            yield parte
+        if cache is not None and partes:
+            cache.update(*chave, generate_from_stream(iter(partes)).generations)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        cache = self._cache_de_chamadas()
+        if cache is not None:
+            chave = (dumps(messages), self._get_llm_string(stop=stop, **kwargs))
+            gravado = await cache.alookup(*chave)
+            if gravado:
+                yield _pedaco_gravado(gravado)
+                return
+        partes = []
+        async for parte in limitador(self.provedor).atransmitir(lambda: self.modelo._astream(messages, stop=stop, run_manager=run_manager, **{**self.argumentos_modelo, **kwargs})):
+            partes.append(parte)
+            yield parte
+        if cache is not None and partes:
+            await cache.aupdate(*chave, generate_from_stream(iter(partes)).generations)
+
+def _pedaco_gravado(geracoes: List[Any]) -> ChatGenerationChunk:
+    """Resposta do cache de LLM como um único pedaço de stream."""
+    return ChatGenerationChunk(message=AIMessageChunk(content=geracoes[0].text), generation_info=geracoes[0].generation_info)
+
+class EmbeddingsComLimites(Embeddings):
+    """Embeddings pelo LimitadorProvedor; expõe `model`/`dimensions` do original para o EmbeddingsComCache."""
+
+    def __init__(self, embeddings: Embeddings, provedor: str):
+        self.embeddings = embeddings
+        self.provedor = provedor
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.dimensions = getattr(embeddings, "dimensions", None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return limitador(self.provedor).chamar(lambda: self.embeddings.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return limitador(self.provedor).chamar(lambda: self.embeddings.embed_query(text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await limitador(self.provedor).achamar(lambda: self.embeddings.aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await limitador(self.provedor).achamar(lambda: self.embeddings.aembed_query(text))
+
+# --- CLIENTES DO PROCESSO ---
+
+_clientes: Dict[Any, Any] = {}
+_lock_clientes = threading.RLock()  # `criar` de _uma_vez pode chamar cliente_http_openai
+_http_openai: Optional[httpx.Client] = None
+
+def _uma_vez(chave: Any, criar: Callable[[], Any]) -> Any:
+    with _lock_clientes:
+        if chave not in _clientes:
+            _clientes[chave] = criar()
+        return _clientes[chave]
+
+def cliente_http_openai() -> httpx.Client:
+    """Pool de conexões HTTP (keep-alive) compartilhado por todos os clientes síncronos da OpenAI."""
+    global _http_openai
+    with _lock_clientes:
+        if _http_openai is None:
+            _http_openai = httpx.Client(
+                limits=httpx.Limits(max_connections=MAX_CONEXOES_HTTP, max_keepalive_connections=MAX_CONEXOES_HTTP),
+                timeout=TIMEOUT_HTTP_SEGUNDOS,
+            )
+        return _http_openai
+
+def obter_llm_openai(model_name: str, temperature: float = 0, api_key: Optional[str] = None) -> ChatComLimites:
+    """
+    ChatOpenAI do processo para o modelo, com as retentativas do SDK desligadas (quem
+    repete é o LimitadorProvedor, respeitando os cabeçalhos de rate limit).
+    """
+    def criar():
+        from langchain_openai import ChatOpenAI
+        modelo = ChatOpenAI(model_name=model_name, temperature=temperature, openai_api_key=api_key or os.getenv("OPENAI_API_KEY"),
+                            max_retries=0, http_client=cliente_http_openai())
+        return ChatComLimites(modelo=modelo, provedor="openai", cache=obter_cache_llm())
+    return _uma_vez(("openai", model_name, temperature), criar)
+
+def obter_embeddings_openai(model: str, api_key: Optional[str] = None, **kwargs: Any) -> EmbeddingsComLimites:
+    def criar():
+        from langchain_openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings(model=model, openai_api_key=api_key or os.getenv("OPENAI_API_KEY"),
+                                      max_retries=0, http_client=cliente_http_openai(), **kwargs)
+        return EmbeddingsComLimites(embeddings, "openai")
+    return _uma_vez(("openai-embeddings", model, tuple(sorted(kwargs.items()))), criar)
+
+def obter_llm_cohere(model: str = MODELO_SINTESE_COHERE, temperature: float = 0) -> ChatComLimites:
+    """
+    ChatCohere do processo (um cliente HTTP reaproveitado entre as requisições), com as
+    retentativas do SDK desligadas em cada chamada (OPCOES_REQUISICAO_COHERE).
+    """
+    def criar():
+        from langchain_cohere import ChatCohere
+        modelo = ChatCohere(model=model, temperature=temperature, cohere_api_key=os.getenv("COHERE_API_KEY"))
+        return ChatComLimites(modelo=modelo, provedor="cohere", cache=obter_cache_llm(),
+                              argumentos_modelo={"request_options": OPCOES_REQUISICAO_COHERE})
+    return _uma_vez(("cohere", model, temperature), criar)
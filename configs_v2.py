@@ -1,209 +1,300 @@
-import streamlit as st
-
-MODEL_NAME = "o1-preview" # "gpt-4o"
-
-# Mantenha o QA_TEMPLATE original
-'''QA_TEMPLATE = """
-Você é um analista regulatório sênior do Banco Central do Brasil, especializado em fornecer respostas precisas, bem-fundamentadas e rastreáveis, baseadas exclusivamente no contexto fornecido.
-
-**Instrução Mestra de Hierarquia:**
-Sua tarefa mais importante é identificar a regra MAIS ESPECÍFICA para a pergunta. Regras de capítulos, seções ou artigos que tratam diretamente do assunto da pergunta prevalecem sobre regras de capítulos mais gerais.
-
-**Siga rigorosamente esta estrutura para sua resposta:**
-
-**1. Análise dos Fatos:**
-- Liste os artigos e parágrafos do contexto que são potencialmente relevantes para a pergunta, agrupando-os por norma de origem.
-
-**2. Dedução Lógica:**
-- **A. Categorização do Assunto:** Inicie por categorizar de forma clara e objetiva o tema central da pergunta (ex: "O ativo em questão é um título de securitização", "A pergunta trata dos requerimentos de capital para instituições do S2").
-
-- **B. Identificação e Justificativa da Regra Principal:** Com base na "Instrução Mestra de Hierarquia", compare os artigos relevantes e justifique textualmente qual deles constitui a regra principal para responder à pergunta e por quê.
-
-- **C. Análise Detalhada da Regra Principal:** Uma vez identificada a regra principal, explique seu funcionamento em detalhe:
-    - Descreva o mecanismo central ou a exigência da regra.
-    - Aponte quaisquer **condições, exceções, pisos ou tetos** que a própria regra principal estabelece.
-    - Explique como outros artigos (se aplicável) servem como **parâmetros ou fontes de informação** para a regra principal (ex: um artigo define um cálculo, enquanto outro fornece o percentual a ser usado nesse cálculo).
-
-**3. Conclusão Final Sintetizada:**
-- Resuma sua análise em uma resposta direta, clara e objetiva para a pergunta original do usuário, reafirmando a regra principal que fundamenta a conclusão.
-
-**Regra de Segurança:**
-Se o contexto não contiver a regra específica necessária para a sua dedução, ou se as informações forem insuficientes, declare isso claramente e não tente formular uma resposta incompleta.
-
----
-**Contexto Fornecido:**
-{context}
-
----
-**Pergunta do Usuário:**
-{question}
-"""'''
-
-QA_TEMPLATE = """
-Você é um especialista em normas bancárias do BACEN.
-Use apenas o contexto extraído das resoluções (normas) para responder à pergunta e pense com calma (revisão os processos e a lógica).
-Para responder a qualquer pergunta do usuário envolvendo normas, siga rigorosamente esta estrutura:
-
-1) **Norma e Seção**:
-   - Informe o nome completo da norma (ex.: Resolução BCB nº X/ANO) e a seção exata (artigo e parágrafo) aplicáveis.
-
-2) **Texto Literal**:
-   - Apresente o(s) trecho(s) exato(s) da(s) norma(s) identificado(s) no item 1.
-
-3) **Explicação**:
-   - Forneça uma interpretação clara e objetiva do trecho legal, destacando como ele responde à pergunta.
-
-4) **Conclusão**:
-   - Responda à pergunta do usuário citando todos os possíveis cenários e resumindo o principal ponto aplicável.
-
-Contexto extraído:
-{context}
-
-Pergunta do usuário:
-{question}
-"""
-
-# Mantenha o FINAL_FORMATTER_TEMPLATE original
-'''FINAL_FORMATTER_TEMPLATE = """
-Você é um redator técnico sênior do Banco Central do Brasil, especializado em formatar análises complexas em um formato padronizado e claro.
-
-Sua única tarefa é pegar a "Análise Consolidada" que foi pré-aprovada e verificada, e reformatá-la para seguir rigorosamente a estrutura do "Template de Resposta Final".
-
-Não adicione nenhuma informação nova, não altere a lógica e não faça novas deduções. Apenas formate o conteúdo fornecido.
-
----
-**Análise Consolidada (Conteúdo a ser formatado):**
-{verified_analysis}
-
----
-**Template de Resposta Final (Estrutura a ser seguida):**
-
-**1. Análise dos Fatos:**
-- Liste os artigos e parágrafos do contexto que são potencialmente relevantes para a pergunta, agrupando-os por norma de origem.
-
-**2. Dedução Lógica (Análise Central):**
-- **A. Categorização do Assunto:** Inicie por categorizar de forma clara e objetiva o tema central da pergunta.
-- **B. Identificação e Justificativa da Regra Principal:** Compare os artigos relevantes e justifique textualmente qual deles constitui a regra principal.
-- **C. Análise Detalhada da Regra Principal:** Explique o funcionamento da regra principal, suas condições, exceções e como outros artigos servem como parâmetros.
-
-**3. Conclusão Final Sintetizada:**
-- Resuma a análise em uma resposta direta e clara para a pergunta original do usuário.
-
----
-**Pergunta Original do Usuário (para contexto):**
-{question}
-
----
-**Sua Resposta Final (Análise Consolidada formatada conforme o template):**
-"""'''
-
-FINAL_FORMATTER_TEMPLATE = """
-Você é um redator técnico sênior do Banco Central do Brasil, especializado em formatar análises complexas em um formato padronizado e claro.
-
-Sua única tarefa é pegar a "Análise Consolidada" que foi pré-aprovada e verificada, e reformatá-la para seguir rigorosamente a estrutura do "Template de Resposta Final".
-
-Não adicione nenhuma informação nova, não altere a lógica e não faça novas deduções. Apenas formate o conteúdo fornecido.
-
----
-**Análise Consolidada (Conteúdo a ser formatado):**
-{verified_analysis}
-
----
-**Template de Resposta Final (Estrutura a ser seguida):**
-
-1) **Norma e Seção**:
-   - Informe o nome completo da norma (ex.: Resolução BCB nº X/ANO) e a seção exata (artigo e parágrafo) aplicáveis.
-
-2) **Texto Literal**:
-   - Apresente o(s) trecho(s) exato(s) da(s) norma(s) identificado(s) no item 1.
-
-3) **Explicação**:
-   - Forneça uma interpretação clara e objetiva do trecho legal, destacando como ele responde à pergunta.
-
-4) **Conclusão**:
-   - Responda à pergunta do usuário citando todos os possíveis cenários e resumindo o principal ponto aplicável.
-
----
-**Pergunta Original do Usuário (para contexto):**
-{question}
-
----
-**Sua Resposta Final (Análise Consolidada formatada conforme o template):**
-"""
-
-# --- TEMPLATE REFINADO COM BASE NOS SEUS EXEMPLOS ---
-METADATA_EXTRACTOR_TEMPLATE = """
-Sua tarefa é atuar como um especialista em roteamento de queries para um banco de dados de normas do Banco Central. Analise a "Pergunta do Usuário" e extraia metadados relevantes para filtrar a busca.
-
-Você DEVE retornar a resposta como um objeto JSON. As chaves válidas para o JSON são: "tipo_norma", "numero_norma", "termo_tecnico", "artigo".
-
-**REGRAS:**
-1.  Se a pergunta não contiver informação para uma chave, omita a chave do JSON.
-2.  Se nenhum metadado relevante for encontrado, retorne um objeto JSON vazio: {}.
-3.  Normalize os valores: 'resolução' ou 'res' deve virar 'resolucao'. 'circular' ou 'circ' deve virar 'circular'.
-4.  Para 'artigo', extraia apenas o número (ex: de "Art. 15", extraia "15").
-5.  Para 'termo_tecnico', extraia o conceito, sigla ou tema principal que define o assunto da pergunta. Se houver múltiplos, extraia o mais importante.
-
-**EXEMPLOS:**
-
-Pergunta do Usuário: "Qual o tratamento para o risco de crédito segundo a resolução 4958?"
-Sua Resposta:
-{
-  "tipo_norma": "resolucao",
-  "numero_norma": "4958",
-  "termo_tecnico": "risco de crédito"
-}
----
-Pergunta do Usuário: "Preciso saber sobre o Patrimônio de Referência no Art. 12 da circular 3978."
-Sua Resposta:
-{
-  "tipo_norma": "circular",
-  "numero_norma": "3978",
-  "termo_tecnico": "Patrimônio de Referência",
-  "artigo": "12"
-}
----
-Pergunta do Usuário: "Sobre o RWAsp, estamos com a seguinte duvida. Para a parcela do MOE que trata sobre as pagamentos realizados e dos recursos transferidos pela instituição, devemos considerar apenas as saidas, ou as entradas e saidas movimentadas. Caso as entradas e saidas, as saidas devem ser apuradas em modulo?"
-Sua Resposta:
-{
-  "termo_tecnico": "RWAsp"
-}
----
-Pergunta do Usuário: "Qual a provisão em % de uma operação de crédito pessoal consignado que está em 14 dias de atraso? e qual a provisão de uma operação de crédito pessoal sem garantia com 14 dias de atraso?"
-Sua Resposta:
-{
-  "termo_tecnico": "provisão para operação de crédito"
-}
----
-Pergunta do Usuário: "Olá, tudo bem?"
-Sua Resposta:
-{}
----
-**Pergunta do Usuário:**
-{question}
-
-**Sua Resposta (APENAS O JSON):**
-"""
-
-def get_config(name: str):
-    """
-    Busca em session_state[name.lower()] e,
-    se não existir, retorna o DEFAULT definido acima.
-    """
-    key = name.lower()
-    if key in st.session_state:
-        return st.session_state[key]
-
-    if key == "model_name":
-        return MODEL_NAME
-    if key == "retrieval_search_type":
-        return "similarity"
-    if key == "retrieval_kwargs":
-        return {"k": 6}
-    if key == "prompt":
-        return QA_TEMPLATE
-    if key == "metadata_extractor_prompt":
-        return METADATA_EXTRACTOR_TEMPLATE
-
-
+import streamlit as st
+
+MODEL_NAME = "o1-preview" # "gpt-4o"
+
+# Mantenha o QA_TEMPLATE original
+'''QA_TEMPLATE = """
+Você é um analista regulatório sênior do Banco Central do Brasil, especializado em fornecer respostas precisas, bem-fundamentadas e rastreáveis, baseadas exclusivamente no contexto fornecido.
+
+**Instrução Mestra de Hierarquia:**
+Sua tarefa mais importante é identificar a regra MAIS ESPECÍFICA para a pergunta. Regras de capítulos, seções ou artigos que tratam diretamente do assunto da pergunta prevalecem sobre regras de capítulos mais gerais.
+
+**Siga rigorosamente esta estrutura para sua resposta:**
+
+**1. Análise dos Fatos:**
+- Liste os artigos e parágrafos do contexto que são potencialmente relevantes para a pergunta, agrupando-os por norma de origem.
+
+**2. Dedução Lógica:**
+- **A. Categorização do Assunto:** Inicie por categorizar de forma clara e objetiva o tema central da pergunta (ex: "O ativo em questão é um título de securitização", "A pergunta trata dos requerimentos de capital para instituições do S2").
+
+- **B. Identificação e Justificativa da Regra Principal:** Com base na "Instrução Mestra de Hierarquia", compare os artigos relevantes e justifique textualmente qual deles constitui a regra principal para responder à pergunta e por quê.
+
+- **C. Análise Detalhada da Regra Principal:** Uma vez identificada a regra principal, explique seu funcionamento em detalhe:
+    - Descreva o mecanismo central ou a exigência da regra.
+    - Aponte quaisquer **condições, exceções, pisos ou tetos** que a própria regra principal estabelece.
+    - Explique como outros artigos (se aplicável) servem como **parâmetros ou fontes de informação** para a regra principal (ex: um artigo define um cálculo, enquanto outro fornece o percentual a ser usado nesse cálculo).
+
+**3. Conclusão Final Sintetizada:**
+- Resuma sua análise em uma resposta direta, clara e objetiva para a pergunta original do usuário, reafirmando a regra principal que fundamenta a conclusão.
+
+**Regra de Segurança:**
+Se o contexto não contiver a regra específica necessária para a sua dedução, ou se as informações forem insuficientes, declare isso claramente e não tente formular uma resposta incompleta.
+
+---
+**Contexto Fornecido:**
+{context}
+
+---
+**Pergunta do Usuário:**
+{question}
+"""'''
+
+QA_TEMPLATE = """
+Você é um especialista em normas bancárias do BACEN.
+Use apenas o contexto extraído das resoluções (normas) para responder à pergunta e pense com calma (revisão os processos e a lógica).
+Para responder a qualquer pergunta do usuário envolvendo normas, siga rigorosamente esta estrutura:
+
+1) **Norma e Seção**:
+   - Informe o nome completo da norma (ex.: Resolução BCB nº X/ANO) e a seção exata (artigo e parágrafo) aplicáveis.
+
+2) **Texto Literal**:
+   - Apresente o(s) trecho(s) exato(s) da(s) norma(s) identificado(s) no item 1.
+
+3) **Explicação**:
+   - Forneça uma interpretação clara e objetiva do trecho legal, destacando como ele responde à pergunta.
+
+4) **Conclusão**:
+   - Responda à pergunta do usuário citando todos os possíveis cenários e resumindo o principal ponto aplicável.
+
+Contexto extraído:
+{context}
+
+Pergunta do usuário:
+{question}
+"""
+
+# Mantenha o FINAL_FORMATTER_TEMPLATE original
+'''FINAL_FORMATTER_TEMPLATE = """
+Você é um redator técnico sênior do Banco Central do Brasil, especializado em formatar análises complexas em um formato padronizado e claro.
+
+Sua única tarefa é pegar a "Análise Consolidada" que foi pré-aprovada e verificada, e reformatá-la para seguir rigorosamente a estrutura do "Template de Resposta Final".
+
+Não adicione nenhuma informação nova, não altere a lógica e não faça novas deduções. Apenas formate o conteúdo fornecido.
+
+---
+**Análise Consolidada (Conteúdo a ser formatado):**
+{verified_analysis}
+
+---
+**Template de Resposta Final (Estrutura a ser seguida):**
+
+**1. Análise dos Fatos:**
+- Liste os artigos e parágrafos do contexto que são potencialmente relevantes para a pergunta, agrupando-os por norma de origem.
+
+**2. Dedução Lógica (Análise Central):**
+- **A. Categorização do Assunto:** Inicie por categorizar de forma clara e objetiva o tema central da pergunta.
+- **B. Identificação e Justificativa da Regra Principal:** Compare os artigos relevantes e justifique textualmente qual deles constitui a regra principal.
+- **C. Análise Detalhada da Regra Principal:** Explique o funcionamento da regra principal, suas condições, exceções e como outros artigos servem como parâmetros.
+
+**3. Conclusão Final Sintetizada:**
+- Resuma a análise em uma resposta direta e clara para a pergunta original do usuário.
+
+---
+**Pergunta Original do Usuário (para contexto):**
+{question}
+
+---
+**Sua Resposta Final (Análise Consolidada formatada conforme o template):**
+"""'''
+
+FINAL_FORMATTER_TEMPLATE = """
+Você é um redator técnico sênior do Banco Central do Brasil, especializado em formatar análises complexas em um formato padronizado e claro.
+
+Sua única tarefa é pegar a "Análise Consolidada" que foi pré-aprovada e verificada, e reformatá-la para seguir rigorosamente a estrutura do "Template de Resposta Final".
+
+Não adicione nenhuma informação nova, não altere a lógica e não faça novas deduções. Apenas formate o conteúdo fornecido.
+
+---
+**Análise Consolidada (Conteúdo a ser formatado):**
+{verified_analysis}
+
+---
+**Template de Resposta Final (Estrutura a ser seguida):**
+
+1) **Norma e Seção**:
+   - Informe o nome completo da norma (ex.: Resolução BCB nº X/ANO) e a seção exata (artigo e parágrafo) aplicáveis.
+
+2) **Texto Literal**:
+   - Apresente o(s) trecho(s) exato(s) da(s) norma(s) identificado(s) no item 1.
+
+3) **Explicação**:
+   - Forneça uma interpretação clara e objetiva do trecho legal, destacando como ele responde à pergunta.
+
+4) **Conclusão**:
+   - Responda à pergunta do usuário citando todos os possíveis cenários e resumindo o principal ponto aplicável.
+
+---
+**Pergunta Original do Usuário (para contexto):**
+{question}
+
+---
+**Sua Resposta Final (Análise Consolidada formatada conforme o template):**
+"""
+
+# --- SÍNTESE EM UMA ÚNICA CHAMADA ---
+# Instruções da síntese (motor_conselho.SYNTHESIS_PROMPT_TEMPLATE) já com a estrutura do
+# FINAL_FORMATTER_TEMPLATE: o modelo de síntese responde direto no formato final, sem o
+# segundo passo de formatação.
+SINGLE_PASS_SYNTHESIS_TEMPLATE = """
+Você é um analista regulatório sênior do Banco Central do Brasil, encarregado de produzir uma análise definitiva e completa. Sua tarefa é ler todo o CONTEXTO NORMATIVO fornecido, que contém trechos de diferentes resoluções, e responder à PERGUNTA DO USUÁRIO numa única resposta coesa, bem fundamentada e já no formato final.
+
+**Instrução Mestra de Síntese:**
+1.  **Leia e Conecte:** Analise todo o contexto. Identifique como as diferentes normas se complementam. Uma norma pode fornecer a fórmula principal, enquanto outra detalha a metodologia de cálculo de seus componentes. Sua principal tarefa é conectar esses pontos.
+2.  **Fundamente nos Fatos:** Baseie cada afirmação exclusivamente nos trechos fornecidos no CONTEXTO NORMATIVO. Cite os artigos e normas relevantes.
+3.  **Seja Conclusivo:** A análise é sua. Você é a autoridade final.
+4.  **Siga o Template de Resposta Final abaixo**, sem seções adicionais.
+
+**Regra de Segurança:**
+Se, mesmo após analisar todo o contexto, as informações forem insuficientes para responder à pergunta, declare isso claramente.
+
+---
+**CONTEXTO NORMATIVO (Trechos de todas as normas relevantes encontradas):**
+{consolidated_context}
+
+---
+**Template de Resposta Final (Estrutura a ser seguida):**
+
+1) **Norma e Seção**:
+   - Informe o nome completo da norma (ex.: Resolução BCB nº X/ANO) e a seção exata (artigo e parágrafo) aplicáveis.
+
+2) **Texto Literal**:
+   - Apresente o(s) trecho(s) exato(s) da(s) norma(s) identificado(s) no item 1.
+
+3) **Explicação**:
+   - Forneça uma interpretação clara e objetiva do trecho legal, destacando como ele responde à pergunta.
+
+4) **Conclusão**:
+   - Responda à pergunta do usuário citando todos os possíveis cenários e resumindo o principal ponto aplicável.
+
+---
+**PERGUNTA DO USUÁRIO:**
+{question}
+
+---
+**Sua Resposta Final (formatada conforme o template):**
+"""
+
+# "duas_etapas": síntese (Cohere) + formatação (MODEL_NAME); "uma_etapa": só a síntese, com SINGLE_PASS_SYNTHESIS_TEMPLATE.
+MODOS_SINTESE = ("duas_etapas", "uma_etapa")
+MODO_SINTESE_CONSELHO = "duas_etapas"
+MODO_SINTESE_UNIFICADO = "duas_etapas"
+
+# --- TEMPLATE REFINADO COM BASE NOS SEUS EXEMPLOS ---
+METADATA_EXTRACTOR_TEMPLATE = """
+Sua tarefa é atuar como um especialista em roteamento de queries para um banco de dados de normas do Banco Central. Analise a "Pergunta do Usuário" e extraia metadados relevantes para filtrar a busca.
+
+Você DEVE retornar a resposta como um objeto JSON. As chaves válidas para o JSON são: "tipo_norma", "numero_norma", "termo_tecnico", "artigo".
+
+**REGRAS:**
+1.  Se a pergunta não contiver informação para uma chave, omita a chave do JSON.
+2.  Se nenhum metadado relevante for encontrado, retorne um objeto JSON vazio: {{}}.
+3.  Normalize os valores: 'resolução' ou 'res' deve virar 'resolucao'. 'circular' ou 'circ' deve virar 'circular'.
+4.  Para 'artigo', extraia apenas o número (ex: de "Art. 15", extraia "15").
+5.  Para 'termo_tecnico', extraia o conceito, sigla ou tema principal que define o assunto da pergunta. Se houver múltiplos, extraia o mais importante.
+
+**EXEMPLOS:**
+
+Pergunta do Usuário: "Qual o tratamento para o risco de crédito segundo a resolução 4958?"
+Sua Resposta:
+{{
+  "tipo_norma": "resolucao",
+  "numero_norma": "4958",
+  "termo_tecnico": "risco de crédito"
+}}
+---
+Pergunta do Usuário: "Preciso saber sobre o Patrimônio de Referência no Art. 12 da circular 3978."
+Sua Resposta:
+{{
+  "tipo_norma": "circular",
+  "numero_norma": "3978",
+  "termo_tecnico": "Patrimônio de Referência",
+  "artigo": "12"
+}}
+---
+Pergunta do Usuário: "Sobre o RWAsp, estamos com a seguinte duvida. Para a parcela do MOE que trata sobre as pagamentos realizados e dos recursos transferidos pela instituição, devemos considerar apenas as saidas, ou as entradas e saidas movimentadas. Caso as entradas e saidas, as saidas devem ser apuradas em modulo?"
+Sua Resposta:
+{{
+  "termo_tecnico": "RWAsp"
+}}
+---
+Pergunta do Usuário: "Qual a provisão em % de uma operação de crédito pessoal consignado que está em 14 dias de atraso? e qual a provisão de uma operação de crédito pessoal sem garantia com 14 dias de atraso?"
+Sua Resposta:
+{{
+  "termo_tecnico": "provisão para operação de crédito"
+}}
+---
+Pergunta do Usuário: "Olá, tudo bem?"
+Sua Resposta:
+{{}}
+---
+**Pergunta do Usuário:**
+{question}
+
+**Sua Resposta (APENAS O JSON):**
+"""
+
+# Condensação da pergunta e extração de filtros numa única chamada (motor unificado com histórico).
+CONDENSE_AND_EXTRACT_TEMPLATE = """
+Você atua no roteamento de queries para um banco de dados de normas do Banco Central. Dado o histórico de uma conversa e uma nova pergunta, faça DUAS tarefas e devolva o resultado num único objeto JSON.
+
+1.  **pergunta_autonoma**: reformule a nova pergunta para ser uma pergunta autônoma e completa, em português, que possa ser entendida sem o histórico. NÃO responda à pergunta, apenas a reformule.
+2.  **filtros**: metadados da pergunta autônoma para filtrar a busca, com as chaves "tipo_norma", "numero_norma", "termo_tecnico", "artigo".
+    - Omita as chaves sem informação; se nenhum metadado for encontrado, use {{}}.
+    - Normalize os valores: 'resolução' ou 'res' deve virar 'resolucao'. 'circular' ou 'circ' deve virar 'circular'.
+    - Para 'artigo', extraia apenas o número (ex: de "Art. 15", extraia "15").
+    - Para 'termo_tecnico', extraia o conceito, sigla ou tema principal da pergunta.
+
+**EXEMPLO:**
+
+Histórico da Conversa:
+user: Qual o tratamento para o risco de crédito segundo a resolução 4958?
+assistant: (análise sobre risco de crédito na Resolução 4958)
+
+Nova Pergunta:
+E o que diz o Art. 12 dela?
+
+Sua Resposta:
+{{
+  "pergunta_autonoma": "O que diz o Art. 12 da Resolução 4958 sobre o risco de crédito?",
+  "filtros": {{"tipo_norma": "resolucao", "numero_norma": "4958", "termo_tecnico": "risco de crédito", "artigo": "12"}}
+}}
+---
+**Histórico da Conversa:**
+{chat_history}
+
+**Nova Pergunta:**
+{question}
+
+**Sua Resposta (APENAS O JSON):**
+"""
+
+def get_config(name: str):
+    """
+    Busca em session_state[name.lower()] e,
+    se não existir, retorna o DEFAULT definido acima.
+    """
+    key = name.lower()
+    if key in st.session_state:
+        return st.session_state[key]
+
+    if key == "model_name":
+        return MODEL_NAME
+    if key == "retrieval_search_type":
+        return "similarity"
+    if key == "retrieval_kwargs":
+        return {"k": 6}
+    if key == "prompt":
+        return QA_TEMPLATE
+    if key == "metadata_extractor_prompt":
+        return METADATA_EXTRACTOR_TEMPLATE
+    if key == "condense_and_extract_prompt":
+        return CONDENSE_AND_EXTRACT_TEMPLATE
+    if key == "single_pass_synthesis_prompt":
+        return SINGLE_PASS_SYNTHESIS_TEMPLATE
+    if key == "modo_sintese_conselho":
+        return MODO_SINTESE_CONSELHO
+    if key == "modo_sintese_unificado":
+        return MODO_SINTESE_UNIFICADO
+
+
     raise KeyError(f"Configuracao desconhecida: {name}")
\ No newline at end of file
@@ -0,0 +1,164 @@
+import os
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from alargamento_contexto import estimar_tokens
+from armazem_chunks import separar_cabecalho
+from servico_rerank import obter_servico_rerank
+
+ORCAMENTO_TOKENS_SINTESE = int(os.getenv("CONTEXTO_SINTESE_MAX_TOKENS", "16000"))
+SEPARADOR_TRECHOS = "\n\n---\n\n"
+MAX_SOBREPOSICAO = 400  # caracteres; o chunk_overlap do build_index_v4 é 150
+MIN_SOBREPOSICAO = 20   # abaixo disso uma coincidência entre fim e início é acaso, não sobreposição
+TAMANHO_SHINGLE = 5     # palavras por shingle na detecção de quase duplicatas
+LIMIAR_QUASE_DUPLICATA = float(os.getenv("CONTEXTO_LIMIAR_QUASE_DUPLICATA", "0.9"))
+
+def sobreposicao(anterior: str, seguinte: str, max_chars: int = MAX_SOBREPOSICAO) -> int:
+    """Tamanho do maior sufixo de `anterior` que é prefixo de `seguinte` (0 se menor que MIN_SOBREPOSICAO)."""
+    for n in range(min(len(anterior), len(seguinte), max_chars), MIN_SOBREPOSICAO - 1, -1):
+        if anterior.endswith(seguinte[:n]):
+            return n
+    return 0
+
+def _shingles(texto: str) -> set:
+    palavras = texto.lower().split()
+    if len(palavras) <= TAMANHO_SHINGLE:
+        return {tuple(palavras)}
+    return {tuple(palavras[i:i + TAMANHO_SHINGLE]) for i in range(len(palavras) - TAMANHO_SHINGLE + 1)}
+
+class Bloco:
+    """
+    Trechos contíguos de uma mesma norma (`original_index` de `inicio` a `fim - 1`) unidos num só texto.
+    O cabeçalho de norma que os resultados do FAISS e da busca híbrida trazem no texto aparece uma
+    vez, no início do bloco; a sobreposição entre os trechos é procurada no texto sem ele.
+    """
+
+    def __init__(self, doc: Document, nota: Optional[float]):
+        self.documentos = [doc]
+        self.origem = doc.metadata.get("origem")
+        self.inicio = doc.metadata.get("original_index")
+        self.fim = None if self.inicio is None else self.inicio + 1
+        self.cabecalho, self.corpo = separar_cabecalho(doc)
+        self.nota = nota
+        self.notas = [nota]
+
+    def continua_com(self, doc: Document) -> bool:
+        return self.fim is not None and doc.metadata.get("original_index") == self.fim and doc.metadata.get("origem") == self.origem
+
+    @property
+    def texto(self) -> str:
+        return self.cabecalho + self.corpo
+
+    def estender(self, doc: Document, nota: Optional[float]):
+        cabecalho, corpo = separar_cabecalho(doc)
+        self.cabecalho = self.cabecalho or cabecalho
+        n = sobreposicao(self.corpo, corpo)
+        self.corpo = self.corpo + corpo[n:] if n else self.corpo + "\n\n" + corpo
+        self.documentos.append(doc)
+        self.notas.append(nota)
+        self.fim += 1
+        if nota is not None and (self.nota is None or nota > self.nota):
+            self.nota = nota
+
+def montar_blocos(docs: Sequence[Document], notas: Sequence[Optional[float]]) -> List[Bloco]:
+    """
+    Blocos em ordem de documento. Trechos com o mesmo `original_index` são um só (fica o
+    de maior nota); trechos vizinhos da mesma norma viram um bloco, sem repetir o texto
+    sobreposto. Trechos sem `original_index` ficam em blocos próprios, no fim.
+    """
+    por_indice, sem_indice = {}, []
+    for doc, nota in zip(docs, notas):
+        indice = doc.metadata.get("original_index")
+        if indice is None:
+            sem_indice.append(Bloco(doc, nota))
+        elif indice not in por_indice or (nota or 0.0) > (por_indice[indice][1] or 0.0):
+            por_indice[indice] = (doc, nota)
+
+    blocos: List[Bloco] = []
+    for indice in sorted(por_indice):
+        doc, nota = por_indice[indice]
+        if blocos and blocos[-1].continua_com(doc):
+            blocos[-1].estender(doc, nota)
+        else:
+            blocos.append(Bloco(doc, nota))
+    return blocos + sem_indice
+
+def _chave_nota(nota: Optional[float]) -> float:
+    return nota if nota is not None else float("-inf")
+
+def recortar_bloco(bloco: Bloco, orcamento_tokens: int) -> List[Bloco]:
+    """
+    Os trechos de maior nota de um bloco que não cabe inteiro, até `orcamento_tokens`,
+    reagrupados em blocos contíguos ([] se nem o melhor trecho couber).
+    """
+    ordem = sorted(range(len(bloco.documentos)), key=lambda i: -_chave_nota(bloco.notas[i]))
+    incluidos, partes = [], []
+    for i in ordem:
+        tentativa = sorted(incluidos + [i])
+        blocos = montar_blocos([bloco.documentos[j] for j in tentativa], [bloco.notas[j] for j in tentativa])
+        if sum(estimar_tokens(b.texto) for b in blocos) <= orcamento_tokens:
+            incluidos, partes = tentativa, blocos
+    return partes
+
+def _notas(docs: Sequence[Document], question: Optional[str]) -> List[Optional[float]]:
+    """`relevance_score` do re-ranking; para os trechos sem ela, a nota já em cache no ServicoRerank (sem nova chamada)."""
+    notas = [doc.metadata.get("relevance_score") for doc in docs]
+    faltantes = [i for i, nota in enumerate(notas) if nota is None]
+    if question and faltantes:
+        for i, nota in zip(faltantes, obter_servico_rerank().notas_em_cache([docs[i] for i in faltantes], question)):
+            notas[i] = nota
+    return notas
+
+def empacotar_contexto(docs: Sequence[Document], question: Optional[str] = None,
+                       orcamento_tokens: Optional[int] = ORCAMENTO_TOKENS_SINTESE,
+                       separador: str = SEPARADOR_TRECHOS) -> Tuple[str, List[Document]]:
+    """
+    Contexto para o prompt de síntese a partir dos trechos recuperados:
+    1. une trechos vizinhos e sobrepostos (por `original_index`) em blocos contíguos;
+    2. descarta blocos quase idênticos a (ou contidos em) outro escolhido (shingles de palavras);
+    3. escolhe os blocos por nota de re-ranking (maior nota do bloco) até o orçamento de tokens;
+       um bloco que não cabe inteiro entra só com os seus trechos de maior nota que couberem;
+    4. devolve os escolhidos em ordem de documento.
+    O trecho de maior nota sempre entra, mesmo sozinho acima do orçamento.
+    Retorna (texto do contexto, documentos incluídos).
+    """
+    notas = _notas(docs, question)
+    blocos = montar_blocos(docs, notas)
+    posicao = {id(bloco): i for i, bloco in enumerate(blocos)}
+    tokens_originais = sum(estimar_tokens(doc.page_content) for doc in docs)
+
+    escolhidos, tokens_usados = [], 0  # (bloco, shingles, tokens, ordem)
+
+    def escolher(bloco: Bloco, ordem: Tuple[int, int], recortar: bool) -> None:
+        nonlocal escolhidos, tokens_usados
+        shingles = _shingles(bloco.texto)
+        if any(len(shingles & outro) >= LIMIAR_QUASE_DUPLICATA * len(shingles) for _, outro, _, _ in escolhidos):
+            return
+        # Blocos já escolhidos que estão contidos neste (ex.: o mesmo trecho em outra norma) dão lugar a ele.
+        contidos = [item for item in escolhidos if len(shingles & item[1]) >= LIMIAR_QUASE_DUPLICATA * len(item[1])]
+        tokens = estimar_tokens(bloco.texto)
+        livres = None if orcamento_tokens is None else orcamento_tokens - tokens_usados + sum(item[2] for item in contidos)
+        if livres is not None and tokens > livres:
+            if recortar and len(bloco.documentos) > 1:
+                for parte in recortar_bloco(bloco, orcamento_tokens - tokens_usados):
+                    escolher(parte, (ordem[0], parte.inicio or 0), recortar=False)
+            return
+        escolhidos = [item for item in escolhidos if not any(item is c for c in contidos)] + [(bloco, shingles, tokens, ordem)]
+        tokens_usados += tokens - sum(item[2] for item in contidos)
+
+    for bloco in sorted(blocos, key=lambda b: -_chave_nota(b.nota)):
+        escolher(bloco, (posicao[id(bloco)], bloco.inicio or 0), recortar=True)
+
+    if not escolhidos and docs:
+        melhor = max(range(len(docs)), key=lambda i: _chave_nota(notas[i]))
+        bloco = Bloco(docs[melhor], notas[melhor])
+        tokens_usados = estimar_tokens(bloco.texto)
+        print(f"-> O trecho de maior nota (~{tokens_usados} tokens) excede o orçamento de {orcamento_tokens}; incluído mesmo assim.")
+        escolhidos = [(bloco, None, tokens_usados, (0, 0))]
+
+    escolhidos = [item[0] for item in sorted(escolhidos, key=lambda item: item[3])]
+    documentos = [doc for bloco in escolhidos for doc in bloco.documentos]
+    print(f"-> Contexto empacotado: {len(documentos)} de {len(docs)} trechos em {len(escolhidos)} blocos, "
+          f"~{tokens_usados} tokens (antes ~{tokens_originais}).")
+    return separador.join(bloco.texto for bloco in escolhidos), documentos
@@ -0,0 +1,87 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+# Eventos emitidos pelos motores `obter_resposta_*_stream`, em ordem:
+#   {"tipo": "etapa", "etapa": nome, "detalhe": texto}  -> progresso (pergunta condensada, filtros, ...)
+#   {"tipo": "fontes", "documentos": [...]}              -> trechos recuperados que vão ao LLM
+#   {"tipo": "token", "texto": parte}                    -> pedaços da resposta da última etapa de LLM
+#   {"tipo": "fim", "resultado": {...}}                  -> mesmo dicionário que o `obter_resposta_*` devolve
+
+ROTULOS_ETAPAS = {
+    "pergunta_autonoma": "Pergunta autônoma",
+    "intencao": "Intenção detectada",
+    "filtros": "Filtros extraídos",
+    "recuperacao": "Recuperação",
+    "expansao": "Expansão",
+    "falhas": "⚠️ Motores com falha",
+    "rerank": "Re-ranking",
+    "sintese": "Síntese",
+    "formatacao": "Formatação",
+    "geracao": "Geração",
+}
+
+def etapa(nome: str, detalhe: Optional[str] = None) -> Dict[str, Any]:
+    return {"tipo": "etapa", "etapa": nome, "detalhe": detalhe}
+
+def fontes(documentos: List[Document]) -> Dict[str, Any]:
+    return {"tipo": "fontes", "documentos": documentos}
+
+def token(texto: str) -> Dict[str, Any]:
+    return {"tipo": "token", "texto": texto}
+
+def fim(resultado: Dict[str, Any]) -> Dict[str, Any]:
+    return {"tipo": "fim", "resultado": resultado}
+
+def gerar_resposta(chain: Any, entrada: Dict[str, Any], source_documents: List[Document]) -> Iterator[Dict[str, Any]]:
+    """Transmite os tokens de `chain` (terminada em StrOutputParser) e encerra com o resultado completo."""
+    partes = []
+    for parte in chain.stream(entrada):
+        partes.append(parte)
+        yield token(parte)
+    yield fim({"answer": "".join(partes), "source_documents": source_documents})
+
+def eventos_de_resultado(resultado: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Eventos equivalentes a um resultado pronto (acerto de cache, respostas sem documentos)."""
+    if resultado.get("source_documents"):
+        yield fontes(resultado["source_documents"])
+    if resultado.get("answer"):
+        yield token(resultado["answer"])
+    yield fim(resultado)
+
+def resultado_de_eventos(eventos: Iterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """Consome o stream inteiro e devolve o resultado final."""
+    resultado = {}
+    for evento in eventos:
+        if evento["tipo"] == "fim":
+            resultado = evento["resultado"]
+    return resultado
+
+class ConsumidorDeEventos:
+    """
+    Separa o stream de um motor para a interface: `tokens()` é o gerador de texto para
+    o `st.write_stream`, os demais eventos vão para `ao_evento` (ex.: um `st.status`) e o
+    resultado final fica em `resultado`.
+    """
+
+    def __init__(self, eventos: Iterator[Dict[str, Any]], ao_evento: Callable[[Dict[str, Any]], None]):
+        self.eventos = eventos
+        self.ao_evento = ao_evento
+        self.resultado: Dict[str, Any] = {}
+
+    def tokens(self) -> Iterator[str]:
+        for evento in self.eventos:
+            if evento["tipo"] == "token":
+                yield evento["texto"]
+            elif evento["tipo"] == "fim":
+                self.resultado = evento["resultado"]
+            else:
+                self.ao_evento(evento)
+
+def descrever_evento(evento: Dict[str, Any]) -> str:
+    """Linha em Markdown para exibir um evento de etapa ou de fontes na interface."""
+    if evento["tipo"] == "fontes":
+        origens = list(dict.fromkeys(doc.metadata.get("origem", "?") for doc in evento["documentos"]))
+        return f"📚 **{len(evento['documentos'])} trechos recuperados** de: {', '.join(origens)}"
+    rotulo = ROTULOS_ETAPAS.get(evento.get("etapa"), evento.get("etapa"))
+    return f"**{rotulo}:** {evento['detalhe']}" if evento.get("detalhe") else f"**{rotulo}**"
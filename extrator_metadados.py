@@ -1,41 +1,128 @@
-import json
-from typing import Dict, Any
-
-from langchain_core.output_parsers import StrOutputParser
-from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-
-from configs_v2 import METADATA_EXTRACTOR_TEMPLATE
-
-class ExtratorDeMetadados:
-
-    def __init__(self, llm: ChatOpenAI):
-        self.llm = llm
-        self.prompt_template = PromptTemplate.from_template(METADATA_EXTRACTOR_TEMPLATE)
-        self.chain = self.prompt_template | self.llm | StrOutputParser()
-
-    def extrair_filtros(self, question: str) -> Dict[str, Any]:
-
-        print(f"-> Extraindo filtros da pergunta: '{question}'")
-        try:
-            response_str = self.chain.invoke({"question": question})
-            if "```json" in response_str:
-                response_str = response_str.split("```json\n")[1].split("```")[0]
-            
-            filter_dict = json.loads(response_str)
-            
-            cleaned_filter_dict = {k: v for k, v in filter_dict.items() if v}
-
-            if cleaned_filter_dict:
-                print(f"--> Filtros extraídos: {cleaned_filter_dict}")
-            else:
-                print("--> Nenhum filtro relevante extraído.")
-
-            return cleaned_filter_dict
-        except (json.JSONDecodeError, IndexError) as e:
-            print(f"⚠️ Aviso: Não foi possível decodificar a resposta JSON do extrator. Erro: {e}")
-            print(f"Resposta recebida: {response_str}")
-            return {} 
-        except Exception as e:
-            print(f"Erro inesperado no ExtratorDeMetadados: {e}")
+import json
+from typing import Dict, Any, Optional, Tuple
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain.prompts import PromptTemplate
+from langchain_openai import ChatOpenAI
+
+from configs_v2 import METADATA_EXTRACTOR_TEMPLATE, CONDENSE_AND_EXTRACT_TEMPLATE
+from motor_conselho import cadeia_condensacao
+
+class ExtratorDeMetadados:
+
+    def __init__(self, llm: ChatOpenAI):
+        self.llm = llm
+        self.prompt_template = PromptTemplate.from_template(METADATA_EXTRACTOR_TEMPLATE)
+        self.chain = self.prompt_template | self.llm | StrOutputParser()
+        self.chain_fundida = PromptTemplate.from_template(CONDENSE_AND_EXTRACT_TEMPLATE) | self.llm | StrOutputParser()
+        self.chain_condensacao = cadeia_condensacao(self.llm)
+
+    def extrair_filtros(self, question: str) -> Dict[str, Any]:
+
+        print(f"-> Extraindo filtros da pergunta: '{question}'")
+        try:
+            response_str = self.chain.invoke({"question": question})
+        except Exception as e:
+            print(f"Erro inesperado no ExtratorDeMetadados: {e}")
+            return {}
+        return self._interpretar(response_str)
+
+    async def aextrair_filtros(self, question: str) -> Dict[str, Any]:
+
+        print(f"-> Extraindo filtros da pergunta: '{question}'")
+        try:
+            response_str = await self.chain.ainvoke({"question": question})
+        except Exception as e:
+            print(f"Erro inesperado no ExtratorDeMetadados: {e}")
+            return {}
+        return self._interpretar(response_str)
+
+    def condensar_e_extrair(self, question: str, chat_history: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Pergunta autônoma e filtros numa única chamada ao LLM (em vez de condensar e depois
+        extrair). Se a resposta não for um JSON válido, volta às duas chamadas separadas.
+        """
+
+        print(f"-> Condensando a pergunta e extraindo filtros numa única chamada: '{question}'")
+        try:
+            response_str = self.chain_fundida.invoke({"chat_history": chat_history, "question": question})
+        except Exception as e:
+            print(f"Erro inesperado no ExtratorDeMetadados: {e}")
+            return question, {}
+        resultado = self._interpretar_fundida(response_str, question)
+        if resultado is not None:
+            return resultado
+
+        print("-> Condensando a pergunta com o prompt de condensação e extraindo os filtros separadamente.")
+        try:
+            standalone_question = self.chain_condensacao.invoke({"chat_history": chat_history, "question": question}).strip() or question
+        except Exception as e:
+            print(f"Erro inesperado no ExtratorDeMetadados: {e}")
+            return question, {}
+        print(f"-> Pergunta autônoma: {standalone_question}")
+        return standalone_question, self.extrair_filtros(standalone_question)
+
+    async def acondensar_e_extrair(self, question: str, chat_history: str) -> Tuple[str, Dict[str, Any]]:
+
+        print(f"-> Condensando a pergunta e extraindo filtros numa única chamada: '{question}'")
+        try:
+            response_str = await self.chain_fundida.ainvoke({"chat_history": chat_history, "question": question})
+        except Exception as e:
+            print(f"Erro inesperado no ExtratorDeMetadados: {e}")
+            return question, {}
+        resultado = self._interpretar_fundida(response_str, question)
+        if resultado is not None:
+            return resultado
+
+        print("-> Condensando a pergunta com o prompt de condensação e extraindo os filtros separadamente.")
+        try:
+            standalone_question = (await self.chain_condensacao.ainvoke({"chat_history": chat_history, "question": question})).strip() or question
+        except Exception as e:
+            print(f"Erro inesperado no ExtratorDeMetadados: {e}")
+            return question, {}
+        print(f"-> Pergunta autônoma: {standalone_question}")
+        return standalone_question, await self.aextrair_filtros(standalone_question)
+
+    def _interpretar_fundida(self, response_str: str, question: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(pergunta autônoma, filtros) da resposta da chamada fundida, ou None se ela não for um JSON válido."""
+        try:
+            resposta = json.loads(self._json_da_resposta(response_str))
+            standalone_question = str(resposta.get("pergunta_autonoma") or "").strip() or question
+            filter_dict = resposta.get("filtros") or {}
+            cleaned_filter_dict = {k: v for k, v in filter_dict.items() if v}
+        except (json.JSONDecodeError, IndexError, AttributeError) as e:
+            print(f"⚠️ Aviso: Não foi possível decodificar a resposta JSON do extrator. Erro: {e}")
+            print(f"Resposta recebida: {response_str}")
+            return None
+
+        print(f"-> Pergunta autônoma: {standalone_question}")
+        if cleaned_filter_dict:
+            print(f"--> Filtros extraídos: {cleaned_filter_dict}")
+        else:
+            print("--> Nenhum filtro relevante extraído.")
+        return standalone_question, cleaned_filter_dict
+
+    def _json_da_resposta(self, response_str: str) -> str:
+        if "```json" in response_str:
+            return response_str.split("```json\n")[1].split("```")[0]
+        return response_str
+
+    def _interpretar(self, response_str: str) -> Dict[str, Any]:
+        try:
+            filter_dict = json.loads(self._json_da_resposta(response_str))
+            
+            cleaned_filter_dict = {k: v for k, v in filter_dict.items() if v}
+
+            if cleaned_filter_dict:
+                print(f"--> Filtros extraídos: {cleaned_filter_dict}")
+            else:
+                print("--> Nenhum filtro relevante extraído.")
+
+            return cleaned_filter_dict
+        except (json.JSONDecodeError, IndexError) as e:
+            print(f"⚠️ Aviso: Não foi possível decodificar a resposta JSON do extrator. Erro: {e}")
+            print(f"Resposta recebida: {response_str}")
+            return {} 
+        except Exception as e:
+            print(f"Erro inesperado no ExtratorDeMetadados: {e}")
             return {}
\ No newline at end of file
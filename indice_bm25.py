@@ -0,0 +1,350 @@
+import os
+import json
+import mmap
+import threading
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from artefatos_versionados import gravacao_versionada, resolver_versao
+
+# Mesmos parâmetros do BM25Okapi (rank_bm25), usado pelo BM25Retriever do LangChain.
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+# Metadados com shards BM25 pré-construídos (um índice por valor).
+CAMPOS_SHARDS = ("origem", "norma")
+
+def chave_norma(tipo_norma: str, numero_norma: str) -> str:
+    """Valor do campo sintético 'norma', que agrupa os chunks de (tipo_norma, numero_norma)."""
+    return f"{tipo_norma}|{numero_norma}"
+
+def tokenizar(texto: str) -> List[str]:
+    """Mesma tokenização padrão do BM25Retriever (split por espaços)."""
+    return texto.split()
+
+class _VocabularioMapeado(Sequence):
+    """Vocabulário ordenado lido sob demanda de um blob UTF-8 mapeado em memória."""
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self._blob[int(self._offsets[i]):int(self._offsets[i + 1])]).decode("utf-8")
+
+    def indice_do_termo(self, termo: str) -> Optional[int]:
+        i = bisect_left(self, termo)
+        if i < len(self) and self[i] == termo:
+            return i
+        return None
+
+class IndiceBM25:
+    """
+    Índice BM25 esparso e compacto: vocabulário ordenado, postings em CSR e
+    normalização por tamanho de documento pré-calculada. Salvo como arquivos
+    .npy que são mapeados em memória na carga, então vários workers compartilham
+    as mesmas páginas e nenhum objeto Python é criado por documento.
+
+    Um shard é um IndiceBM25 construído só com um subconjunto do corpus (IDF próprio);
+    `ids_globais` traduz seus ids locais para `original_index`.
+    """
+
+    ARQUIVOS = ("termos_offsets.npy", "idf.npy", "postings_ptr.npy", "postings_docs.npy", "postings_tf.npy", "norma_docs.npy")
+
+    def __init__(self, termos_blob, termos_offsets, idf, postings_ptr, postings_docs, postings_tf, norma_docs, meta, ids_globais=None):
+        self.vocabulario = _VocabularioMapeado(termos_blob, termos_offsets)
+        self.termos_offsets = termos_offsets
+        self.idf = idf
+        self.postings_ptr = postings_ptr
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.norma_docs = norma_docs
+        self.meta = meta
+        self.k1 = meta["k1"]
+        self.n_docs = meta["n_docs"]
+        self.ids_globais = ids_globais
+
+    @classmethod
+    def construir(cls, textos: List[str], k1: float = BM25_K1, b: float = BM25_B, epsilon: float = BM25_EPSILON,
+                  ids_globais: Optional[np.ndarray] = None) -> "IndiceBM25":
+        termo_para_id = {}
+        termos_ids, docs_ids, tfs = [], [], []
+        doc_len = np.zeros(len(textos), dtype=np.int32)
+        for doc_id, texto in enumerate(textos):
+            tokens = tokenizar(texto)
+            doc_len[doc_id] = len(tokens)
+            for termo, tf in Counter(tokens).items():
+                termos_ids.append(termo_para_id.setdefault(termo, len(termo_para_id)))
+                docs_ids.append(doc_id)
+                tfs.append(tf)
+
+        # Reordena o vocabulário alfabeticamente para permitir busca binária no blob.
+        termos = sorted(termo_para_id)
+        novo_id = np.empty(len(termos), dtype=np.int64)
+        for i, termo in enumerate(termos):
+            novo_id[termo_para_id[termo]] = i
+        termos_ids = novo_id[np.asarray(termos_ids, dtype=np.int64)]
+        ordem = np.argsort(termos_ids, kind="stable")  # estável: doc_ids continuam crescentes por termo
+
+        postings_docs = np.asarray(docs_ids, dtype=np.int32)[ordem]
+        postings_tf = np.minimum(np.asarray(tfs, dtype=np.int64)[ordem], np.iinfo(np.uint16).max).astype(np.uint16)
+        df = np.bincount(termos_ids, minlength=len(termos))
+        postings_ptr = np.zeros(len(termos) + 1, dtype=np.int64)
+        np.cumsum(df, out=postings_ptr[1:])
+
+        n_docs = len(textos)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+        avgdl = float(doc_len.mean()) if n_docs else 0.0
+        norma_docs = k1 * (1 - b + b * doc_len / avgdl) if avgdl else np.full(n_docs, k1)
+
+        blobs = [t.encode("utf-8") for t in termos]
+        termos_offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in blobs], out=termos_offsets[1:])
+        meta = {"n_docs": n_docs, "avgdl": avgdl, "k1": k1, "b": b, "epsilon": epsilon, "tokenizacao": "split"}
+        return cls(b"".join(blobs), termos_offsets, idf.astype(np.float32), postings_ptr,
+                   postings_docs, postings_tf, norma_docs.astype(np.float32), meta,
+                   None if ids_globais is None else np.asarray(ids_globais, dtype=np.int64))
+
+    def salvar(self, caminho: str):
+        os.makedirs(caminho, exist_ok=True)
+        with open(os.path.join(caminho, "termos.bin"), "wb") as f:
+            f.write(bytes(self.vocabulario._blob))
+        for nome in self.ARQUIVOS:
+            np.save(os.path.join(caminho, nome), getattr(self, nome[:-4]))
+        if self.ids_globais is not None:
+            np.save(os.path.join(caminho, "ids_globais.npy"), self.ids_globais)
+        with open(os.path.join(caminho, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> "IndiceBM25":
+        caminho = resolver_versao(caminho)
+        with open(os.path.join(caminho, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(caminho, "termos.bin"), "rb") as f:
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b""
+        arrays = {nome[:-4]: np.load(os.path.join(caminho, nome), mmap_mode="r") for nome in cls.ARQUIVOS}
+        caminho_ids = os.path.join(caminho, "ids_globais.npy")
+        ids_globais = np.load(caminho_ids, mmap_mode="r") if os.path.exists(caminho_ids) else None
+        return cls(blob, meta=meta, ids_globais=ids_globais, **arrays)
+
+    def pontuar(self, query: str) -> np.ndarray:
+        """Scores BM25 de todos os documentos para a query (mesma fórmula do BM25Okapi)."""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for termo in tokenizar(query):
+            termo_id = self.vocabulario.indice_do_termo(termo)
+            if termo_id is None: continue
+            self.somar_termo(scores, termo_id, self.idf[termo_id], self.norma_docs)
+        return scores
+
+    def df(self, termo_id: int) -> int:
+        """Número de documentos que contêm o termo."""
+        return int(self.postings_ptr[termo_id + 1] - self.postings_ptr[termo_id])
+
+    def somar_termo(self, scores: np.ndarray, termo_id: int, idf: float, norma_docs: np.ndarray):
+        """Soma em `scores` a contribuição do termo, com o `idf` e a normalização por tamanho dados."""
+        inicio, fim = self.postings_ptr[termo_id], self.postings_ptr[termo_id + 1]
+        docs = self.postings_docs[inicio:fim]
+        tf = self.postings_tf[inicio:fim].astype(np.float32)
+        scores[docs] += np.float32(idf) * (tf * (self.k1 + 1) / (tf + norma_docs[docs]))
+
+    def buscar(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Retorna (original_index, scores) dos k documentos de maior score, em ordem decrescente."""
+        return melhores(self.pontuar(query), k, self.ids_globais)
+
+def melhores(scores: np.ndarray, k: int, ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids, scores) das k maiores notas, em ordem decrescente; sem `ids`, a posição em `scores`."""
+    n_docs = len(scores)
+    k = min(k, n_docs)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    candidatos = np.argpartition(-scores, k - 1)[:k] if k < n_docs else np.arange(n_docs)
+    ordem = candidatos[np.argsort(-scores[candidatos], kind="stable")]
+    return (ordem if ids is None else np.asarray(ids[ordem])), scores[ordem]
+
+class IndiceBM25Combinado:
+    """
+    Busca na união de vários shards disjuntos como num único IndiceBM25 construído com os
+    seus documentos: o IDF de cada termo vem do df somado e do total de documentos dos
+    shards, e a normalização por tamanho usa o tamanho médio de documento da união. Os
+    scores de shards diferentes ficam assim comparáveis (cada shard tem o próprio IDF e
+    avgdl, e intercalar os scores de cada um favorecia os shards pequenos).
+    """
+
+    def __init__(self, indices: List[IndiceBM25]):
+        self.indices = indices
+        self.k1 = indices[0].k1
+        self.n_docs = sum(indice.n_docs for indice in indices)
+        self.avgdl = sum(indice.meta["avgdl"] * indice.n_docs for indice in indices) / self.n_docs if self.n_docs else 0.0
+        self.normas_docs = [self._norma_na_uniao(indice) for indice in indices]
+        self.ids_globais = np.concatenate([np.asarray(indice.ids_globais) for indice in indices])
+        self._piso_idf = None
+
+    def _norma_na_uniao(self, indice: IndiceBM25) -> np.ndarray:
+        # norma = k1 * (1 - b + b * dl / avgdl): troca o avgdl do shard pelo da união sem precisar de dl.
+        if not indice.meta["avgdl"] or not self.avgdl:
+            return np.asarray(indice.norma_docs)
+        constante = indice.k1 * (1 - indice.meta["b"])
+        return (constante + (np.asarray(indice.norma_docs) - constante) * (indice.meta["avgdl"] / self.avgdl)).astype(np.float32)
+
+    def _piso_do_idf(self) -> float:
+        """epsilon * IDF médio do vocabulário da união: o valor do BM25Okapi para termos com IDF negativo."""
+        if self._piso_idf is None:
+            df = Counter()
+            for indice in self.indices:
+                df.update(dict(zip(indice.vocabulario, np.diff(indice.postings_ptr).tolist())))
+            dfs = np.fromiter(df.values(), dtype=np.float64, count=len(df))
+            idf = np.log(self.n_docs - dfs + 0.5) - np.log(dfs + 0.5)
+            self._piso_idf = float(self.indices[0].meta["epsilon"] * idf.mean())
+        return self._piso_idf
+
+    def pontuar(self, query: str) -> np.ndarray:
+        """Scores BM25 da união (na ordem de `ids_globais`) para a query."""
+        scores = [np.zeros(indice.n_docs, dtype=np.float32) for indice in self.indices]
+        for termo in tokenizar(query):
+            termos_ids = [indice.vocabulario.indice_do_termo(termo) for indice in self.indices]
+            df = sum(indice.df(termo_id) for indice, termo_id in zip(self.indices, termos_ids) if termo_id is not None)
+            if not df: continue
+            idf = np.log(self.n_docs - df + 0.5) - np.log(df + 0.5)
+            if idf < 0:
+                idf = self._piso_do_idf()
+            for indice, termo_id, scores_shard, norma_docs in zip(self.indices, termos_ids, scores, self.normas_docs):
+                if termo_id is not None:
+                    indice.somar_termo(scores_shard, termo_id, idf, norma_docs)
+        return np.concatenate(scores)
+
+    def buscar(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return melhores(self.pontuar(query), k, self.ids_globais)
+
+class IndiceBM25Restrito:
+    """
+    Busca no índice completo restrita a um subconjunto de documentos (os scores usam o IDF
+    do corpus inteiro). Usado quando o índice não tem os shards pedidos.
+    """
+
+    def __init__(self, indice: IndiceBM25, ids: np.ndarray):
+        self.indice = indice
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+    def buscar(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return melhores(self.indice.pontuar(query)[self.ids], k, self.ids)
+
+class ShardsBM25:
+    """
+    Shards BM25 pré-construídos por metadado (ver CAMPOS_SHARDS), gravados em
+    `<indice>/shards/`. Cada shard é mapeado em memória na primeira vez que é usado.
+    Os shards ficam na mesma versão do índice completo (veja `salvar_indice_bm25`).
+    """
+
+    def __init__(self, caminho: str, mapa: Dict[str, Dict[str, str]]):
+        self.caminho = caminho
+        self.mapa = mapa
+        self._carregados = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def construir_e_salvar(chunks: List[Any], caminho_indice: str):
+        caminho = os.path.join(caminho_indice, "shards")
+        os.makedirs(caminho)
+        grupos = {campo: {} for campo in CAMPOS_SHARDS}
+        for i, doc in enumerate(chunks):
+            if doc.metadata.get("origem"):
+                grupos["origem"].setdefault(doc.metadata["origem"], []).append(i)
+            if doc.metadata.get("tipo_norma") and doc.metadata.get("numero_norma"):
+                grupos["norma"].setdefault(chave_norma(doc.metadata["tipo_norma"], doc.metadata["numero_norma"]), []).append(i)
+
+        mapa = {}
+        for campo, valores in grupos.items():
+            mapa[campo] = {}
+            for n, (valor, ids) in enumerate(sorted(valores.items())):
+                nome = f"{campo}_{n}"
+                IndiceBM25.construir([chunks[i].page_content for i in ids], ids_globais=np.asarray(ids)).salvar(os.path.join(caminho, nome))
+                mapa[campo][valor] = nome
+        with open(os.path.join(caminho, "shards.json"), "w", encoding="utf-8") as f:
+            json.dump(mapa, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def carregar(cls, caminho_indice: str) -> "ShardsBM25":
+        caminho = os.path.join(resolver_versao(caminho_indice), "shards")
+        mapa = {}
+        if os.path.exists(os.path.join(caminho, "shards.json")):
+            with open(os.path.join(caminho, "shards.json"), "r", encoding="utf-8") as f:
+                mapa = json.load(f)
+        return cls(caminho, mapa)
+
+    def shard(self, campo: str, valor: str) -> Optional[IndiceBM25]:
+        nome = self.mapa.get(campo, {}).get(valor)
+        if nome is None:
+            return None
+        with self._lock:
+            if nome not in self._carregados:
+                try:
+                    self._carregados[nome] = IndiceBM25.carregar(os.path.join(self.caminho, nome))
+                except FileNotFoundError:
+                    # A versão carregada por este processo já foi removida por construções mais novas.
+                    print(f"⚠️  Aviso: Shard BM25 '{nome}' não existe mais em '{self.caminho}'. Reinicie o app para carregar a versão atual.")
+                    return None
+            return self._carregados[nome]
+
+def salvar_indice_bm25(chunks: List[Any], caminho_indice: str):
+    """Grava numa nova versão de `caminho_indice` o índice BM25 completo e os seus shards."""
+    with gravacao_versionada(caminho_indice) as destino:
+        IndiceBM25.construir([doc.page_content for doc in chunks]).salvar(destino)
+        ShardsBM25.construir_e_salvar(chunks, destino)
+
+class RetrieverBM25Compacto(BaseRetriever):
+    """
+    Retriever LangChain sobre o IndiceBM25. Materializa apenas os k Documents
+    retornados, buscando-os em `docs` (sequência endereçada por `original_index`).
+    """
+    indice: Any
+    docs: Any
+    shards: Any = None
+    k: int = 4
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        ids, _ = self.indice.buscar(query, self.k)
+        return [self.docs[int(i)] for i in ids]
+
+    def filtrado(self, campo: str, valores: List[str]) -> Optional["RetrieverBM25Compacto"]:
+        """
+        Retriever restrito aos shards pré-construídos de `campo` (ex.: 'origem') para os
+        `valores` pedidos. Sem shard para nenhum dos valores (índice construído sem shards,
+        ou de uma versão que já foi removida), busca no índice completo restrito aos chunks
+        com esses valores. Retorna None se nenhum chunk tiver os valores.
+        """
+        indices = [self.shards.shard(campo, valor) for valor in valores] if self.shards else []
+        indices = [indice for indice in indices if indice is not None]
+        if indices:
+            indice = indices[0] if len(indices) == 1 else IndiceBM25Combinado(indices)
+            return RetrieverBM25Compacto(indice=indice, docs=self.docs, k=self.k)
+
+        ids = self._ids_com_valor(campo, valores)
+        if ids is None or not len(ids):
+            return None
+        print(f"⚠️  Aviso: Sem shards BM25 de '{campo}' para {list(valores)}; buscando no índice completo restrito a {len(ids)} chunks.")
+        return RetrieverBM25Compacto(indice=IndiceBM25Restrito(self.indice, ids), docs=self.docs, k=self.k)
+
+    def _ids_com_valor(self, campo: str, valores: List[str]) -> Optional[np.ndarray]:
+        if not hasattr(self.docs, "ids_com_valor"):
+            print(f"⚠️  Aviso: Sem shards BM25 de '{campo}' e os chunks não são um ArmazemDeChunks; a busca filtrada foi ignorada.")
+            return None
+        if campo != "norma":
+            return self.docs.ids_com_valor(campo, valores)
+        ids = [np.intersect1d(self.docs.ids_com_valor("tipo_norma", [tipo]), self.docs.ids_com_valor("numero_norma", [numero]))
+               for tipo, numero in (valor.split("|", 1) for valor in valores)]
+        return np.unique(np.concatenate(ids)) if ids else None
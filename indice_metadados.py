@@ -0,0 +1,93 @@
+import os
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from indice_bm25 import chave_norma
+from artefatos_versionados import gravacao_versionada, resolver_versao
+
+# Metadados indexados: cada valor aponta para a lista ordenada de ids (= `original_index`
+# = posição no FAISS) dos chunks que o possuem. O campo sintético "norma" combina
+# (tipo_norma, numero_norma) para que a busca direta por norma seja uma única consulta.
+CAMPOS_INDEXADOS = ("origem", "tipo_norma", "numero_norma")
+CAMPO_NORMA = "norma"
+
+class IndiceMetadados:
+    """
+    Índice invertido metadado -> ids de chunks, construído junto com os demais índices.
+    As listas de ids ficam concatenadas em um único `ids.npy` (mapeado em memória) e
+    `chaves.json` guarda o intervalo [início, fim) de cada (campo, valor).
+    """
+
+    def __init__(self, ids: np.ndarray, chaves: Dict[str, Dict[str, List[int]]]):
+        self._ids = ids
+        self._chaves = chaves
+
+    @staticmethod
+    def construir_e_salvar(chunks: List[Document], caminho: str):
+        grupos = {campo: {} for campo in CAMPOS_INDEXADOS + (CAMPO_NORMA,)}
+        for i, doc in enumerate(chunks):
+            for campo in CAMPOS_INDEXADOS:
+                valor = doc.metadata.get(campo)
+                if valor is not None and valor != "":
+                    grupos[campo].setdefault(str(valor), []).append(i)
+            if doc.metadata.get("tipo_norma") and doc.metadata.get("numero_norma"):
+                grupos[CAMPO_NORMA].setdefault(chave_norma(doc.metadata["tipo_norma"], doc.metadata["numero_norma"]), []).append(i)
+
+        partes, chaves, inicio = [], {}, 0
+        for campo, valores in grupos.items():
+            chaves[campo] = {}
+            for valor, ids in sorted(valores.items()):
+                chaves[campo][valor] = [inicio, inicio + len(ids)]
+                partes.append(np.asarray(ids, dtype=np.int64))
+                inicio += len(ids)
+
+        with gravacao_versionada(caminho) as destino:
+            np.save(os.path.join(destino, "ids.npy"), np.concatenate(partes) if partes else np.empty(0, dtype=np.int64))
+            with open(os.path.join(destino, "chaves.json"), "w", encoding="utf-8") as f:
+                json.dump(chaves, f, ensure_ascii=False)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> "IndiceMetadados":
+        caminho = resolver_versao(caminho)
+        with open(os.path.join(caminho, "chaves.json"), "r", encoding="utf-8") as f:
+            chaves = json.load(f)
+        return cls(np.load(os.path.join(caminho, "ids.npy"), mmap_mode="r"), chaves)
+
+    def campos(self) -> List[str]:
+        return list(self._chaves)
+
+    def ids(self, campo: str, valor: Any) -> np.ndarray:
+        """Ids, em ordem de documento, dos chunks com `campo == valor`."""
+        intervalo = self._chaves.get(campo, {}).get(str(valor))
+        if intervalo is None:
+            return np.empty(0, dtype=np.int64)
+        return np.asarray(self._ids[intervalo[0]:intervalo[1]])
+
+    def ids_da_norma(self, tipo_norma: str, numero_norma: str) -> np.ndarray:
+        """Ids, em ordem de documento, de todos os chunks da norma (tipo_norma, numero_norma)."""
+        return self.ids(CAMPO_NORMA, chave_norma(tipo_norma, numero_norma))
+
+    def ids_para_filtro(self, filtro: Dict[str, Any]) -> Optional[np.ndarray]:
+        """
+        Resolve um filtro no formato do FAISS do LangChain ({campo: valor}, {campo: [valores]}
+        ou {campo: {"$eq"/"$in": ...}}) para o conjunto de ids. Retorna None se o filtro
+        usar um campo ou operador que este índice não cobre.
+        """
+        resultado = None
+        for campo, condicao in filtro.items():
+            if campo not in self._chaves:
+                return None
+            if isinstance(condicao, dict):
+                if set(condicao) - {"$eq", "$in"}:
+                    return None
+                valores = list(condicao.get("$in", [])) + ([condicao["$eq"]] if "$eq" in condicao else [])
+            elif isinstance(condicao, (list, tuple, set)):
+                valores = list(condicao)
+            else:
+                valores = [condicao]
+            ids_campo = np.unique(np.concatenate([self.ids(campo, v) for v in valores])) if valores else np.empty(0, dtype=np.int64)
+            resultado = ids_campo if resultado is None else np.intersect1d(resultado, ids_campo, assume_unique=True)
+        return resultado
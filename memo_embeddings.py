@@ -0,0 +1,90 @@
+import copy
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+class MemoDeEmbeddings(Embeddings):
+    """
+    Memo de embeddings com escopo de uma requisição: cada texto distinto (pergunta
+    original, condensada, reescrita do v3, parágrafo HyDE do v4) é embutido uma única vez,
+    e os textos ainda não vistos de uma mesma chamada vão à API num único lote.
+    Threads que pedem um texto já em voo esperam por ele em vez de repetir a chamada;
+    textos diferentes são embutidos em paralelo. Não deve ser compartilhado entre requisições.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self._lock = threading.Lock()
+        self._vetores: Dict[str, List[float]] = {}
+        self._em_voo: Dict[str, threading.Event] = {}
+
+    def _obter(self, texts: List[str], embutir: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        with self._lock:
+            meus = [t for t in dict.fromkeys(texts) if t not in self._vetores and t not in self._em_voo]
+            for t in meus:
+                self._em_voo[t] = threading.Event()
+            alheios = [self._em_voo[t] for t in dict.fromkeys(texts) if t in self._em_voo and t not in meus]
+        if meus:
+            try:
+                vetores = embutir(meus)
+                with self._lock:
+                    self._vetores.update(zip(meus, vetores))
+            finally:
+                with self._lock:
+                    for t in meus:
+                        self._em_voo.pop(t).set()
+        for evento in alheios:
+            evento.wait()
+        faltantes = [t for t in texts if t not in self._vetores]
+        if faltantes:  # a thread que embutia esses textos falhou; tenta de novo nesta
+            return self._obter(texts, embutir)
+        return [self._vetores[t] for t in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._obter(texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._obter([text], lambda t: [self.embeddings.embed_query(t[0])])[0]
+
+    async def _aobter(self, texts: List[str], aembutir: Callable[[List[str]], Awaitable[List[List[float]]]]) -> List[List[float]]:
+        """Versão assíncrona de `_obter`: mesmo memo e mesmos textos em voo, sem bloquear o event loop."""
+        with self._lock:
+            meus = [t for t in dict.fromkeys(texts) if t not in self._vetores and t not in self._em_voo]
+            for t in meus:
+                self._em_voo[t] = threading.Event()
+            alheios = [self._em_voo[t] for t in dict.fromkeys(texts) if t in self._em_voo and t not in meus]
+        if meus:
+            try:
+                vetores = await aembutir(meus)
+                with self._lock:
+                    self._vetores.update(zip(meus, vetores))
+            finally:
+                with self._lock:
+                    for t in meus:
+                        self._em_voo.pop(t).set()
+        for evento in alheios:
+            if not evento.is_set():
+                await asyncio.to_thread(evento.wait)
+        faltantes = [t for t in texts if t not in self._vetores]
+        if faltantes:
+            return await self._aobter(texts, aembutir)
+        return [self._vetores[t] for t in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._aobter(texts, self.embeddings.aembed_documents)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def aembutir(t: List[str]) -> List[List[float]]:
+            return [await self.embeddings.aembed_query(t[0])]
+        return (await self._aobter([text], aembutir))[0]
+
+def vectorstore_com_memo(vectorstore: Any, memo: MemoDeEmbeddings) -> Any:
+    """
+    Cópia rasa do vectorstore que embute as consultas pelo memo. Índice FAISS, docstore
+    e índice de metadados continuam compartilhados com o original.
+    """
+    copia = copy.copy(vectorstore)
+    copia.embedding_function = memo
+    return copia
@@ -1,204 +1,422 @@
-import os
-import re
-import concurrent.futures
-from typing import Dict, Any, List
-from langchain_core.documents import Document
-from dotenv import load_dotenv
-from pathlib import Path
-
-from langchain_openai import ChatOpenAI
-from langchain_cohere import ChatCohere
-
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-
-# Importa as funções de resposta dos outros motores.
-from chatbot_logica_v2 import obter_resposta_v2
-from chatbot_logica_v3 import obter_resposta_v3
-from chatbot_logica_v4 import obter_resposta_v4
-from chatbot_logica_v5 import obter_resposta_v5
-
-# Importa o template de formatação final.
-from configs_v2 import FINAL_FORMATTER_TEMPLATE
-
-load_dotenv()
-
-# --- DEFINIÇÃO DOS PROMPTS COMPLETOS ---
-
-CONDENSE_QUESTION_PROMPT = """
-Dado o histórico de uma conversa e uma nova pergunta, reformule a nova pergunta para ser uma pergunta autônoma e completa, em português, que possa ser entendida sem o histórico. NÃO responda à pergunta, apenas a reformule.
-
-Histórico da Conversa:
-{chat_history}
-
-Nova Pergunta:
-{question}
-
-Pergunta Autônoma:
-"""
-
-SYNTHESIS_PROMPT_TEMPLATE = """
-Você é um analista regulatório sênior do Banco Central do Brasil, encarregado de produzir uma análise definitiva e completa. Sua tarefa é ler todo o CONTEXTO NORMATIVO fornecido, que contém trechos de diferentes resoluções, e sintetizar uma única resposta coesa e bem fundamentada para a PERGUNTA DO USUÁRIO.
-
-**Instrução Mestra de Síntese:**
-1.  **Leia e Conecte:** Analise todo o contexto. Identifique como as diferentes normas se complementam. Uma norma pode fornecer a fórmula principal, enquanto outra detalha a metodologia de cálculo de seus componentes. Sua principal tarefa é conectar esses pontos.
-2.  **Estruture a Resposta:** Siga rigorosamente a estrutura de resposta padrão (Análise dos Fatos, Dedução Lógica, Conclusão).
-3.  **Fundamente nos Fatos:** Baseie cada afirmação exclusivamente nos trechos fornecidos no CONTEXTO NORMATIVO. Cite os artigos e normas relevantes.
-4.  **Seja Conclusivo:** Não se refira a "outros analistas" ou "pareceres". A análise é sua. Você é a autoridade final.
-
-**Regra de Segurança:**
-Se, mesmo após analisar todo o contexto, as informações forem insuficientes para responder à pergunta, declare isso claramente.
-
----
-**CONTEXTO NORMATIVO (Trechos de todas as normas relevantes encontradas):**
-{consolidated_context}
-
----
-**PERGUNTA DO USUÁRIO:**
-{question}
-
----
-**Sua Análise Final (siga a estrutura padrão):**
-"""
-
-
-# --- FUNÇÕES AUXILIARES ---
-
-def parse_query_for_metadata(question: str) -> Dict[str, str]:
-    """Analisa a pergunta do usuário para extrair menções explícitas a normas."""
-    question_lower = question.lower().strip()
-    patterns = {
-        'carta circular': r'(?:carta circular|c_circ|circ)\s*n?º?\s*(\d+)',
-        'circular': r'circular\s*n?º?\s*(\d+)(?!.*carta)',
-        'resolucao': r'(?:resolucao|res)\s*n?º?\s*(\d+)',
-    }
-    for norma_type, pattern in patterns.items():
-        match = re.search(pattern, question_lower)
-        if match:
-            return {"tipo_norma": norma_type, "numero_norma": match.group(1)}
-    return {}
-
-def extract_metadata_from_filename(file: Path) -> Dict[str, str]:
-    """Extrai metadados do nome de um arquivo para encontrar a norma correspondente."""
-    name = file.stem
-    name_lower = name.lower()
-    meta = {}
- 
-    patterns = {
-        "resolucao": r"^(?:res_|resolucao_?)(\d+)",
-        "carta circular": r"^(?:carta_circular_|c[_\s]?circ[_\s]?|circ[_\s]?)(\d+)",
-        "circular": r"^(?:circular_|circ[_\s]?)(\d+)",
-        "instrucao": r"^(?:dlo_|instrucao_?)(\d+)",
-        "norma": r"^norma[_\s]?(\d+)",
-        "instrumento": r"^(?:instrumento_|intrumento_?)(\d+)",
-        "voto": r"^(?:Voto_|VOTO_?)(\d+)",
-        "contexto": r"^(?:contexto[_\s]?)(\d+)",
-    }
-    for norma_type, pattern in patterns.items():
-        m = re.match(pattern, name_lower)
-        if m:
-            norma_type_normalized = 'resolucao' if 'resolucao' in norma_type else norma_type
-            norma_type_normalized = 'circular' if 'circular' in norma_type and 'carta' not in norma_type else norma_type_normalized
-            return {"tipo_norma": norma_type_normalized, "numero_norma": m.group(1)}
-    return {}
-
-
-# --- FUNÇÃO PRINCIPAL DO MOTOR DE SÍNTESE ---
-
-def obter_resposta_conselho(
-    question: str,
-    chat_history: List[Dict[str, str]],
-    llm: ChatOpenAI,
-    vectorstore: Any,
-    bm25_retriever_full: Any,
-    ordered_chunks: List[Document],
-    available_norms: List[str]  
-) -> Dict[str, Any]:
-    """
-    Executa um pipeline de RAG em múltiplas etapas:
-    1. Expansão: Coleta documentos de vários motores de busca em paralelo.
-    2. Síntese: Usa um LLM avançado para gerar uma resposta a partir do contexto consolidado.
-    """
-    print("--- INICIANDO MOTOR DE 'SÍNTESE AVANÇADA' (RAG Multi-Etapas) ---")
-
-    # ETAPA 0: CONDENSAÇÃO DA PERGUNTA COM HISTÓRICO
-    formatted_chat_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
-    if not formatted_chat_history:
-        standalone_question = question
-    else:
-        condense_prompt = PromptTemplate.from_template(CONDENSE_QUESTION_PROMPT)
-        condense_chain = condense_prompt | llm | StrOutputParser()
-        standalone_question = condense_chain.invoke({
-            "chat_history": formatted_chat_history,
-            "question": question
-        })
-    print(f"-> Pergunta autônoma gerada: {standalone_question}")
-
-
-    # --- ETAPA 1: EXPANSÃO (Coleta de Documentos) ---
-    print("--- ETAPA 1: EXPANSÃO (Coletando documentos de todos os motores) ---")
-    
-    norma_mencionada_meta = parse_query_for_metadata(standalone_question)
-    normas_focadas = []
-    if norma_mencionada_meta:
-        for norm_filename_str in available_norms:
-            file_meta = extract_metadata_from_filename(Path(norm_filename_str))
-            if file_meta == norma_mencionada_meta:
-                normas_focadas.append(norm_filename_str)
-                break
-    
-    all_source_docs = []
-    base_kwargs = {"question": standalone_question, "llm": llm, "vectorstore": vectorstore, "bm25_retriever_full": bm25_retriever_full}
-    kwargs_com_widening = {**base_kwargs, "ordered_chunks": ordered_chunks}
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(obter_resposta_v2, **kwargs_com_widening),
-            executor.submit(obter_resposta_v3, **base_kwargs),
-            executor.submit(obter_resposta_v4, **kwargs_com_widening)
-        ]
-        if normas_focadas:
-            print(f"--> Adicionando busca focada (v5) na norma '{normas_focadas[0]}' à etapa de expansão.")
-            kwargs_v5 = {**kwargs_com_widening, "normas_selecionadas": normas_focadas}
-            futures.append(executor.submit(obter_resposta_v5, **kwargs_v5))
-
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                result = future.result()
-                all_source_docs.extend(result.get('source_documents', []))
-            except Exception as e:
-                print(f"Erro ao obter resultado de um motor: {e}")
-
-    unique_docs_dict = {doc.page_content: doc for doc in all_source_docs}
-    unique_source_docs = list(unique_docs_dict.values())
-    
-    if not unique_source_docs:
-        return {"answer": "Não foi possível encontrar nenhum documento relevante para responder à pergunta.", "source_documents": []}
-
-    print(f"-> Expansão concluída. {len(unique_source_docs)} trechos de documentos únicos foram encontrados.")
-
-
-    # --- ETAPA 2: SÍNTESE (Geração da Resposta Final) ---
-    print("--- ETAPA 2: SÍNTESE (Gerando resposta a partir do contexto consolidado) ---")
-
-    consolidated_context = "\n\n---\n\n".join([doc.page_content for doc in unique_source_docs])
-
-    synthesis_prompt = PromptTemplate(template=SYNTHESIS_PROMPT_TEMPLATE, input_variables=["consolidated_context", "question"])
-    synthesis_llm = ChatCohere(model="command-r-plus-08-2024", temperature=0, cohere_api_key=os.getenv("COHERE_API_KEY"))
-    synthesis_chain = synthesis_prompt | synthesis_llm | StrOutputParser()
-    
-    internal_verdict = synthesis_chain.invoke({
-        "consolidated_context": consolidated_context,
-        "question": standalone_question
-    })
-
-    print("-> Formatando a análise final...")
-    formatter_prompt = PromptTemplate.from_template(FINAL_FORMATTER_TEMPLATE)
-    formatting_chain = formatter_prompt | llm | StrOutputParser()
-    final_answer = formatting_chain.invoke({
-        "verified_analysis": internal_verdict,
-        "question": standalone_question
-    })
-
-    print("--- FINALIZANDO MOTOR DE 'SÍNTESE AVANÇADA' ---")
-    return {"answer": final_answer, "source_documents": unique_source_docs}
+import os
+import re
+import asyncio
+import concurrent.futures
+from typing import Dict, Any, List, Iterator, Tuple
+from langchain_core.documents import Document
+from dotenv import load_dotenv
+from pathlib import Path
+
+from langchain_openai import ChatOpenAI
+
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+# Importa as funções de resposta dos outros motores.
+from chatbot_logica_v2 import buscar_candidatos_v2, buscar_candidatos_v2_async, montar_contexto_v2, sem_documentos
+from chatbot_logica_v3 import buscar_candidatos_v3, buscar_candidatos_v3_async, montar_contexto_v3, montar_contexto_v3_async
+from chatbot_logica_v4 import buscar_candidatos_v4, buscar_candidatos_v4_async, montar_contexto_v4
+from chatbot_logica_v5 import buscar_candidatos_v5, buscar_candidatos_v5_async, montar_contexto_v5
+from pool_candidatos import PoolDeCandidatos
+
+# Importa o template de formatação final.
+from configs_v2 import FINAL_FORMATTER_TEMPLATE, MODOS_SINTESE, get_config
+from cache_respostas import com_cache_de_respostas
+from eventos_stream import etapa, fontes, fim, gerar_resposta, eventos_de_resultado, resultado_de_eventos
+from empacotador_contexto import empacotar_contexto
+from clientes_llm import ChatComLimites, obter_llm_cohere
+
+load_dotenv()
+
+RESPOSTA_SEM_DOCUMENTOS = "Não foi possível encontrar nenhum documento relevante para responder à pergunta."
+
+# Pool do processo para os motores da expansão: pedidos simultâneos dividem as mesmas
+# threads em vez de cada um abrir o seu (as chamadas aos provedores já são limitadas
+# em clientes_llm; isto limita as threads que esperam por elas).
+MAX_WORKERS_CONSELHO = int(os.getenv("CONSELHO_MAX_WORKERS", "16"))
+executor_conselho = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS_CONSELHO, thread_name_prefix="conselho")
+
+# --- DEFINIÇÃO DOS PROMPTS COMPLETOS ---
+
+CONDENSE_QUESTION_PROMPT = """
+Dado o histórico de uma conversa e uma nova pergunta, reformule a nova pergunta para ser uma pergunta autônoma e completa, em português, que possa ser entendida sem o histórico. NÃO responda à pergunta, apenas a reformule.
+
+Histórico da Conversa:
+{chat_history}
+
+Nova Pergunta:
+{question}
+
+Pergunta Autônoma:
+"""
+
+SYNTHESIS_PROMPT_TEMPLATE = """
+Você é um analista regulatório sênior do Banco Central do Brasil, encarregado de produzir uma análise definitiva e completa. Sua tarefa é ler todo o CONTEXTO NORMATIVO fornecido, que contém trechos de diferentes resoluções, e sintetizar uma única resposta coesa e bem fundamentada para a PERGUNTA DO USUÁRIO.
+
+**Instrução Mestra de Síntese:**
+1.  **Leia e Conecte:** Analise todo o contexto. Identifique como as diferentes normas se complementam. Uma norma pode fornecer a fórmula principal, enquanto outra detalha a metodologia de cálculo de seus componentes. Sua principal tarefa é conectar esses pontos.
+2.  **Estruture a Resposta:** Siga rigorosamente a estrutura de resposta padrão (Análise dos Fatos, Dedução Lógica, Conclusão).
+3.  **Fundamente nos Fatos:** Baseie cada afirmação exclusivamente nos trechos fornecidos no CONTEXTO NORMATIVO. Cite os artigos e normas relevantes.
+4.  **Seja Conclusivo:** Não se refira a "outros analistas" ou "pareceres". A análise é sua. Você é a autoridade final.
+
+**Regra de Segurança:**
+Se, mesmo após analisar todo o contexto, as informações forem insuficientes para responder à pergunta, declare isso claramente.
+
+---
+**CONTEXTO NORMATIVO (Trechos de todas as normas relevantes encontradas):**
+{consolidated_context}
+
+---
+**PERGUNTA DO USUÁRIO:**
+{question}
+
+---
+**Sua Análise Final (siga a estrutura padrão):**
+"""
+
+
+# --- FUNÇÕES AUXILIARES ---
+
+def parse_query_for_metadata(question: str) -> Dict[str, str]:
+    """Analisa a pergunta do usuário para extrair menções explícitas a normas."""
+    question_lower = question.lower().strip()
+    patterns = {
+        'carta circular': r'(?:carta circular|c_circ|circ)\s*n?º?\s*(\d+)',
+        'circular': r'circular\s*n?º?\s*(\d+)(?!.*carta)',
+        'resolucao': r'(?:resolucao|res)\s*n?º?\s*(\d+)',
+    }
+    for norma_type, pattern in patterns.items():
+        match = re.search(pattern, question_lower)
+        if match:
+            return {"tipo_norma": norma_type, "numero_norma": match.group(1)}
+    return {}
+
+def extract_metadata_from_filename(file: Path) -> Dict[str, str]:
+    """Extrai metadados do nome de um arquivo para encontrar a norma correspondente."""
+    name = file.stem
+    name_lower = name.lower()
+    meta = {}
+ 
+    patterns = {
+        "resolucao": r"^(?:res_|resolucao_?)(\d+)",
+        "carta circular": r"^(?:carta_circular_|c[_\s]?circ[_\s]?|circ[_\s]?)(\d+)",
+        "circular": r"^(?:circular_|circ[_\s]?)(\d+)",
+        "instrucao": r"^(?:dlo_|instrucao_?)(\d+)",
+        "norma": r"^norma[_\s]?(\d+)",
+        "instrumento": r"^(?:instrumento_|intrumento_?)(\d+)",
+        "voto": r"^(?:Voto_|VOTO_?)(\d+)",
+        "contexto": r"^(?:contexto[_\s]?)(\d+)",
+    }
+    for norma_type, pattern in patterns.items():
+        m = re.match(pattern, name_lower)
+        if m:
+            norma_type_normalized = 'resolucao' if 'resolucao' in norma_type else norma_type
+            norma_type_normalized = 'circular' if 'circular' in norma_type and 'carta' not in norma_type else norma_type_normalized
+            return {"tipo_norma": norma_type_normalized, "numero_norma": m.group(1)}
+    return {}
+
+def encontrar_normas_focadas(standalone_question: str, available_norms: List[str]) -> List[str]:
+    """A norma citada explicitamente na pergunta, se estiver entre as disponíveis."""
+    norma_mencionada_meta = parse_query_for_metadata(standalone_question)
+    normas_focadas = []
+    if norma_mencionada_meta:
+        for norm_filename_str in available_norms:
+            file_meta = extract_metadata_from_filename(Path(norm_filename_str))
+            if file_meta == norma_mencionada_meta:
+                normas_focadas.append(norm_filename_str)
+                break
+    return normas_focadas
+
+
+# --- FUNÇÃO PRINCIPAL DO MOTOR DE SÍNTESE ---
+
+def formatar_historico(chat_history: List[Dict[str, str]]) -> str:
+    return "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
+
+def cadeia_condensacao(llm: ChatOpenAI):
+    condense_prompt = PromptTemplate.from_template(CONDENSE_QUESTION_PROMPT)
+    return condense_prompt | llm | StrOutputParser()
+
+def condensar_pergunta(question: str, chat_history: List[Dict[str, str]], llm: ChatOpenAI) -> str:
+    """Pergunta autônoma: a própria pergunta sem histórico, ou reformulada pelo LLM com ele."""
+    formatted_chat_history = formatar_historico(chat_history)
+    if not formatted_chat_history:
+        return question
+    return cadeia_condensacao(llm).invoke({
+        "chat_history": formatted_chat_history,
+        "question": question
+    })
+
+async def acondensar_pergunta(question: str, chat_history: List[Dict[str, str]], llm: ChatOpenAI) -> str:
+    """Versão assíncrona de `condensar_pergunta`."""
+    formatted_chat_history = formatar_historico(chat_history)
+    if not formatted_chat_history:
+        return question
+    return await cadeia_condensacao(llm).ainvoke({
+        "chat_history": formatted_chat_history,
+        "question": question
+    })
+
+# Motores da expansão: nome -> (buscar, buscar assíncrono, montar, montar assíncrono).
+MOTORES_EXPANSAO = {
+    "v2": (buscar_candidatos_v2, buscar_candidatos_v2_async, montar_contexto_v2, montar_contexto_v2),
+    "v3": (buscar_candidatos_v3, buscar_candidatos_v3_async, montar_contexto_v3, montar_contexto_v3_async),
+    "v4": (buscar_candidatos_v4, buscar_candidatos_v4_async, montar_contexto_v4, montar_contexto_v4),
+    "v5": (buscar_candidatos_v5, buscar_candidatos_v5_async, montar_contexto_v5, montar_contexto_v5),
+}
+
+def _argumentos_dos_motores(standalone_question: str, llm: ChatOpenAI, vectorstore: Any, bm25_retriever_full: Any, ordered_chunks: List[Document],
+                            available_norms: List[str], pool: PoolDeCandidatos) -> Dict[str, Dict[str, Any]]:
+    """Argumentos do `buscar` de cada motor da expansão; o v5 só entra quando a pergunta cita uma norma disponível."""
+    normas_focadas = encontrar_normas_focadas(standalone_question, available_norms)
+    base_kwargs = {"question": standalone_question, "vectorstore": vectorstore, "bm25_retriever_full": bm25_retriever_full, "pool": pool}
+    argumentos = {
+        "v2": {**base_kwargs, "llm": llm, "ordered_chunks": ordered_chunks},
+        "v3": {**base_kwargs, "llm": llm},
+        "v4": {**base_kwargs, "llm": llm, "ordered_chunks": ordered_chunks},
+    }
+    if normas_focadas:
+        print(f"--> Adicionando busca focada (v5) na norma '{normas_focadas[0]}' à etapa de expansão.")
+        argumentos["v5"] = {**base_kwargs, "ordered_chunks": ordered_chunks, "normas_selecionadas": normas_focadas}
+    return argumentos
+
+def _candidatos(estados: Dict[str, Dict[str, Any]]) -> List[Document]:
+    return [doc for estado in estados.values() for doc in estado.get("candidatos", [])]
+
+def _so_buscas_diretas(estados: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Sem as notas do re-ranking, só os motores que resolveram pela busca direta por norma têm contexto."""
+    return {nome: estado for nome, estado in estados.items() if "contexto" in estado}
+
+def _separar_falhas(nomes: List[str], resultados: List[Any], etapa_com_falha: str, erros: List[str]) -> Dict[str, Any]:
+    """Resultados de um `gather(..., return_exceptions=True)` por motor; as exceções vão para `erros`."""
+    sucessos = {}
+    for nome, resultado in zip(nomes, resultados):
+        if isinstance(resultado, Exception):
+            erros.append(_registrar_erro(f"{etapa_com_falha} {nome}", resultado))
+        else:
+            sucessos[nome] = resultado
+    return sucessos
+
+def _docs_unicos(docs: List[Document]) -> List[Document]:
+    return list({doc.page_content: doc for doc in docs}.values())
+
+def expandir_contexto(standalone_question: str, llm: ChatOpenAI, vectorstore: Any, bm25_retriever_full: Any,
+                      ordered_chunks: List[Document], available_norms: List[str]) -> Tuple[List[Document], List[str]]:
+    """
+    Etapa 1 do conselho: coleta e consolida os documentos de todos os motores.
+    Retorna (documentos únicos, falhas): um motor que falha não derruba os outros,
+    mas a falha é devolvida para aparecer no resultado.
+    """
+    # Os motores rodam só até a recuperação: as buscas base (embedding da pergunta, BM25 e
+    # FAISS) saem do pool compartilhado, a união dos candidatos é re-rankeada numa única
+    # chamada e nenhuma resposta intermediária é gerada (só os documentos são usados).
+    pool = PoolDeCandidatos(standalone_question, vectorstore, bm25_retriever_full)
+    argumentos = _argumentos_dos_motores(standalone_question, llm, vectorstore, bm25_retriever_full, ordered_chunks, available_norms, pool)
+
+    estados, erros = {}, []
+    futures = {executor_conselho.submit(MOTORES_EXPANSAO[nome][0], **kwargs): nome for nome, kwargs in argumentos.items()}
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            estados[futures[future]] = future.result()
+        except Exception as e:
+            erros.append(_registrar_erro(f"candidatos do motor {futures[future]}", e))
+
+    try:
+        pool.pontuar(_candidatos(estados))
+    except Exception as e:
+        erros.append(_registrar_erro("re-ranking dos candidatos", e))
+        estados = _so_buscas_diretas(estados)
+
+    all_source_docs = []
+    futures = {nome: executor_conselho.submit(pool.montar_contexto, estados[nome], MOTORES_EXPANSAO[nome][2])
+               for nome in argumentos if nome in estados}
+    for nome, future in futures.items():
+        try:
+            all_source_docs.extend(future.result())
+        except Exception as e:
+            erros.append(_registrar_erro(f"resultado do motor {nome}", e))
+    return _docs_unicos(all_source_docs), erros
+
+async def aexpandir_contexto(standalone_question: str, llm: ChatOpenAI, vectorstore: Any, bm25_retriever_full: Any,
+                             ordered_chunks: List[Document], available_norms: List[str]) -> Tuple[List[Document], List[str]]:
+    """
+    Versão assíncrona de `expandir_contexto`: os motores rodam como corrotinas no mesmo
+    event loop (LLM via `ainvoke`, buscas em threads), sem um pool de threads por pedido.
+    """
+    pool = PoolDeCandidatos(standalone_question, vectorstore, bm25_retriever_full)
+    argumentos = _argumentos_dos_motores(standalone_question, llm, vectorstore, bm25_retriever_full, ordered_chunks, available_norms, pool)
+
+    erros = []
+    resultados = await asyncio.gather(*(MOTORES_EXPANSAO[nome][1](**kwargs) for nome, kwargs in argumentos.items()), return_exceptions=True)
+    estados = _separar_falhas(list(argumentos), resultados, "candidatos do motor", erros)
+
+    try:
+        await pool.apontuar(_candidatos(estados))
+    except Exception as e:
+        erros.append(_registrar_erro("re-ranking dos candidatos", e))
+        estados = _so_buscas_diretas(estados)
+
+    nomes = [nome for nome in argumentos if nome in estados]
+    resultados = await asyncio.gather(*(pool.amontar_contexto(estados[nome], MOTORES_EXPANSAO[nome][3]) for nome in nomes), return_exceptions=True)
+    contextos = _separar_falhas(nomes, resultados, "resultado do motor", erros)
+    return _docs_unicos([doc for nome in nomes if nome in contextos for doc in contextos[nome]]), erros
+
+def _registrar_erro(etapa_com_falha: str, erro: Exception) -> str:
+    mensagem = f"{etapa_com_falha}: {type(erro).__name__}: {erro}"
+    print(f"Erro ao obter {mensagem}")
+    return mensagem
+
+def _com_erros(resultado: Dict[str, Any], erros: List[str]) -> Dict[str, Any]:
+    """Resultado com a lista de falhas parciais (chave "erros"), quando houve alguma."""
+    return {**resultado, "erros": erros} if erros else resultado
+
+def _llm_sintese() -> ChatComLimites:
+    return obter_llm_cohere()
+
+def cadeia_sintese():
+    synthesis_prompt = PromptTemplate(template=SYNTHESIS_PROMPT_TEMPLATE, input_variables=["consolidated_context", "question"])
+    return synthesis_prompt | _llm_sintese() | StrOutputParser()
+
+def cadeia_sintese_unica():
+    """Síntese já no formato final (SINGLE_PASS_SYNTHESIS_TEMPLATE): dispensa a chamada de formatação."""
+    synthesis_prompt = PromptTemplate(template=get_config("single_pass_synthesis_prompt"), input_variables=["consolidated_context", "question"])
+    return synthesis_prompt | _llm_sintese() | StrOutputParser()
+
+def cadeia_formatacao(llm: ChatOpenAI):
+    formatter_prompt = PromptTemplate.from_template(FINAL_FORMATTER_TEMPLATE)
+    return formatter_prompt | llm | StrOutputParser()
+
+def modo_sintese(nome_motor: str) -> str:
+    """Modo de síntese do motor (`modo_sintese_<motor>` no get_config): "duas_etapas" ou "uma_etapa"."""
+    modo = get_config(f"modo_sintese_{nome_motor}")
+    if modo not in MODOS_SINTESE:
+        raise ValueError(f"Modo de síntese inválido: '{modo}'. Opções: {', '.join(MODOS_SINTESE)}.")
+    return modo
+
+async def asintetizar_resposta(consolidated_context: str, standalone_question: str, llm: ChatOpenAI, modo: str) -> str:
+    """Resposta final a partir do contexto: síntese + formatação, ou uma única chamada no modo "uma_etapa"."""
+    entrada = {"consolidated_context": consolidated_context, "question": standalone_question}
+    if modo == "uma_etapa":
+        print("-> Síntese em uma única chamada, já no formato final...")
+        return await cadeia_sintese_unica().ainvoke(entrada)
+    internal_verdict = await cadeia_sintese().ainvoke(entrada)
+    print("-> Formatando a análise final...")
+    return await cadeia_formatacao(llm).ainvoke({"verified_analysis": internal_verdict, "question": standalone_question})
+
+def eventos_sintese(consolidated_context: str, standalone_question: str, llm: ChatOpenAI, modo: str,
+                    source_documents: List[Document]) -> Iterator[Dict[str, Any]]:
+    """Etapas de síntese em eventos; os tokens transmitidos são os da última chamada (a única, no modo "uma_etapa")."""
+    entrada = {"consolidated_context": consolidated_context, "question": standalone_question}
+    if modo == "uma_etapa":
+        print("-> Síntese em uma única chamada, já no formato final...")
+        yield etapa("sintese", f"Sintetizando a resposta a partir de {len(source_documents)} trechos...")
+        yield from gerar_resposta(cadeia_sintese_unica(), entrada, source_documents)
+        return
+    yield etapa("sintese", f"Sintetizando a análise a partir de {len(source_documents)} trechos...")
+    internal_verdict = cadeia_sintese().invoke(entrada)
+    print("-> Formatando a análise final...")
+    yield etapa("formatacao", "Formatando a resposta final...")
+    yield from gerar_resposta(cadeia_formatacao(llm), {"verified_analysis": internal_verdict, "question": standalone_question}, source_documents)
+
+
+# --- FUNÇÃO PRINCIPAL DO MOTOR DE SÍNTESE ---
+
+def obter_resposta_conselho(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: Any,
+    bm25_retriever_full: Any,
+    ordered_chunks: List[Document],
+    available_norms: List[str]  
+) -> Dict[str, Any]:
+    """
+    Executa um pipeline de RAG em múltiplas etapas:
+    1. Expansão: Coleta documentos de vários motores de busca em paralelo.
+    2. Síntese: Usa um LLM avançado para gerar uma resposta a partir do contexto consolidado,
+       formatada numa segunda chamada ou já na mesma (modo_sintese_conselho).
+    Devolve o resultado final de `obter_resposta_conselho_stream`.
+    """
+    return resultado_de_eventos(obter_resposta_conselho_stream(
+        question, chat_history, llm, vectorstore, bm25_retriever_full, ordered_chunks, available_norms))
+
+
+# --- VERSÃO EM STREAMING ---
+
+@com_cache_de_respostas("conselho")
+def obter_resposta_conselho_stream(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: Any,
+    bm25_retriever_full: Any,
+    ordered_chunks: List[Document],
+    available_norms: List[str]
+) -> Iterator[Dict[str, Any]]:
+    """
+    Pipeline do conselho em eventos de etapa (pergunta condensada, fontes, síntese),
+    transmitindo os tokens da última chamada ao LLM (veja eventos_stream).
+    """
+    print("--- INICIANDO MOTOR DE 'SÍNTESE AVANÇADA' (RAG Multi-Etapas) ---")
+
+    # ETAPA 0: CONDENSAÇÃO DA PERGUNTA COM HISTÓRICO
+    standalone_question = condensar_pergunta(question, chat_history, llm)
+    print(f"-> Pergunta autônoma gerada: {standalone_question}")
+    if standalone_question != question:
+        yield etapa("pergunta_autonoma", standalone_question)
+
+    # --- ETAPA 1: EXPANSÃO (Coleta de Documentos) ---
+    print("--- ETAPA 1: EXPANSÃO (Coletando documentos de todos os motores) ---")
+    yield etapa("expansao", "Coletando documentos de todos os motores...")
+    unique_source_docs, erros = expandir_contexto(standalone_question, llm, vectorstore, bm25_retriever_full, ordered_chunks, available_norms)
+    if erros:
+        yield etapa("falhas", "; ".join(erros))
+    if not unique_source_docs:
+        yield from eventos_de_resultado(_com_erros(sem_documentos(RESPOSTA_SEM_DOCUMENTOS), erros))
+        return
+    print(f"-> Expansão concluída. {len(unique_source_docs)} trechos de documentos únicos foram encontrados.")
+
+    # --- ETAPA 2: SÍNTESE (Geração da Resposta Final) ---
+    print("--- ETAPA 2: SÍNTESE (Gerando resposta a partir do contexto consolidado) ---")
+    consolidated_context, unique_source_docs = empacotar_contexto(unique_source_docs, standalone_question)
+    if not unique_source_docs:
+        yield from eventos_de_resultado(_com_erros(sem_documentos(RESPOSTA_SEM_DOCUMENTOS), erros))
+        return
+    yield fontes(unique_source_docs)
+    for evento in eventos_sintese(consolidated_context, standalone_question, llm, modo_sintese("conselho"), unique_source_docs):
+        yield fim(_com_erros(evento["resultado"], erros)) if evento["tipo"] == "fim" else evento
+    print("--- FINALIZANDO MOTOR DE 'SÍNTESE AVANÇADA' ---")
+
+
+# --- VERSÃO ASSÍNCRONA ---
+
+@com_cache_de_respostas("conselho")
+async def obter_resposta_conselho_async(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: Any,
+    bm25_retriever_full: Any,
+    ordered_chunks: List[Document],
+    available_norms: List[str]
+) -> Dict[str, Any]:
+    """Versão assíncrona de `obter_resposta_conselho` (a expansão em `aexpandir_contexto`)."""
+    print("--- INICIANDO MOTOR DE 'SÍNTESE AVANÇADA' (RAG Multi-Etapas, assíncrono) ---")
+
+    standalone_question = await acondensar_pergunta(question, chat_history, llm)
+    print(f"-> Pergunta autônoma gerada: {standalone_question}")
+
+    print("--- ETAPA 1: EXPANSÃO (Coletando documentos de todos os motores) ---")
+    unique_source_docs, erros = await aexpandir_contexto(standalone_question, llm, vectorstore, bm25_retriever_full, ordered_chunks, available_norms)
+    if not unique_source_docs:
+        return _com_erros(sem_documentos(RESPOSTA_SEM_DOCUMENTOS), erros)
+    print(f"-> Expansão concluída. {len(unique_source_docs)} trechos de documentos únicos foram encontrados.")
+
+    print("--- ETAPA 2: SÍNTESE (Gerando resposta a partir do contexto consolidado) ---")
+    consolidated_context, unique_source_docs = empacotar_contexto(unique_source_docs, standalone_question)
+    if not unique_source_docs:
+        return _com_erros(sem_documentos(RESPOSTA_SEM_DOCUMENTOS), erros)
+    final_answer = await asintetizar_resposta(consolidated_context, standalone_question, llm, modo_sintese("conselho"))
+
+    print("--- FINALIZANDO MOTOR DE 'SÍNTESE AVANÇADA' (assíncrono) ---")
+    return _com_erros({"answer": final_answer, "source_documents": unique_source_docs}, erros)
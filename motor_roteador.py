@@ -1,113 +1,156 @@
-import os
-from typing import Dict, Any, List
-from langchain_core.documents import Document
-from dotenv import load_dotenv
-
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain.chains.llm import LLMChain
-
-from motor_unificado import obter_resposta_unificada
-
-load_dotenv()
-
-# --- DEFINIÇÃO DOS PROMPTS PARA O ROTEADOR ---
-
-ROUTER_PROMPT_TEMPLATE = """
-Sua tarefa é classificar a pergunta do usuário em uma de duas categorias, com base em sua intenção. Responda apenas com o nome da categoria.
-
-Categorias:
-- "Consulta Normativa": A pergunta envolve a interpretação, cálculo, aplicação ou detalhes de uma lei, regra, norma, resolução ou artigo.
-- "Consulta Factual": A pergunta busca uma definição, descrição ou informação geral sobre uma entidade, pessoa, produto ou conceito.
-
-Pergunta do Usuário:
-"{question}"
-
-Categoria:
-"""
-
-FACTUAL_PROMPT_TEMPLATE = """
-Você é um assistente de conhecimento, especialista em extrair e apresentar informações de forma clara e organizada. Sua tarefa é responder à pergunta do usuário criando um resumo completo e bem estruturado, utilizando apenas as informações fornecidas no contexto abaixo.
-
-**Instruções:**
-1.  **Síntese Completa:** Leia todo o contexto e sintetize as informações para fornecer uma resposta abrangente.
-2.  **Estrutura Lógica:** Organize a resposta em parágrafos. Comece com uma definição ou resumo geral e, em seguida, adicione detalhes importantes, como datas, classificações, produtos ou objetivos.
-3.  **Linguagem Clara:** Use uma linguagem direta e clara. Evite jargões, a menos que sejam explicados.
-4.  **Fidelidade ao Contexto:** Não adicione nenhuma informação que não esteja explicitamente no texto do contexto. Se a informação não estiver lá, não a invente.
-
-Contexto:
-{context}
-
-Pergunta do Usuário:
-{question}
-
-Resposta Completa e Estruturada:
-"""
-
-
-# --- FUNÇÃO PRINCIPAL DO MOTOR ROTEADOR (MODIFICADA) ---
-
-def obter_resposta_roteada(
-    question: str,
-    chat_history: List[Dict[str, str]],
-    llm: ChatOpenAI,
-    vectorstore: Any,
-    bm25_retriever_full: Any,
-    ordered_chunks: List[Document],
-    available_norms: List[str]
-) -> Dict[str, Any]:
-    """
-    Primeiro, classifica a intenção da pergunta e depois a direciona
-    para o pipeline de RAG apropriado.
-    """
-    print("--- INICIANDO MOTOR ROTEADOR ---")
-
-    # ETAPA 1: CLASSIFICAÇÃO DA INTENÇÃO
-    print(f"-> Classificando a pergunta: '{question}'")
-    router_prompt = PromptTemplate.from_template(ROUTER_PROMPT_TEMPLATE)
-    router_chain = router_prompt | llm | StrOutputParser()
-    intent = router_chain.invoke({"question": question}).strip()
-    print(f"--> Intenção detectada: {intent}")
-
-    # ETAPA 2: ROTEAMENTO PARA O ESPECIALISTA CORRETO
-
-    if intent == "Consulta Normativa":
-        print("--> Roteando para o Motor Unificado.")
-        return obter_resposta_unificada(
-            question=question,
-            chat_history=chat_history,
-            llm=llm,
-            vectorstore=vectorstore,
-            bm25_retriever_full=bm25_retriever_full,
-            ordered_chunks=ordered_chunks,
-            available_norms=available_norms
-        )
-    
-    elif intent == "Consulta Factual":
-        print("--> Roteando para o Motor Factual Simples.")
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
-        docs = retriever.invoke(question)
-        
-        if not docs:
-            return {"answer": "Desculpe, não encontrei informações sobre este tópico.", "source_documents": []}
-        
-        context_text = "\n\n---\n\n".join([doc.page_content for doc in docs])
-        
-        factual_prompt = PromptTemplate.from_template(FACTUAL_PROMPT_TEMPLATE)
-        factual_chain = LLMChain(llm=llm, prompt=factual_prompt)
-        response = factual_chain.invoke({"context": context_text, "question": question})
-        
-        return {"answer": response['text'], "source_documents": docs}
-
-    else:
-        print("--> Não foi possível classificar a intenção, usando o motor padrão (Unificado).")
-        return obter_resposta_unificada(
-            question=question,
-            chat_history=chat_history,
-            llm=llm,
-            vectorstore=vectorstore,
-            bm25_retriever_full=bm25_retriever_full,
-            ordered_chunks=ordered_chunks,
-            available_norms=available_norms
-        )
\ No newline at end of file
+import os
+from typing import Dict, Any, List, Iterator
+from langchain_core.documents import Document
+from dotenv import load_dotenv
+
+from langchain_openai import ChatOpenAI
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from motor_unificado import obter_resposta_unificada_async, obter_resposta_unificada_stream
+from cache_respostas import com_cache_de_respostas
+from eventos_stream import etapa, fontes, gerar_resposta, eventos_de_resultado, resultado_de_eventos
+from chatbot_logica_v2 import sem_documentos
+from classificador_intencao import CONSULTA_NORMATIVA, CONSULTA_FACTUAL, classificar_intencao, aclassificar_intencao
+
+load_dotenv()
+
+# --- DEFINIÇÃO DOS PROMPTS PARA O ROTEADOR ---
+
+FACTUAL_PROMPT_TEMPLATE = """
+Você é um assistente de conhecimento, especialista em extrair e apresentar informações de forma clara e organizada. Sua tarefa é responder à pergunta do usuário criando um resumo completo e bem estruturado, utilizando apenas as informações fornecidas no contexto abaixo.
+
+**Instruções:**
+1.  **Síntese Completa:** Leia todo o contexto e sintetize as informações para fornecer uma resposta abrangente.
+2.  **Estrutura Lógica:** Organize a resposta em parágrafos. Comece com uma definição ou resumo geral e, em seguida, adicione detalhes importantes, como datas, classificações, produtos ou objetivos.
+3.  **Linguagem Clara:** Use uma linguagem direta e clara. Evite jargões, a menos que sejam explicados.
+4.  **Fidelidade ao Contexto:** Não adicione nenhuma informação que não esteja explicitamente no texto do contexto. Se a informação não estiver lá, não a invente.
+
+Contexto:
+{context}
+
+Pergunta do Usuário:
+{question}
+
+Resposta Completa e Estruturada:
+"""
+
+RESPOSTA_FACTUAL_SEM_DOCUMENTOS = "Desculpe, não encontrei informações sobre este tópico."
+K_FACTUAL = 6
+
+def _cadeia_factual(question: str, llm: ChatOpenAI, docs: List[Document]):
+    """Cadeia do Motor Factual Simples e a sua entrada."""
+    context_text = "\n\n---\n\n".join([doc.page_content for doc in docs])
+    factual_chain = PromptTemplate.from_template(FACTUAL_PROMPT_TEMPLATE) | llm | StrOutputParser()
+    return factual_chain, {"context": context_text, "question": question}
+
+def _anunciar_rota_unificada(intent: str):
+    if intent == CONSULTA_NORMATIVA:
+        print("--> Roteando para o Motor Unificado.")
+    else:
+        print("--> Não foi possível classificar a intenção, usando o motor padrão (Unificado).")
+
+
+# --- FUNÇÃO PRINCIPAL DO MOTOR ROTEADOR (MODIFICADA) ---
+
+def obter_resposta_roteada(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: Any,
+    bm25_retriever_full: Any,
+    ordered_chunks: List[Document],
+    available_norms: List[str]
+) -> Dict[str, Any]:
+    """
+    Primeiro, classifica a intenção da pergunta e depois a direciona
+    para o pipeline de RAG apropriado. A intenção vem do classificador local
+    (classificador_intencao) e só vai ao LLM quando ele não está confiante.
+    Devolve o resultado final de `obter_resposta_roteada_stream`.
+    """
+    return resultado_de_eventos(obter_resposta_roteada_stream(
+        question, chat_history, llm, vectorstore, bm25_retriever_full, ordered_chunks, available_norms))
+
+
+# --- VERSÃO EM STREAMING ---
+
+@com_cache_de_respostas("roteado")
+def obter_resposta_roteada_stream(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: Any,
+    bm25_retriever_full: Any,
+    ordered_chunks: List[Document],
+    available_norms: List[str]
+) -> Iterator[Dict[str, Any]]:
+    """Pipeline do roteador em eventos de etapa e tokens da resposta (veja eventos_stream)."""
+    print("--- INICIANDO MOTOR ROTEADOR ---")
+
+    # ETAPA 1: CLASSIFICAÇÃO DA INTENÇÃO
+    print(f"-> Classificando a pergunta: '{question}'")
+    intent, origem = classificar_intencao(question, llm)
+    print(f"--> Intenção detectada ({origem}): {intent}")
+    yield etapa("intencao", f"{intent or 'não reconhecida, usando o Motor Unificado'} ({origem})")
+
+    # ETAPA 2: ROTEAMENTO PARA O ESPECIALISTA CORRETO
+    if intent == CONSULTA_FACTUAL:
+        print("--> Roteando para o Motor Factual Simples.")
+        docs = vectorstore.as_retriever(search_kwargs={"k": K_FACTUAL}).invoke(question)
+        if not docs:
+            yield from eventos_de_resultado(sem_documentos(RESPOSTA_FACTUAL_SEM_DOCUMENTOS))
+            return
+        yield fontes(docs)
+        yield from gerar_resposta(*_cadeia_factual(question, llm, docs), docs)
+        return
+
+    _anunciar_rota_unificada(intent)
+    yield from obter_resposta_unificada_stream(
+        question=question,
+        chat_history=chat_history,
+        llm=llm,
+        vectorstore=vectorstore,
+        bm25_retriever_full=bm25_retriever_full,
+        ordered_chunks=ordered_chunks,
+        available_norms=available_norms
+    )
+
+
+# --- VERSÃO ASSÍNCRONA ---
+
+@com_cache_de_respostas("roteado")
+async def obter_resposta_roteada_async(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: Any,
+    bm25_retriever_full: Any,
+    ordered_chunks: List[Document],
+    available_norms: List[str]
+) -> Dict[str, Any]:
+    """Versão assíncrona de `obter_resposta_roteada`."""
+    print("--- INICIANDO MOTOR ROTEADOR (assíncrono) ---")
+
+    print(f"-> Classificando a pergunta: '{question}'")
+    intent, origem = await aclassificar_intencao(question, llm)
+    print(f"--> Intenção detectada ({origem}): {intent}")
+
+    if intent == CONSULTA_FACTUAL:
+        print("--> Roteando para o Motor Factual Simples.")
+        docs = await vectorstore.as_retriever(search_kwargs={"k": K_FACTUAL}).ainvoke(question)
+        if not docs:
+            return sem_documentos(RESPOSTA_FACTUAL_SEM_DOCUMENTOS)
+
+        factual_chain, entrada = _cadeia_factual(question, llm, docs)
+        return {"answer": await factual_chain.ainvoke(entrada), "source_documents": docs}
+
+    _anunciar_rota_unificada(intent)
+    return await obter_resposta_unificada_async(
+        question=question,
+        chat_history=chat_history,
+        llm=llm,
+        vectorstore=vectorstore,
+        bm25_retriever_full=bm25_retriever_full,
+        ordered_chunks=ordered_chunks,
+        available_norms=available_norms
+    )
@@ -1,113 +1,197 @@
-import os
-from typing import List, Dict, Any
-
-from langchain_cohere import CohereRerank
-from langchain_core.documents import Document
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.retrievers import BM25Retriever, EnsembleRetriever
-from langchain_community.vectorstores import FAISS
-from langchain.chains.llm import LLMChain
-from langchain_cohere import ChatCohere
-from langchain_core.output_parsers import StrOutputParser
-
-from configs_v2 import FINAL_FORMATTER_TEMPLATE
-from extrator_metadados import ExtratorDeMetadados
-from motor_conselho import CONDENSE_QUESTION_PROMPT, SYNTHESIS_PROMPT_TEMPLATE
-
-K_INITIAL_SEARCH = 70
-RERANKER_TOP_N = 9
-
-def obter_resposta_unificada(
-    question: str,
-    chat_history: List[Dict[str, str]],
-    llm: ChatOpenAI,
-    vectorstore: FAISS,
-    bm25_retriever_full: BM25Retriever,
-    ordered_chunks: List[Document],
-    available_norms: List[str] 
-) -> Dict[str, Any]:
-    """
-    Executa um pipeline de RAG unificado e sequencial:
-    1. Condensa a pergunta com base no histórico.
-    2. Extrai metadados da pergunta para criar filtros de busca.
-    3. Executa uma busca híbrida (BM25 + Vetorial) usando os filtros.
-    4. Re-rankeia os resultados para obter os melhores candidatos.
-    5. Usa uma cadeia de LLMs (Síntese + Formatação) para gerar a resposta final.
-    """
-    print("\n--- INICIANDO MOTOR UNIFICADO v1.0 (Sequencial) ---")
-
-    # ETAPA 1: CONDENSAÇÃO DA PERGUNTA (Lógica reaproveitada do motor_conselho)
-    formatted_chat_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
-    if not formatted_chat_history:
-        standalone_question = question
-    else:
-        condense_prompt = PromptTemplate.from_template(CONDENSE_QUESTION_PROMPT)
-        condense_chain = condense_prompt | llm | StrOutputParser()
-        standalone_question = condense_chain.invoke({
-            "chat_history": formatted_chat_history,
-            "question": question
-        })
-    print(f"-> Pergunta autônoma: {standalone_question}")
-
-    # ETAPA 2: EXTRAÇÃO DE METADADOS PARA FILTRAGEM
-    metadata_extractor = ExtratorDeMetadados(llm)
-    extracted_filters = metadata_extractor.extrair_filtros(standalone_question)
-
-    # ETAPA 3: RECUPERAÇÃO HÍBRIDA E FILTRADA
-    print("--- ETAPA 3: Recuperação Híbrida Filtrada ---")
-
-    search_kwargs = {'k': K_INITIAL_SEARCH}
-    if extracted_filters:
-
-        faiss_filter = {k: v for k, v in extracted_filters.items() if k in ["tipo_norma", "numero_norma"]}
-        if faiss_filter:
-             search_kwargs['filter'] = faiss_filter
-
-    faiss_retriever = vectorstore.as_retriever(search_kwargs=search_kwargs)
-
-    bm25_retriever_full.k = K_INITIAL_SEARCH
-
-    ensemble_retriever = EnsembleRetriever(
-        retrievers=[bm25_retriever_full, faiss_retriever], weights=[0.5, 0.5]
-    )
-    
-    initial_chunks = ensemble_retriever.invoke(standalone_question)
-    print(f"-> {len(initial_chunks)} documentos recuperados na busca inicial.")
-    if not initial_chunks:
-        return {"answer": "Com base nos documentos fornecidos, não encontrei informações para responder a essa pergunta.", "source_documents": []}
-
-    # ETAPA 4: RE-RANKING (Lógica reaproveitada)
-    print("--- ETAPA 4: Re-ranking dos documentos ---")
-    reranker = CohereRerank(cohere_api_key=os.getenv("COHERE_API_KEY"), model="rerank-multilingual-v3.0", top_n=RERANKER_TOP_N)
-    reranked_chunks = reranker.compress_documents(documents=initial_chunks, query=standalone_question)
-    
-    unique_docs_dict = {doc.page_content: doc for doc in reranked_chunks}
-    final_context_docs = list(unique_docs_dict.values())
-
-    if not final_context_docs:
-        return {"answer": "Após o re-ranking, nenhum trecho foi considerado relevante para a pergunta.", "source_documents": []}
-    print(f"-> {len(final_context_docs)} documentos unicos após re-ranking.")
-
-
-    # ETAPA 5: SÍNTESE E FORMATAÇÃO (Lógica reaproveitada do motor_conselho)
-    print("--- ETAPA 5: Geração da Resposta Final (Síntese + Formatação) ---")
-    consolidated_context = "\n\n---\n\n".join([doc.page_content for doc in final_context_docs])
-
-    synthesis_prompt = PromptTemplate(template=SYNTHESIS_PROMPT_TEMPLATE, input_variables=["consolidated_context", "question"])
-    synthesis_llm = ChatCohere(model="command-r-plus-08-2024", temperature=0, cohere_api_key=os.getenv("COHERE_API_KEY"))
-    synthesis_chain = synthesis_prompt | synthesis_llm | StrOutputParser()
-    internal_verdict = synthesis_chain.invoke({
-        "consolidated_context": consolidated_context,
-        "question": standalone_question
-    })
-
-    formatter_prompt = PromptTemplate.from_template(FINAL_FORMATTER_TEMPLATE)
-    formatting_chain = formatter_prompt | llm | StrOutputParser()
-    final_answer = formatting_chain.invoke({
-        "verified_analysis": internal_verdict,
-        "question": standalone_question
-    })
-    
-    print("--- FINALIZANDO MOTOR UNIFICADO ---")
-    return {"answer": final_answer, "source_documents": final_context_docs}
\ No newline at end of file
+import asyncio
+from typing import List, Dict, Any, Iterator, Tuple
+
+from langchain_core.documents import Document
+from langchain_openai import ChatOpenAI
+from langchain_community.vectorstores import FAISS
+
+from cache_respostas import com_cache_de_respostas
+from extrator_metadados import ExtratorDeMetadados
+from servico_rerank import obter_servico_rerank
+from retriever_hibrido import RetrieverHibrido
+from indice_bm25 import RetrieverBM25Compacto
+from memo_embeddings import MemoDeEmbeddings, vectorstore_com_memo
+from motor_conselho import parse_query_for_metadata, formatar_historico, modo_sintese, asintetizar_resposta, eventos_sintese, RESPOSTA_SEM_DOCUMENTOS
+from chatbot_logica_v2 import RESPOSTA_SEM_INFORMACOES, sem_documentos
+from chatbot_logica_v5 import RESPOSTA_SEM_RERANK
+from eventos_stream import etapa, fontes, eventos_de_resultado, resultado_de_eventos
+from empacotador_contexto import empacotar_contexto
+
+K_INITIAL_SEARCH = 70
+RERANKER_TOP_N = 9
+CHAVES_FILTRO = ["tipo_norma", "numero_norma"]
+
+def _filtros_sem_llm(formatted_chat_history: str, question: str) -> Dict[str, str]:
+    """Sem histórico, a norma citada explicitamente na pergunta (regex) já é o filtro: dispensa o LLM."""
+    if formatted_chat_history:
+        return {}
+    filtros = parse_query_for_metadata(question)
+    if filtros:
+        print(f"-> Pergunta autônoma: {question}")
+        print(f"--> Filtros extraídos sem LLM: {filtros}")
+    return filtros
+
+def _so_filtros_de_norma(extracted_filters: Dict[str, Any]) -> Dict[str, str]:
+    return {k: v for k, v in extracted_filters.items() if k in CHAVES_FILTRO}
+
+def _retriever_filtrado(vectorstore: FAISS, bm25_retriever_full: RetrieverBM25Compacto, ordered_chunks: List[Document],
+                        faiss_filter: Dict[str, str]) -> RetrieverHibrido:
+    return RetrieverHibrido(
+        vectorstore=vectorstore, bm25=bm25_retriever_full, docs=ordered_chunks,
+        k=K_INITIAL_SEARCH, filtro=faiss_filter or None
+    )
+
+def condensar_e_filtrar(question: str, chat_history: List[Dict[str, str]], llm: ChatOpenAI) -> Tuple[str, Dict[str, str]]:
+    """
+    Pergunta autônoma e filtro de norma (tipo_norma/numero_norma) com no máximo uma chamada ao LLM:
+    - sem histórico e com a norma resolvida pelo regex, nenhuma chamada;
+    - sem histórico, a pergunta já é autônoma e só a extração de filtros vai ao LLM;
+    - com histórico, uma única chamada devolve a pergunta condensada e os filtros.
+    """
+    formatted_chat_history = formatar_historico(chat_history)
+    filtros = _filtros_sem_llm(formatted_chat_history, question)
+    if filtros:
+        return question, filtros
+    metadata_extractor = ExtratorDeMetadados(llm)
+    if not formatted_chat_history:
+        print(f"-> Pergunta autônoma: {question}")
+        standalone_question, extracted_filters = question, metadata_extractor.extrair_filtros(question)
+    else:
+        standalone_question, extracted_filters = metadata_extractor.condensar_e_extrair(question, formatted_chat_history)
+    return standalone_question, _so_filtros_de_norma(extracted_filters)
+
+async def acondensar_e_filtrar(question: str, chat_history: List[Dict[str, str]], llm: ChatOpenAI) -> Tuple[str, Dict[str, str]]:
+    formatted_chat_history = formatar_historico(chat_history)
+    filtros = _filtros_sem_llm(formatted_chat_history, question)
+    if filtros:
+        return question, filtros
+    metadata_extractor = ExtratorDeMetadados(llm)
+    if not formatted_chat_history:
+        print(f"-> Pergunta autônoma: {question}")
+        standalone_question, extracted_filters = question, await metadata_extractor.aextrair_filtros(question)
+    else:
+        standalone_question, extracted_filters = await metadata_extractor.acondensar_e_extrair(question, formatted_chat_history)
+    return standalone_question, _so_filtros_de_norma(extracted_filters)
+
+def obter_resposta_unificada(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: FAISS,
+    bm25_retriever_full: RetrieverBM25Compacto,
+    ordered_chunks: List[Document],
+    available_norms: List[str] 
+) -> Dict[str, Any]:
+    """
+    Executa um pipeline de RAG unificado e sequencial:
+    1-2. Condensa a pergunta com base no histórico e extrai metadados para os filtros de
+         busca, numa única chamada ao LLM (nenhuma, se o regex já resolve a norma).
+    3. Executa uma busca híbrida (BM25 + Vetorial) usando os filtros.
+    4. Re-rankeia os resultados para obter os melhores candidatos.
+    5. Usa uma cadeia de LLMs (Síntese + Formatação) para gerar a resposta final, ou uma
+       única chamada de síntese já formatada (modo_sintese_unificado = "uma_etapa").
+    Devolve o resultado final de `obter_resposta_unificada_stream`.
+    """
+    return resultado_de_eventos(obter_resposta_unificada_stream(
+        question, chat_history, llm, vectorstore, bm25_retriever_full, ordered_chunks, available_norms))
+
+
+# --- VERSÃO EM STREAMING ---
+
+@com_cache_de_respostas("unificado")
+def obter_resposta_unificada_stream(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: FAISS,
+    bm25_retriever_full: RetrieverBM25Compacto,
+    ordered_chunks: List[Document],
+    available_norms: List[str]
+) -> Iterator[Dict[str, Any]]:
+    """
+    Pipeline unificado em eventos de etapa (pergunta condensada, filtros, fontes, síntese),
+    transmitindo os tokens da última chamada ao LLM (veja eventos_stream).
+    """
+    print("\n--- INICIANDO MOTOR UNIFICADO v1.0 (Sequencial) ---")
+
+    # ETAPAS 1 e 2: PERGUNTA AUTÔNOMA E FILTROS DE METADADOS
+    standalone_question, faiss_filter = condensar_e_filtrar(question, chat_history, llm)
+    if standalone_question != question:
+        yield etapa("pergunta_autonoma", standalone_question)
+    yield etapa("filtros", ", ".join(f"{k}: {v}" for k, v in faiss_filter.items()) or "Nenhum filtro de norma.")
+
+    # ETAPA 3: RECUPERAÇÃO HÍBRIDA E FILTRADA
+    print("--- ETAPA 3: Recuperação Híbrida Filtrada ---")
+    yield etapa("recuperacao", "Buscando e re-rankeando os trechos relevantes...")
+    initial_chunks = _retriever_filtrado(vectorstore, bm25_retriever_full, ordered_chunks, faiss_filter).invoke(standalone_question)
+    print(f"-> {len(initial_chunks)} documentos recuperados na busca inicial.")
+    if not initial_chunks:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_INFORMACOES))
+        return
+
+    # ETAPA 4: RE-RANKING (Lógica reaproveitada)
+    print("--- ETAPA 4: Re-ranking dos documentos ---")
+    final_context_docs = obter_servico_rerank().reranquear(initial_chunks, standalone_question, RERANKER_TOP_N)  # já deduplica por original_index
+    if not final_context_docs:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_RERANK))
+        return
+    print(f"-> {len(final_context_docs)} documentos unicos após re-ranking.")
+
+    # ETAPA 5: SÍNTESE E FORMATAÇÃO (Lógica reaproveitada do motor_conselho)
+    print("--- ETAPA 5: Geração da Resposta Final (Síntese + Formatação) ---")
+    consolidated_context, final_context_docs = empacotar_contexto(final_context_docs, standalone_question)
+    if not final_context_docs:
+        yield from eventos_de_resultado(sem_documentos(RESPOSTA_SEM_DOCUMENTOS))
+        return
+    yield fontes(final_context_docs)
+    yield from eventos_sintese(consolidated_context, standalone_question, llm, modo_sintese("unificado"), final_context_docs)
+    print("--- FINALIZANDO MOTOR UNIFICADO ---")
+
+
+# --- VERSÃO ASSÍNCRONA ---
+
+@com_cache_de_respostas("unificado")
+async def obter_resposta_unificada_async(
+    question: str,
+    chat_history: List[Dict[str, str]],
+    llm: ChatOpenAI,
+    vectorstore: FAISS,
+    bm25_retriever_full: RetrieverBM25Compacto,
+    ordered_chunks: List[Document],
+    available_norms: List[str]
+) -> Dict[str, Any]:
+    """
+    Versão assíncrona de `obter_resposta_unificada`. Sem histórico a pergunta já é a
+    autônoma e o seu embedding é calculado enquanto o LLM extrai os filtros; a busca
+    híbrida o reaproveita pelo memo.
+    """
+    print("\n--- INICIANDO MOTOR UNIFICADO v1.0 (assíncrono) ---")
+
+    memo = MemoDeEmbeddings(vectorstore.embeddings)
+    if chat_history:
+        standalone_question, faiss_filter = await acondensar_e_filtrar(question, chat_history, llm)
+    else:
+        (standalone_question, faiss_filter), _ = await asyncio.gather(
+            acondensar_e_filtrar(question, chat_history, llm), memo.aembed_query(question))
+
+    print("--- ETAPA 3: Recuperação Híbrida Filtrada ---")
+    hybrid_retriever = _retriever_filtrado(vectorstore_com_memo(vectorstore, memo), bm25_retriever_full, ordered_chunks, faiss_filter)
+    initial_chunks = await hybrid_retriever.ainvoke(standalone_question)
+    print(f"-> {len(initial_chunks)} documentos recuperados na busca inicial.")
+    if not initial_chunks:
+        return sem_documentos(RESPOSTA_SEM_INFORMACOES)
+
+    print("--- ETAPA 4: Re-ranking dos documentos ---")
+    final_context_docs = await asyncio.to_thread(obter_servico_rerank().reranquear, initial_chunks, standalone_question, RERANKER_TOP_N)
+    if not final_context_docs:
+        return sem_documentos(RESPOSTA_SEM_RERANK)
+    print(f"-> {len(final_context_docs)} documentos unicos após re-ranking.")
+
+    print("--- ETAPA 5: Geração da Resposta Final (Síntese + Formatação) ---")
+    consolidated_context, final_context_docs = empacotar_contexto(final_context_docs, standalone_question)
+    if not final_context_docs:
+        return sem_documentos(RESPOSTA_SEM_DOCUMENTOS)
+    final_answer = await asintetizar_resposta(consolidated_context, standalone_question, llm, modo_sintese("unificado"))
+
+    print("--- FINALIZANDO MOTOR UNIFICADO (assíncrono) ---")
+    return {"answer": final_answer, "source_documents": final_context_docs}
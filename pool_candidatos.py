@@ -0,0 +1,139 @@
+import asyncio
+import inspect
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from retriever_hibrido import documento_hibrido, executor_pernas, fundir_rrf
+from memo_embeddings import MemoDeEmbeddings, vectorstore_com_memo
+from servico_rerank import obter_servico_rerank
+
+PESOS_HIBRIDO = (0.5, 0.5)  # BM25, FAISS
+
+class PoolDeCandidatos:
+    """
+    Estágios de recuperação comuns aos motores para uma mesma pergunta, executados uma
+    única vez e compartilhados entre threads: embedding da pergunta e buscas BM25/FAISS
+    base (e a fusão RRF das duas). As notas de re-ranking vêm do ServicoRerank.
+
+    Como a nota depende só do par (pergunta, trecho), o motor conselho pode pontuar a
+    união dos candidatos de todos os motores numa única chamada e cada motor depois pega
+    o seu top_n do cache de notas. Um motor chamado isoladamente usa um pool próprio,
+    com o mesmo resultado do pipeline original.
+
+    `self.vectorstore` embute as consultas pelo MemoDeEmbeddings do pool: buscas dos
+    motores com a mesma string (ou por vetor) não voltam à API de embeddings.
+
+    Os métodos `a*` são as versões assíncronas, com o mesmo memo: o embedding é aguardado
+    no event loop e as buscas e o re-ranking (CPU ou cliente síncrono) rodam em threads.
+    """
+
+    def __init__(self, question: str, vectorstore: Any, bm25_retriever_full: Any):
+        self.question = question
+        self.memo = MemoDeEmbeddings(vectorstore.embeddings)
+        self.vectorstore = vectorstore_com_memo(vectorstore, self.memo)
+        self.bm25_retriever_full = bm25_retriever_full
+        self._lock = threading.Lock()
+        self._locks_por_chave: Dict[Any, threading.Lock] = {}
+        self._memo: Dict[Any, Any] = {}
+
+    def _uma_vez(self, chave: Any, funcao: Callable[[], Any]) -> Any:
+        with self._lock:
+            if chave in self._memo:
+                return self._memo[chave]
+            lock_chave = self._locks_por_chave.setdefault(chave, threading.Lock())
+        with lock_chave:
+            if chave not in self._memo:
+                self._memo[chave] = funcao()
+            return self._memo[chave]
+
+    def vetor_pergunta(self) -> List[float]:
+        return self.memo.embed_query(self.question)
+
+    def ids_bm25(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self._uma_vez(("bm25", k), lambda: self.bm25_retriever_full.indice.buscar(self.question, k))
+
+    def ids_faiss(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self._uma_vez(("faiss", k), lambda: self.vectorstore.buscar_ids(self.vetor_pergunta(), k))
+
+    def busca_bm25(self, k: int) -> List[Document]:
+        return [self.bm25_retriever_full.docs[int(i)] for i in self.ids_bm25(k)[0]]
+
+    def busca_faiss(self, k: int, filtro: Optional[Dict[str, Any]] = None) -> List[Document]:
+        if filtro is not None:
+            return self.vectorstore.similarity_search_by_vector(self.vetor_pergunta(), k=k, filter=filtro)
+        docstore, ids_docstore = self.vectorstore.docstore, self.vectorstore.index_to_docstore_id
+        return [docstore.search(ids_docstore[int(i)]) for i in self.ids_faiss(k)[0]]
+
+    def busca_hibrida(self, k: int) -> List[Document]:
+        """Fusão RRF (como o RetrieverHibrido) das pernas BM25 e FAISS já buscadas pelo pool, k em cada."""
+        def fundir():
+            futuro_bm25 = executor_pernas.submit(self.ids_bm25, k)
+            ids_faiss = self.ids_faiss(k)[0]
+            return fundir_rrf([futuro_bm25.result()[0], ids_faiss], PESOS_HIBRIDO)
+        ids, notas = self._uma_vez(("hibrida", k), fundir)
+        return self._documentos_hibridos(ids, notas)
+
+    async def avetor_pergunta(self) -> List[float]:
+        return await self.memo.aembed_query(self.question)
+
+    async def aids_bm25(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return await asyncio.get_running_loop().run_in_executor(executor_pernas, self.ids_bm25, k)
+
+    async def aids_faiss(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        vetor = await self.avetor_pergunta()
+        return await asyncio.get_running_loop().run_in_executor(
+            executor_pernas, self._uma_vez, ("faiss", k), lambda: self.vectorstore.buscar_ids(vetor, k))
+
+    async def abusca_bm25(self, k: int) -> List[Document]:
+        return [self.bm25_retriever_full.docs[int(i)] for i in (await self.aids_bm25(k))[0]]
+
+    async def abusca_faiss(self, k: int, filtro: Optional[Dict[str, Any]] = None) -> List[Document]:
+        if filtro is not None:
+            vetor = await self.avetor_pergunta()
+            return await asyncio.to_thread(self.vectorstore.similarity_search_by_vector, vetor, k=k, filter=filtro)
+        docstore, ids_docstore = self.vectorstore.docstore, self.vectorstore.index_to_docstore_id
+        return [docstore.search(ids_docstore[int(i)]) for i in (await self.aids_faiss(k))[0]]
+
+    async def abusca_hibrida(self, k: int) -> List[Document]:
+        (ids_bm25, _), (ids_faiss, _) = await asyncio.gather(self.aids_bm25(k), self.aids_faiss(k))
+        ids, notas = self._uma_vez(("hibrida", k), lambda: fundir_rrf([ids_bm25, ids_faiss], PESOS_HIBRIDO))
+        return self._documentos_hibridos(ids, notas)
+
+    def _documentos_hibridos(self, ids: np.ndarray, notas: np.ndarray) -> List[Document]:
+        return [documento_hibrido(self.bm25_retriever_full.docs[int(i)], nota) for i, nota in zip(ids, notas)]
+
+    def pontuar(self, docs: List[Document]):
+        """Pontua os trechos pelo serviço de rerank (uma chamada para os que não estão no cache)."""
+        if docs:
+            obter_servico_rerank().pontuar(docs, self.question)
+
+    def reranquear(self, docs: List[Document], top_n: int) -> List[Document]:
+        """Os `top_n` melhores trechos de `docs`, com `relevance_score` nos metadados."""
+        return obter_servico_rerank().reranquear(docs, self.question, top_n)
+
+    async def apontuar(self, docs: List[Document]):
+        await asyncio.to_thread(self.pontuar, docs)
+
+    async def areranquear(self, docs: List[Document], top_n: int) -> List[Document]:
+        return await asyncio.to_thread(self.reranquear, docs, top_n)
+
+    def montar_contexto(self, estado: Dict[str, Any], montar: Callable) -> List[Document]:
+        """
+        Contexto final a partir do estado de um `buscar_candidatos_vX`: o da busca direta
+        ({"contexto": docs}) ou o `montar(estado, reranked)` sobre o top_n dos candidatos.
+        """
+        if "contexto" in estado:
+            return estado["contexto"]
+        if not estado["candidatos"]: return []
+        return montar(estado, self.reranquear(estado["candidatos"], estado["top_n"]))
+
+    async def amontar_contexto(self, estado: Dict[str, Any], montar: Callable) -> List[Document]:
+        """Versão assíncrona de `montar_contexto`; `montar` pode ser síncrono ou uma corrotina."""
+        if "contexto" in estado:
+            return estado["contexto"]
+        if not estado["candidatos"]: return []
+        contexto = montar(estado, await self.areranquear(estado["candidatos"], estado["top_n"]))
+        return await contexto if inspect.isawaitable(contexto) else contexto
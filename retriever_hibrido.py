@@ -0,0 +1,134 @@
+import asyncio
+import concurrent.futures
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from armazem_chunks import montar_texto_com_cabecalho
+
+RRF_C = 60  # mesma constante do EnsembleRetriever
+MODOS_FUSAO = ("rrf", "pesos")
+
+# As pernas BM25 rodam aqui enquanto a thread chamadora embute a consulta e busca no FAISS.
+executor_pernas = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="hibrido")
+
+def _candidatos(ids_por_perna: Sequence[np.ndarray]) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Ids distintos na ordem da primeira aparição (BM25 antes de FAISS) e a posição de cada perna neles."""
+    todos = np.concatenate([np.asarray(ids, dtype=np.int64) for ids in ids_por_perna]) if ids_por_perna else np.empty(0, dtype=np.int64)
+    unicos, primeira, inverso = np.unique(todos, return_index=True, return_inverse=True)
+    ordem = np.argsort(primeira, kind="stable")
+    posicao = np.empty(len(unicos), dtype=np.int64)
+    posicao[ordem] = np.arange(len(unicos))
+    fatias = np.cumsum([0] + [len(ids) for ids in ids_por_perna])
+    return unicos[ordem], [posicao[inverso[fatias[i]:fatias[i + 1]]] for i in range(len(ids_por_perna))]
+
+def fundir_rrf(ids_por_perna: Sequence[np.ndarray], pesos: Sequence[float], c: int = RRF_C) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reciprocal Rank Fusion ponderado, como o EnsembleRetriever (inclusive no desempate,
+    que segue a ordem de aparição). Notas divididas pelo máximo possível, sum(pesos)/(1+c),
+    ficando em [0, 1]: 1 = primeiro lugar em todas as pernas.
+    """
+    ids, posicoes = _candidatos(ids_por_perna)
+    notas = np.zeros(len(ids), dtype=np.float64)
+    for posicao, peso in zip(posicoes, pesos):
+        notas[posicao] += peso / (np.arange(1, len(posicao) + 1) + c)
+    notas /= sum(pesos) / (1 + c)
+    ordem = np.argsort(-notas, kind="stable")
+    return ids[ordem], notas[ordem]
+
+def fundir_por_pesos(ids_por_perna: Sequence[np.ndarray], notas_por_perna: Sequence[np.ndarray], pesos: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Média ponderada das notas já calibradas em [0, 1] de cada perna (0 para quem a perna não trouxe)."""
+    ids, posicoes = _candidatos(ids_por_perna)
+    notas = np.zeros(len(ids), dtype=np.float64)
+    for posicao, notas_perna, peso in zip(posicoes, notas_por_perna, pesos):
+        notas[posicao] += peso * np.asarray(notas_perna, dtype=np.float64)
+    notas /= sum(pesos)
+    ordem = np.argsort(-notas, kind="stable")
+    return ids[ordem], notas[ordem]
+
+def documento_hibrido(doc: Document, nota: float) -> Document:
+    """
+    Resultado da fusão: texto com o cabeçalho de norma/artigo da indexação vetorial (como
+    os acertos do FAISS no EnsembleRetriever), para o re-ranking e o prompt citarem a norma.
+    """
+    return Document(page_content=montar_texto_com_cabecalho(doc), metadata={**doc.metadata, "score_hibrido": float(nota)})
+
+def calibrar_bm25(scores: np.ndarray) -> np.ndarray:
+    """BM25 não tem escala absoluta: normaliza pelo maior score da consulta."""
+    scores = np.asarray(scores, dtype=np.float64)
+    maximo = scores.max() if len(scores) else 0.0
+    return scores / maximo if maximo > 0 else np.zeros_like(scores)
+
+def calibrar_distancias(distancias: np.ndarray) -> np.ndarray:
+    """Distância L2² entre vetores normalizados -> similaridade de cosseno (1 - d/2), limitada a [0, 1]."""
+    return np.clip(1.0 - np.asarray(distancias, dtype=np.float64) / 2.0, 0.0, 1.0)
+
+class RetrieverHibrido(BaseRetriever):
+    """
+    Busca híbrida BM25 + FAISS sobre ids de chunk (`original_index`) e arrays NumPy,
+    no lugar do EnsembleRetriever. As duas pernas rodam em paralelo, a fusão é vetorizada
+    (RRF ou média ponderada de notas calibradas) e só os Documents do resultado final são
+    materializados, a partir de `docs`, com o cabeçalho da norma no texto (documento_hibrido)
+    e a nota fundida em `metadata["score_hibrido"]`.
+
+    `bm25` é um RetrieverBM25Compacto (completo ou `filtrado`); `filtro` restringe a
+    perna FAISS, como o `search_kwargs['filter']` do as_retriever.
+
+    No `ainvoke`, o embedding da consulta é aguardado no event loop e as duas buscas
+    (CPU) rodam em threads, em paralelo.
+    """
+    vectorstore: Any
+    bm25: Any
+    docs: Any
+    k: int = 4
+    pesos: Tuple[float, float] = (0.5, 0.5)
+    modo: str = "rrf"
+    filtro: Optional[Dict[str, Any]] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _perna_faiss(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        return self._perna_faiss_por_vetor(self.vectorstore.embeddings.embed_query(query))
+
+    def _perna_faiss_por_vetor(self, embedding: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+        resultado = self.vectorstore.buscar_ids(embedding, self.k, filter=self.filtro)
+        if resultado is None:
+            # Filtro fora do IndiceMetadados: pós-filtro padrão do LangChain.
+            pares = self.vectorstore.similarity_search_with_score_by_vector(embedding, k=self.k, filter=self.filtro)
+            return (np.array([doc.metadata["original_index"] for doc, _ in pares], dtype=np.int64),
+                    np.array([d for _, d in pares], dtype=np.float32))
+        return resultado
+
+    def buscar_ids(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, notas fundidas em [0, 1]) em ordem decrescente de nota."""
+        futuro_bm25 = executor_pernas.submit(self.bm25.indice.buscar, query, self.k)
+        ids_faiss, distancias = self._perna_faiss(query)
+        return self._fundir(futuro_bm25.result(), (ids_faiss, distancias))
+
+    async def abuscar_ids(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        loop = asyncio.get_running_loop()
+        futuro_bm25 = loop.run_in_executor(executor_pernas, self.bm25.indice.buscar, query, self.k)
+        embedding = await self.vectorstore.embeddings.aembed_query(query)
+        perna_faiss = await loop.run_in_executor(executor_pernas, self._perna_faiss_por_vetor, embedding)
+        return self._fundir(await futuro_bm25, perna_faiss)
+
+    def _fundir(self, perna_bm25: Tuple[np.ndarray, np.ndarray], perna_faiss: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        (ids_bm25, scores_bm25), (ids_faiss, distancias) = perna_bm25, perna_faiss
+        if self.modo == "pesos":
+            return fundir_por_pesos([ids_bm25, ids_faiss], [calibrar_bm25(scores_bm25), calibrar_distancias(distancias)], self.pesos)
+        if self.modo != "rrf":
+            raise ValueError(f"Modo de fusão inválido: '{self.modo}'. Opções: {', '.join(MODOS_FUSAO)}.")
+        return fundir_rrf([ids_bm25, ids_faiss], self.pesos)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self._materializar(*self.buscar_ids(query))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return self._materializar(*await self.abuscar_ids(query))
+
+    def _materializar(self, ids: np.ndarray, notas: np.ndarray) -> List[Document]:
+        return [documento_hibrido(self.docs[int(i)], nota) for i, nota in zip(ids, notas)]
@@ -0,0 +1,213 @@
+import os
+import re
+import math
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from clientes_llm import OPCOES_REQUISICAO_COHERE, TIMEOUT_HTTP_SEGUNDOS, limitador
+
+BACKEND_RERANK = os.getenv("RERANK_BACKEND", "cohere")  # cohere | cross-encoder | lexico
+MODELO_RERANK = os.getenv("RERANK_MODELO", "rerank-multilingual-v3.0")
+MODELO_CROSS_ENCODER = os.getenv("RERANK_MODELO_LOCAL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+MAX_ENTRADAS_CACHE_RERANK = int(os.getenv("RERANK_CACHE_MAX_ENTRADAS", "200000"))
+JANELA_LOTE_SEGUNDOS = float(os.getenv("RERANK_JANELA_MS", "15")) / 1000
+
+# --- BACKENDS ---
+
+class BackendCohere:
+    """
+    Rerank da Cohere pelo SDK (o CohereRerank do LangChain não repassa `request_options`).
+    Um único cliente por processo; as chamadas passam pelo limitador do provedor "cohere",
+    com as retentativas do SDK desligadas.
+    """
+
+    def __init__(self, modelo: str = MODELO_RERANK):
+        import cohere
+        self.modelo = modelo
+        self._cliente = cohere.ClientV2(api_key=os.getenv("COHERE_API_KEY"), timeout=TIMEOUT_HTTP_SEGUNDOS)
+
+    def pontuar(self, consulta: str, textos: List[str]) -> List[float]:
+        notas = [0.0] * len(textos)
+        resposta = limitador("cohere").chamar(lambda: self._cliente.rerank(
+            model=self.modelo, query=consulta, documents=textos, top_n=len(textos), request_options=OPCOES_REQUISICAO_COHERE))
+        for resultado in resposta.results:
+            notas[resultado.index] = resultado.relevance_score
+        return notas
+
+class BackendCrossEncoder:
+    """Cross-encoder local (CPU) via sentence-transformers; nota = sigmoide do logit."""
+
+    def __init__(self, modelo: str = MODELO_CROSS_ENCODER):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("RERANK_BACKEND=cross-encoder requer o pacote 'sentence-transformers'.") from e
+        self.modelo = modelo
+        self._modelo = CrossEncoder(modelo)
+
+    def pontuar(self, consulta: str, textos: List[str]) -> List[float]:
+        logits = self._modelo.predict([(consulta, texto) for texto in textos])
+        return [1 / (1 + math.exp(-float(x))) for x in logits]
+
+def _termos(texto: str) -> List[str]:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.findall(r"\w+", texto)
+
+class BackendLexico:
+    """
+    Pontuação local e sem dependências, para uso offline e em testes: cobertura dos termos
+    da consulta no trecho, ponderada pelo tamanho do termo (termos curtos pesam menos).
+    Só depende do par (consulta, trecho), como as notas dos outros backends.
+    """
+    modelo = "lexico-v1"
+
+    def pontuar(self, consulta: str, textos: List[str]) -> List[float]:
+        termos_consulta = {t: math.log(1 + len(t)) for t in set(_termos(consulta))}
+        total = sum(termos_consulta.values()) or 1.0
+        notas = []
+        for texto in textos:
+            termos_texto = set(_termos(texto))
+            notas.append(sum(peso for t, peso in termos_consulta.items() if t in termos_texto) / total)
+        return notas
+
+BACKENDS = {"cohere": BackendCohere, "cross-encoder": BackendCrossEncoder, "lexico": BackendLexico}
+
+# --- SERVIÇO ---
+
+def _chave_documento(doc: Document) -> Any:
+    """(`original_index`, hash do texto): versões do mesmo chunk com e sem cabeçalho têm notas próprias."""
+    return (doc.metadata.get("original_index"), hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest())
+
+class _Lote:
+    def __init__(self):
+        self.textos: Dict[Any, str] = {}
+        self.notas: Dict[Any, float] = {}
+        self.erro: Optional[Exception] = None
+        self.pronto = threading.Event()
+
+class ServicoRerank:
+    """
+    Re-ranking com cache de notas e agrupamento de chamadas concorrentes.
+
+    - Cache: (modelo, hash da consulta, `original_index` e hash do texto) -> nota, com
+      remoção LRU. A nota depende só do par (consulta, trecho), então serve a qualquer
+      motor e às perguntas seguintes da conversa.
+    - Lotes: pedidos simultâneos com o mesmo modelo e consulta são unidos. A primeira
+      thread abre o lote e faz uma única chamada ao backend; trechos já em voo num lote
+      não são enviados de novo. Só quando há outros pedidos em andamento ela espera
+      `janela_segundos` por mais trechos; um pedido sozinho não paga a janela.
+    """
+
+    def __init__(self, backend: Any, max_entradas: int = MAX_ENTRADAS_CACHE_RERANK, janela_segundos: float = JANELA_LOTE_SEGUNDOS):
+        self.backend = backend
+        self.max_entradas = max_entradas
+        self.janela_segundos = janela_segundos
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str, Any], float]" = OrderedDict()
+        self._lotes_abertos: Dict[Tuple[str, str], _Lote] = {}
+        self._em_voo: Dict[Tuple[str, str, Any], _Lote] = {}
+        self._ativos = 0
+
+    def pontuar(self, docs: List[Document], consulta: str) -> List[float]:
+        """Notas de `docs` para `consulta`, na mesma ordem."""
+        with self._lock:
+            self._ativos += 1
+        try:
+            return self._pontuar(docs, consulta)
+        finally:
+            with self._lock:
+                self._ativos -= 1
+
+    def _pontuar(self, docs: List[Document], consulta: str) -> List[float]:
+        chave_consulta = (self.backend.modelo, hashlib.sha256(consulta.encode("utf-8")).hexdigest())
+        chaves = [_chave_documento(doc) for doc in docs]
+        conjunto_chaves = set(chaves)
+        notas: Dict[Any, float] = {}
+        aguardar: List[_Lote] = []
+        lider, concorrido = None, False
+        with self._lock:
+            for chave, doc in zip(chaves, docs):
+                chave_cache = chave_consulta + (chave,)
+                if chave in notas: continue
+                if chave_cache in self._cache:
+                    self._cache.move_to_end(chave_cache)
+                    notas[chave] = self._cache[chave_cache]
+                elif chave_cache in self._em_voo:
+                    aguardar.append(self._em_voo[chave_cache])
+                else:
+                    lote = self._lotes_abertos.get(chave_consulta)
+                    if lote is None:
+                        lote = lider = self._lotes_abertos[chave_consulta] = _Lote()
+                        concorrido = self._ativos > 1
+                    lote.textos[chave] = doc.page_content
+                    self._em_voo[chave_cache] = lote
+                    aguardar.append(lote)
+
+        if lider is not None:
+            if concorrido and self.janela_segundos > 0:
+                time.sleep(self.janela_segundos)
+            with self._lock:
+                del self._lotes_abertos[chave_consulta]
+                chaves_lote = list(lider.textos)
+            try:
+                print(f"-> Re-ranking ({self.backend.modelo}): {len(chaves_lote)} trechos numa única chamada.")
+                lider.notas = dict(zip(chaves_lote, self.backend.pontuar(consulta, [lider.textos[c] for c in chaves_lote])))
+            except Exception as e:
+                lider.erro = e
+            finally:
+                with self._lock:
+                    for chave in chaves_lote:
+                        self._em_voo.pop(chave_consulta + (chave,), None)
+                        if chave in lider.notas:
+                            self._cache[chave_consulta + (chave,)] = lider.notas[chave]
+                    while len(self._cache) > self.max_entradas:
+                        self._cache.popitem(last=False)
+                lider.pronto.set()
+
+        for lote in dict.fromkeys(aguardar):
+            lote.pronto.wait()
+            if lote.erro is not None:
+                raise lote.erro
+            notas.update({c: n for c, n in lote.notas.items() if c in conjunto_chaves})
+        return [notas[chave] for chave in chaves]
+
+    def notas_em_cache(self, docs: List[Document], consulta: str) -> List[Optional[float]]:
+        """Notas já conhecidas de `docs` para `consulta` (None para as que não estão no cache), sem chamar o backend."""
+        chave_consulta = (self.backend.modelo, hashlib.sha256(consulta.encode("utf-8")).hexdigest())
+        with self._lock:
+            return [self._cache.get(chave_consulta + (_chave_documento(doc),)) for doc in docs]
+
+    def reranquear(self, docs: List[Document], consulta: str, top_n: int) -> List[Document]:
+        """
+        Mesmo contrato do `CohereRerank.compress_documents`: os `top_n` trechos mais
+        relevantes, em ordem decrescente, com `relevance_score` nos metadados.
+        """
+        por_chave: Dict[Any, Document] = {}
+        for doc in docs:
+            por_chave.setdefault(_chave_documento(doc), doc)
+        unicos = list(por_chave.values())
+        if not unicos:
+            return []
+        notas = self.pontuar(unicos, consulta)
+        ordem = sorted(range(len(unicos)), key=lambda i: notas[i], reverse=True)[:top_n]
+        return [Document(page_content=unicos[i].page_content, metadata={**unicos[i].metadata, "relevance_score": notas[i]}) for i in ordem]
+
+_servico: Optional[ServicoRerank] = None
+_lock_servico = threading.Lock()
+
+def obter_servico_rerank() -> ServicoRerank:
+    """Serviço do processo, com o backend escolhido em RERANK_BACKEND."""
+    global _servico
+    with _lock_servico:
+        if _servico is None:
+            if BACKEND_RERANK not in BACKENDS:
+                raise ValueError(f"RERANK_BACKEND inválido: '{BACKEND_RERANK}'. Opções: {', '.join(BACKENDS)}.")
+            _servico = ServicoRerank(BACKENDS[BACKEND_RERANK]())
+        return _servico
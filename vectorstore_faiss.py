@@ -0,0 +1,307 @@
+import os
+import json
+import operator
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from armazem_chunks import ArmazemDeChunks, montar_texto_com_cabecalho
+from indice_metadados import IndiceMetadados
+from artefatos_versionados import gravacao_versionada, resolver_versao
+
+ARQUIVO_INDICE_FAISS = "index.faiss"
+ARQUIVO_VETORES = "vetores.npy"      # vetores normalizados em float32, na ordem de `original_index`
+ARQUIVO_INFO_INDICE = "indice.json"
+TIPO_INDICE_PADRAO = os.getenv("FAISS_TIPO_INDICE", "flat")
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "32"))          # listas visitadas por busca nos índices IVF
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "128"))   # tamanho da fila de busca nos índices HNSW
+MAX_VETORES_TREINO = 100_000
+MIN_PONTOS_POR_CENTROIDE = 39   # abaixo disso o k-means do faiss só avisa, e o índice sai mal treinado
+# Busca em dois estágios (Matryoshka): os embeddings text-embedding-3 podem ser encurtados
+# (primeiras dimensões, renormalizadas). Um índice grosso com DIMENSAO_GROSSA dimensões, do
+# mesmo FAISS_TIPO_INDICE do índice principal, traz FATOR_CANDIDATOS * k candidatos,
+# re-pontuados exatamente com os vetores completos.
+ARQUIVO_INDICE_GROSSO = "index_grosso.faiss"
+DIMENSAO_GROSSA = int(os.getenv("FAISS_DIMENSAO_GROSSA", "256"))   # 0 desliga o índice grosso
+FATOR_CANDIDATOS = int(os.getenv("FAISS_FATOR_CANDIDATOS", "10"))
+MIN_CANDIDATOS = int(os.getenv("FAISS_MIN_CANDIDATOS", "200"))
+# Modo opcional: a busca sem filtro só passa pelo índice grosso com FAISS_BUSCA_DOIS_ESTAGIOS=1.
+# O padrão é a busca no índice principal até o recall ser medido em perguntas reais.
+BUSCA_DOIS_ESTAGIOS = os.getenv("FAISS_BUSCA_DOIS_ESTAGIOS", "0") == "1"
+
+class DocstoreDoArmazem(Docstore):
+    """
+    Docstore somente-leitura sobre o ArmazemDeChunks: o id de cada documento é o seu
+    `original_index`. Devolve o texto com o mesmo cabeçalho usado na indexação, sem
+    manter uma segunda cópia do corpus em memória.
+    """
+
+    def __init__(self, armazem: ArmazemDeChunks):
+        self.armazem = armazem
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            doc = self.armazem[int(search)]
+        except (ValueError, IndexError):
+            return f"ID {search} not found."
+        return Document(page_content=montar_texto_com_cabecalho(doc), metadata=doc.metadata)
+
+class _MapeamentoPosicional(Mapping):
+    """index_to_docstore_id implícito: a posição i no FAISS corresponde ao documento 'i'."""
+
+    def __init__(self, n: int):
+        self._n = n
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < self._n:
+            raise KeyError(i)
+        return str(i)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._n))
+
+    def __len__(self) -> int:
+        return self._n
+
+class FAISSPreFiltrado(FAISS):
+    """
+    FAISS que resolve filtros de metadados pelo IndiceMetadados antes da busca: os ids
+    permitidos são conhecidos de antemão e a busca exata é feita só sobre eles, em vez
+    do pós-filtro do LangChain (que busca `fetch_k` no corpus todo e pode devolver
+    menos de k documentos para normas pequenas). Filtros que o índice não cobre caem
+    no comportamento padrão.
+
+    Com `indice_grosso` e `vetores`, as buscas sem filtro são feitas em dois estágios:
+    candidatos pelo índice grosso (embeddings encurtados) e re-pontuação exata.
+    """
+
+    def __init__(self, *args, indice_metadados: Optional[IndiceMetadados] = None, vetores: Optional[np.ndarray] = None,
+                 indice_grosso: Optional[Any] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.indice_metadados = indice_metadados
+        self.vetores = vetores
+        self.indice_grosso = indice_grosso
+
+    @property
+    def dois_estagios(self) -> bool:
+        return BUSCA_DOIS_ESTAGIOS and self.indice_grosso is not None and self.vetores is not None
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[Any] = None,
+                                               fetch_k: int = 20, **kwargs: Any) -> List[Tuple[Document, float]]:
+        if isinstance(filter, dict) and self.indice_metadados is not None:
+            ids_permitidos = self.indice_metadados.ids_para_filtro(filter)
+            if ids_permitidos is not None:
+                return self.busca_no_subconjunto(embedding, k, ids_permitidos, **kwargs)
+        if filter is None and self.dois_estagios:
+            return self._documentos(*self.buscar_ids(embedding, k), **kwargs)
+        return super().similarity_search_with_score_by_vector(embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs)
+
+    def buscar_ids(self, embedding: List[float], k: int, filter: Optional[Dict[str, Any]] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Busca por vetor devolvendo (ids, distâncias L2 ao quadrado), sem materializar
+        Documents. Retorna None se o filtro não puder ser resolvido pelo IndiceMetadados.
+        """
+        if filter:
+            ids_permitidos = self.indice_metadados.ids_para_filtro(filter) if self.indice_metadados is not None else None
+            if ids_permitidos is None:
+                return None
+            return self.buscar_ids_no_subconjunto(embedding, k, ids_permitidos)
+        if k <= 0 or self.index.ntotal == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        vetor = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vetor)
+        if self.dois_estagios:
+            return busca_dois_estagios(vetor, k, self.indice_grosso, self.vetores)
+        distancias, indices = self.index.search(vetor, min(k, self.index.ntotal))
+        validos = indices[0] != -1
+        return indices[0][validos].astype(np.int64), distancias[0][validos]
+
+    def buscar_ids_no_subconjunto(self, embedding: List[float], k: int, ids_permitidos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca exata (distância L2 ao quadrado, como o IndexFlatL2) restrita a `ids_permitidos`.
+        Usa os vetores originais (`vetores.npy`) quando disponíveis, então o resultado não
+        depende da compressão do índice.
+        """
+        ids_permitidos = np.asarray(ids_permitidos, dtype=np.int64)
+        if len(ids_permitidos) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        vetor = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vetor)
+        try:
+            if self.vetores is not None:
+                candidatos = np.asarray(self.vetores[ids_permitidos], dtype=np.float32)
+            else:
+                candidatos = self.index.reconstruct_batch(ids_permitidos)
+        except RuntimeError:
+            # Índices sem reconstrução: o FAISS filtra por id durante a busca.
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids_permitidos))
+            distancias, indices = self.index.search(vetor, min(k, len(ids_permitidos)), params=params)
+            validos = indices[0] != -1
+            return indices[0][validos], distancias[0][validos]
+        return k_mais_proximos(vetor, k, ids_permitidos, candidatos)
+
+    def busca_no_subconjunto(self, embedding: List[float], k: int, ids_permitidos: np.ndarray, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self._documentos(*self.buscar_ids_no_subconjunto(embedding, k, ids_permitidos), **kwargs)
+
+    def _documentos(self, ids: np.ndarray, distancias: np.ndarray, **kwargs: Any) -> List[Tuple[Document, float]]:
+        docs = [(self.docstore.search(self.index_to_docstore_id[int(i)]), float(d)) for i, d in zip(ids, distancias)]
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            docs = [(doc, d) for doc, d in docs if operator.le(d, score_threshold)]
+        return docs
+
+def k_mais_proximos(vetor: np.ndarray, k: int, ids: np.ndarray, vetores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Os k de `ids` mais próximos de `vetor` (distância L2 ao quadrado exata), em ordem crescente."""
+    distancias = ((vetores - vetor) ** 2).sum(axis=1)
+    k = min(k, len(ids))
+    melhores = np.argpartition(distancias, k - 1)[:k] if k < len(distancias) else np.arange(len(distancias))
+    melhores = melhores[np.argsort(distancias[melhores], kind="stable")]
+    return ids[melhores], distancias[melhores]
+
+def busca_dois_estagios(vetor: np.ndarray, k: int, indice_grosso: Any, vetores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Candidatos pelo índice grosso (vetores encurtados) e os k melhores pela distância exata
+    nos vetores completos. `vetor` já normalizado, com shape (1, d).
+    """
+    n_candidatos = min(max(k * FATOR_CANDIDATOS, MIN_CANDIDATOS), indice_grosso.ntotal)
+    _, candidatos = indice_grosso.search(encurtar_vetores(vetor, indice_grosso.d), n_candidatos)
+    candidatos = np.sort(candidatos[0][candidatos[0] != -1])  # leitura sequencial do vetores.npy mapeado
+    return k_mais_proximos(vetor, k, candidatos, np.asarray(vetores[candidatos], dtype=np.float32))
+
+def fabrica_do_tipo(tipo: str, dimensao: int, n_vetores: int) -> str:
+    """
+    String do `faiss.index_factory` para cada tipo de índice suportado (memória por vetor
+    de 3072 dimensões entre parênteses). Qualquer outro valor é usado como fábrica direta.
+
+    - flat: busca exaustiva em float32, a referência (12 KB)
+    - sq16: quantização escalar float16 (6 KB), recall praticamente igual ao flat
+    - sq8: quantização escalar int8 (3 KB)
+    - pq: quantização por produto, 8 bits por sub-vetor de 32 dimensões (96 B)
+    - hnsw: grafo HNSW sobre vetores SQ8, busca sublinear (3 KB + grafo)
+    - ivf: lista invertida com vetores SQ8; visita FAISS_NPROBE listas por busca (3 KB)
+
+    Os k-means do pq (2**bits centróides por sub-vetor) e do ivf (uma lista por centróide)
+    precisam de MIN_PONTOS_POR_CENTROIDE vetores de treino por centróide. Com menos
+    vetores, o pq usa códigos de 7 ou 6 bits e, abaixo disso, vira SQ8, assim como o ivf
+    que não teria ao menos 2 listas.
+    """
+    n_treino = min(n_vetores, MAX_VETORES_TREINO)
+    n_listas = int(min(4 * np.sqrt(n_vetores), n_treino // MIN_PONTOS_POR_CENTROIDE))
+    bits_pq = next((b for b in (8, 7, 6) if n_treino >= MIN_PONTOS_POR_CENTROIDE * 2 ** b), None)
+    sub_vetores = next(m for m in range(max(1, dimensao // 32), 0, -1) if dimensao % m == 0)
+    tipos = {
+        "flat": "Flat",
+        "sq16": "SQfp16",
+        "sq8": "SQ8",
+        "pq": f"PQ{sub_vetores}x{bits_pq}" if bits_pq else "SQ8",
+        "hnsw": "HNSW32,SQ8",
+        "ivf": f"IVF{n_listas},SQ8" if n_listas >= 2 else "SQ8",
+    }
+    return tipos.get(tipo, tipo)
+
+def construir_indice(vetores: np.ndarray, tipo: str = TIPO_INDICE_PADRAO):
+    """Constrói (e treina, se preciso) um índice do `tipo` pedido sobre vetores já normalizados."""
+    fabrica = fabrica_do_tipo(tipo, vetores.shape[1], len(vetores))
+    index = faiss.index_factory(vetores.shape[1], fabrica, faiss.METRIC_L2)
+    if not index.is_trained:
+        amostra = vetores
+        if len(vetores) > MAX_VETORES_TREINO:
+            amostra = vetores[np.sort(np.random.default_rng(0).choice(len(vetores), MAX_VETORES_TREINO, replace=False))]
+        try:
+            index.train(amostra)
+        except RuntimeError as e:
+            print(f"⚠️  Aviso: Não foi possível treinar o índice '{fabrica}' com {len(amostra)} vetores ({e}). Usando 'Flat'.")
+            fabrica = "Flat"
+            index = faiss.index_factory(vetores.shape[1], fabrica, faiss.METRIC_L2)
+    index.add(vetores)
+    return index, fabrica
+
+def encurtar_vetores(vetores: np.ndarray, dimensao: int) -> np.ndarray:
+    """Embedding Matryoshka encurtado: as primeiras `dimensao` coordenadas, renormalizadas."""
+    curtos = np.array(vetores[:, :dimensao], dtype=np.float32, order="C")  # cópia: normalize_L2 altera no lugar
+    faiss.normalize_L2(curtos)
+    return curtos
+
+def salvar_indice_faiss(vetores: np.ndarray, caminho: str, tipo: str = TIPO_INDICE_PADRAO, dimensao_grossa: int = DIMENSAO_GROSSA):
+    """
+    Grava o índice do `tipo` pedido com os vetores normalizados, na ordem de `original_index`,
+    e também os próprios vetores (`vetores.npy`), usados nas reconstruções incrementais e
+    na pontuação exata de subconjuntos, qualquer que seja a compressão do índice.
+    Com `dimensao_grossa` menor que a dimensão dos vetores, grava também o índice grosso
+    da busca em dois estágios: o mesmo `tipo` sobre os vetores encurtados. É ele que a
+    busca sem filtro percorre, então a compressão escolhida vale para os dois estágios.
+    """
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    faiss.normalize_L2(vetores)
+    index, fabrica = construir_indice(vetores, tipo)
+    if 0 < dimensao_grossa < vetores.shape[1]:
+        indice_grosso, fabrica_grossa = construir_indice(encurtar_vetores(vetores, dimensao_grossa), tipo)
+    else:
+        indice_grosso, dimensao_grossa, fabrica_grossa = None, 0, None
+    with gravacao_versionada(caminho) as destino:
+        np.save(os.path.join(destino, ARQUIVO_VETORES), vetores)
+        faiss.write_index(index, os.path.join(destino, ARQUIVO_INDICE_FAISS))
+        if indice_grosso is not None:
+            faiss.write_index(indice_grosso, os.path.join(destino, ARQUIVO_INDICE_GROSSO))
+        with open(os.path.join(destino, ARQUIVO_INFO_INDICE), "w", encoding="utf-8") as f:
+            json.dump({"tipo": tipo, "fabrica": fabrica, "dimensao": int(vetores.shape[1]), "n_vetores": len(vetores),
+                       "dimensao_grossa": dimensao_grossa, "fabrica_grossa": fabrica_grossa}, f)
+    return fabrica
+
+def ajustar_parametros_busca(index, nprobe: int = FAISS_NPROBE, ef_search: int = FAISS_EF_SEARCH):
+    """Aplica nprobe (IVF) e efSearch (HNSW) aos índices que os possuem."""
+    parametros = faiss.ParameterSpace()
+    for nome, valor in (("nprobe", nprobe), ("efSearch", ef_search)):
+        try:
+            parametros.set_index_parameter(index, nome, valor)
+        except RuntimeError:
+            pass  # o índice não tem esse parâmetro
+
+def carregar_indice_faiss(caminho: str):
+    index = faiss.read_index(os.path.join(resolver_versao(caminho), ARQUIVO_INDICE_FAISS))
+    ajustar_parametros_busca(index)
+    return index
+
+def carregar_vetores(caminho: str) -> Optional[np.ndarray]:
+    """Vetores normalizados da última construção, mapeados em memória (None em índices antigos)."""
+    arquivo = os.path.join(resolver_versao(caminho), ARQUIVO_VETORES)
+    return np.load(arquivo, mmap_mode="r") if os.path.exists(arquivo) else None
+
+def carregar_indice_grosso(caminho: str):
+    arquivo = os.path.join(resolver_versao(caminho), ARQUIVO_INDICE_GROSSO)
+    if not os.path.exists(arquivo):
+        return None
+    index = faiss.read_index(arquivo)
+    ajustar_parametros_busca(index)
+    return index
+
+def carregar_vectorstore(caminho: str, embeddings: Embeddings, armazem: ArmazemDeChunks,
+                         indice_metadados: Optional[IndiceMetadados] = None) -> FAISSPreFiltrado:
+    """Monta o vectorstore FAISS do LangChain usando o armazém de chunks como docstore."""
+    caminho = resolver_versao(caminho)  # as três cargas leem a mesma versão
+    index = carregar_indice_faiss(caminho)
+    vetores = carregar_vetores(caminho)
+    indice_grosso = carregar_indice_grosso(caminho)
+    if indice_grosso is not None and indice_grosso.ntotal != index.ntotal:
+        print("⚠️  Aviso: Índice grosso fora de sincronia com o FAISS. Busca em dois estágios desativada.")
+        indice_grosso = None
+    if index.ntotal != len(armazem):
+        raise RuntimeError(f"Índice FAISS ({index.ntotal} vetores) e armazém de chunks ({len(armazem)}) fora de sincronia. Reconstrua os índices.")
+    return FAISSPreFiltrado(
+        embedding_function=embeddings,
+        index=index,
+        docstore=DocstoreDoArmazem(armazem),
+        index_to_docstore_id=_MapeamentoPosicional(index.ntotal),
+        normalize_L2=True,
+        indice_metadados=indice_metadados,
+        vetores=vetores,
+        indice_grosso=indice_grosso,
+    )